@@ -15,52 +15,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import json
-import time
 from functools import total_ordering
 
-import asyncio
 from typing import Optional
 
 import eth_utils
 import logging
 import pkg_resources
 import sys
+import threading
 
 from web3 import Web3
 from web3.utils.events import get_event_data
 
+from api.batch import multi_call
+from api.cache import block_cache
+from api.gas import GasPrice, DefaultGasPrice
+from api.logs import LogPoller, LogScanner
 from api.numeric import Wad
+from api.receipts import ReceiptTracker
 from api.util import synchronize
 
-filter_threads = []
-
-
-def register_filter_thread(filter_thread):
-    filter_threads.append(filter_thread)
-
-
-def any_filter_thread_present() -> bool:
-    return len(filter_threads) > 0
-
-
-def all_filter_threads_alive() -> bool:
-    return all(filter_thread_alive(filter_thread) for filter_thread in filter_threads)
-
-
-def filter_thread_alive(filter_thread) -> bool:
-    # it's a wicked way of detecting whether a web3.py filter is still working
-    # but unfortunately I wasn't able to find any other one
-    return hasattr(filter_thread, '_args') and hasattr(filter_thread, '_kwargs') or not filter_thread.running
-
-
-def stop_all_filter_threads():
-    for filter_thread in filter_threads:
-        try:
-            filter_thread.stop_watching(timeout=60)
-        except:
-            pass
-
 
 @total_ordering
 class Address:
@@ -113,39 +90,42 @@ class Contract:
         receipt = web3.eth.getTransactionReceipt(tx_hash)
         return Address(receipt['contractAddress'])
 
+    def prefetch_immutables(self):
+        """Reads all values declared as `@immutable`, in one JSON-RPC batch if possible.
+
+        They will be served from memory from now on.
+        """
+        names = [name for name in dir(type(self)) if getattr(getattr(type(self), name), 'immutable', False)]
+        multi_call(self.web3, [getattr(self, name) for name in names])
+
     def _assert_contract_exists(self, web3, address):
         code = web3.eth.getCode(address.address)
         if (code == "0x") or (code is None):
             raise Exception(f"No contract found at {address}")
 
     def _wait_for_receipt(self, web3, transaction_hash):
-        while True:
-            receipt = web3.eth.getTransactionReceipt(transaction_hash)
-            if receipt is not None and receipt['blockNumber'] is not None:
-                return receipt
-            time.sleep(0.25)
+        receipt = ReceiptTracker.for_web3(web3).wait(transaction_hash)
+        block_cache.invalidate()
+        return receipt
 
     async def _async_wait_for_receipt(self, web3, transaction_hash):
-        while True:
-            receipt = web3.eth.getTransactionReceipt(transaction_hash)
-            if receipt is not None and receipt['blockNumber'] is not None:
-                return receipt
-            await asyncio.sleep(0.25)
+        receipt = await ReceiptTracker.for_web3(web3).async_wait(transaction_hash)
+        block_cache.invalidate()
+        return receipt
 
     def _on_event(self, contract, event, cls, handler):
-        register_filter_thread(contract.on(event, None, self._event_callback(cls, handler, False)))
+        log_poller = LogPoller.for_web3(contract.web3)
+        log_poller.subscribe_event(contract, event, self._event_callback(cls, handler, False))
+        log_poller.start()
 
     def _past_events(self, contract, event, cls, number_of_past_blocks) -> list:
         events = []
-
-        def handler(obj):
-            events.append(obj)
+        callback = self._event_callback(cls, events.append, True)
 
         block_number = contract.web3.eth.blockNumber
-        filter_params = {'fromBlock': block_number-number_of_past_blocks, 'toBlock': block_number-1}
-        thread = contract.pastEvents(event, filter_params, self._event_callback(cls, handler, True))
-        register_filter_thread(thread)
-        thread.join()
+        for log in LogScanner.for_web3(contract.web3).scan(contract, event, block_number-number_of_past_blocks,
+                                                           block_number-1):
+            callback(log)
         return events
 
     def _transact(self, web3, log_message, func):
@@ -290,6 +270,10 @@ class Receipt:
 class Transact:
     logger = logging.getLogger('api')
 
+    # simulations of the latest block seen, as (web3, block number, simulations) by `id(web3)`
+    _simulations = {}
+    _simulations_lock = threading.Lock()
+
     def __init__(self, origin, web3, abi, address, contract, function, parameters, extra=None):
         assert(isinstance(origin, object))
         assert(isinstance(web3, Web3))
@@ -308,11 +292,10 @@ class Transact:
         self.parameters = parameters
         self.extra = extra
 
-    async def _async_transact(self, web3, log_message, func):
+    async def _async_transact(self, log_message, gas_price, nonce_manager):
         try:
             self.logger.info(f"Transaction {log_message} in progress...")
-            tx_hash = func()
-            receipt = await self._async_prepare_receipt(web3, tx_hash)
+            receipt = self._prepare_receipt(await self._async_send_and_wait(log_message, gas_price, nonce_manager))
             if receipt:
                 self.logger.info(f"Transaction {log_message} was successful (tx_hash={receipt.transaction_hash})")
             else:
@@ -322,8 +305,51 @@ class Transact:
             self.logger.warning(f"Transaction {log_message} failed ({sys.exc_info()[1]})")
             return None
 
-    async def _async_prepare_receipt(self, web3, transaction_hash):
-        receipt = await self._async_wait_for_receipt(web3, transaction_hash)
+    async def _async_send_and_wait(self, log_message, gas_price, nonce_manager):
+        tracker = ReceiptTracker.for_web3(self.web3)
+        current_gas_price = gas_price.get_gas_price(0)
+        sent_at_block = self.web3.eth.blockNumber
+        nonce = self.extra.get('nonce') if self.extra is not None else None
+        if nonce is None and nonce_manager is not None:
+            nonce, transaction_hash = nonce_manager.send(lambda allocated: self._func(current_gas_price, allocated)())
+        else:
+            transaction_hash = self._func(current_gas_price)()
+
+        futures = {transaction_hash: asyncio.wrap_future(tracker.track(transaction_hash))}
+        try:
+            while True:
+                done, _ = await asyncio.wait(list(futures.values()), timeout=tracker.poll_interval,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if len(done) > 0:
+                    block_cache.invalidate()
+                    return done.pop().result()
+
+                blocks_pending = max((tracker.last_block_number or sent_at_block) - sent_at_block, 0)
+                new_gas_price = gas_price.get_gas_price(blocks_pending)
+                if current_gas_price is None or new_gas_price is None or new_gas_price <= current_gas_price:
+                    continue
+
+                current_gas_price = new_gas_price
+                try:
+                    if nonce is None:
+                        nonce = self.web3.eth.getTransaction(transaction_hash)['nonce']
+
+                    self.logger.info(f"Transaction {log_message} pending for {blocks_pending} blocks,"
+                                     f" replacing it with gas price {new_gas_price} (nonce={nonce})")
+                    transaction_hash = self._func(new_gas_price, nonce)()
+                except:
+                    # one of the previous transactions might have been mined in the meantime
+                    self.logger.warning(f"Replacing transaction {log_message} failed ({sys.exc_info()[1]})")
+                    continue
+
+                futures[transaction_hash] = asyncio.wrap_future(tracker.track(transaction_hash))
+        finally:
+            # the transactions which haven't been mined are not going to be anymore
+            for pending_hash in futures:
+                tracker.forget(pending_hash)
+
+    def _prepare_receipt(self, receipt):
+        transaction_hash = receipt['transactionHash']
         receipt_logs = receipt['logs']
         if (receipt_logs is not None) and (len(receipt_logs) > 0):
             transfers = []
@@ -340,30 +366,133 @@ class Transact:
         else:
             return None
 
-    async def _async_wait_for_receipt(self, web3, transaction_hash):
-        while True:
-            receipt = web3.eth.getTransactionReceipt(transaction_hash)
-            if receipt is not None and receipt['blockNumber'] is not None:
-                return receipt
-            await asyncio.sleep(0.25)
-
-    def _func(self):
-        return lambda: self.contract.transact(self.extra).__getattr__(self.function)(*self.parameters)
+    def _func(self, gas_price: Optional[int] = None, nonce: Optional[int] = None):
+        transaction = dict(self.extra) if self.extra is not None else {}
+        if gas_price is not None:
+            transaction['gasPrice'] = gas_price
+        if nonce is not None:
+            transaction['nonce'] = nonce
+        return lambda: self.contract.transact(transaction).__getattr__(self.function)(*self.parameters)
 
     def name(self) -> str:
         name = f"{repr(self.origin)}.{self.function}({self.parameters})"
         return name if self.extra is None else name + f" with {self.extra}"
 
-    def transact(self) -> Optional[Receipt]:
-        return synchronize([self.transact_async()])[0]
+    def transact(self, gas_price: GasPrice = DefaultGasPrice(), nonce_manager=None) -> Optional[Receipt]:
+        """Executes the transaction and waits for it to get mined.
+
+        Args:
+            gas_price: Gas price strategy. If it raises the gas price while the transaction is pending,
+                the transaction gets replaced with one with the same nonce and the new gas price.
+            nonce_manager: `NonceManager` to allocate the nonce of the transaction. If `None`, the node assigns it.
+
+        Returns:
+            A `Receipt` if the Ethereum transaction was successful.
+            `None` if the Ethereum transaction failed.
+        """
+        return synchronize([self.transact_async(gas_price, nonce_manager)])[0]
+
+    async def transact_async(self, gas_price: GasPrice = DefaultGasPrice(), nonce_manager=None) -> Optional[Receipt]:
+        """Executes the transaction and waits (asynchronously) for it to get mined.
 
-    async def transact_async(self) -> Optional[Receipt]:
-        return await self._async_transact(self.web3, self.name(), self._func())
+        Args:
+            gas_price: Gas price strategy. If it raises the gas price while the transaction is pending,
+                the transaction gets replaced with one with the same nonce and the new gas price.
+            nonce_manager: `NonceManager` to allocate the nonce of the transaction. If `None`, the node assigns it.
+
+        Returns:
+            A `Receipt` if the Ethereum transaction was successful.
+            `None` if the Ethereum transaction failed.
+        """
+        assert(isinstance(gas_price, GasPrice))
+        return await self._async_transact(self.name(), gas_price, nonce_manager)
 
     def invocation(self) -> Invocation:
         return Invocation(self.address,
                           Calldata(self.web3.eth.contract(abi=self.abi).encodeABI(self.function, self.parameters)))
 
+    def simulate(self) -> 'Simulation':
+        """Executes the transaction as an `eth_call` on top of the latest block, without sending it.
+
+        Lets keepers skip transactions which would fail anyway, without paying for the gas.
+        As the state only changes with new blocks, the outcome is memoized per calldata and block,
+        so simulating the same transaction again within one block costs only one `eth_blockNumber` request.
+
+        Returns:
+            A `Simulation` describing the outcome of the transaction.
+        """
+        invocation = self.invocation()
+        transaction = {'from': self.web3.eth.defaultAccount, **(self.extra or {}),
+                       'to': invocation.address.address, 'data': str(invocation.calldata)}
+        block_number = self.web3.eth.blockNumber
+        key = (invocation.address, invocation.calldata, transaction['from'], transaction.get('value', 0))
+
+        with Transact._simulations_lock:
+            _, simulations_block_number, simulations = Transact._simulations.get(id(self.web3), (None, None, {}))
+            if block_number == simulations_block_number and key in simulations:
+                return simulations[key]
+
+        simulation = self._simulate(transaction, block_number)
+
+        with Transact._simulations_lock:
+            _, simulations_block_number, simulations = Transact._simulations.get(id(self.web3), (None, None, {}))
+            # only the simulations on top of the latest block are worth keeping
+            if simulations_block_number is None or block_number > simulations_block_number:
+                simulations_block_number, simulations = block_number, {}
+                Transact._simulations[id(self.web3)] = (self.web3, simulations_block_number, simulations)
+            if block_number == simulations_block_number:
+                simulations[key] = simulation
+        return simulation
+
+    def _simulate(self, transaction: dict, block_number: int) -> 'Simulation':
+        try:
+            output = eth_utils.force_text(self.web3.eth.call(transaction, block_number))
+        except:
+            self.logger.debug(f"Simulation of {self.name()} failed ({sys.exc_info()[1]})")
+            return Simulation(block_number=block_number, successful=False, gas=None, output=None)
+
+        # some nodes return no data instead of an error if the call throws
+        if output in ['0x', ''] and self._has_outputs():
+            return Simulation(block_number=block_number, successful=False, gas=None, output=None)
+
+        try:
+            gas = self.web3.eth.estimateGas(transaction)
+        except:
+            return Simulation(block_number=block_number, successful=False, gas=None, output=None)
+
+        # some nodes return the block gas limit instead of an error if the transaction always fails
+        if gas >= self.web3.eth.getBlock(block_number)['gasLimit']:
+            return Simulation(block_number=block_number, successful=False, gas=None, output=None)
+
+        return Simulation(block_number=block_number, successful=True, gas=gas, output=output)
+
+    def _has_outputs(self) -> bool:
+        return any(len(abi.get('outputs', [])) > 0 for abi in self.abi
+                   if abi.get('type') == 'function' and abi.get('name') == self.function)
+
+
+class Simulation:
+    """Represents the outcome of a transaction executed as an `eth_call`, without being sent.
+
+    Attributes:
+        block_number: Number of the block the transaction has been executed on top of.
+        successful: Whether the transaction would have succeeded if mined in the next block.
+        gas: Estimated amount of gas the transaction would use. `None` if it would have failed.
+        output: Data returned by the contract method, as a hex string. `None` if it would have failed.
+    """
+    def __init__(self, block_number: int, successful: bool, gas: Optional[int], output: Optional[str]):
+        assert(isinstance(block_number, int))
+        assert(isinstance(successful, bool))
+        assert(isinstance(gas, int) or gas is None)
+        assert(isinstance(output, str) or output is None)
+        self.block_number = block_number
+        self.successful = successful
+        self.gas = gas
+        self.output = output
+
+    def __repr__(self):
+        return f"Simulation(block_number={self.block_number}, successful={self.successful}, gas={self.gas})"
+
 
 class Transfer:
     """Represents an ERC20 token transfer.
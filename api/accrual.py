@@ -0,0 +1,102 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from api.numeric import Wad, Ray, rdiv, rmul
+from api.sai import Tub, Tap, TubState
+
+
+class FeeProjection:
+    """Projects fee accruals of a `Tub` to any moment in the future, without calling it.
+
+    The stability fee (`tax`) accrues to `chi` and to the surplus (`joy`) only when someone calls `drip()`,
+    and the holder fee (`way`) accrues to `par` only when someone calls `prod()`. Until then `Tap.joy()`
+    and `Tub.ice()` keep returning stale values. The projection calculates the values these would have
+    at any given time, using the same formulas (and `rpow`) as the contracts.
+
+    `chi` and `par` are projected from their values as of `era`, `ice` and `joy` from their values as
+    of the last `drip()` (`rho`) and the total debt in internal units they correspond to. If the snapshot
+    was taken in the same second as the last `drip()` and `prod()`, the projected values are exactly the same
+    as the ones the contracts will calculate. Otherwise they can differ from them by a few wei, due to rounding
+    of the intermediate values.
+
+    Attributes:
+        state: The `TubState` snapshot the projection starts from.
+    """
+
+    def __init__(self, state: TubState):
+        assert(isinstance(state, TubState))
+        self.state = state
+
+    @classmethod
+    def read(cls, tub: Tub, tap: Tap) -> 'FeeProjection':
+        """Creates a projection starting from the current state of `tub` and `tap`."""
+        return cls(TubState.read(tub, tap))
+
+    def _age(self, timestamp: int, since: int) -> int:
+        assert(isinstance(timestamp, int))
+        assert(timestamp >= self.state.era)
+        return timestamp - since
+
+    def _accrues(self) -> bool:
+        # the stability fee stops accruing once the `Tub` has been caged
+        return self.state.reg == 0
+
+    def chi(self, timestamp: int) -> Ray:
+        """Returns the internal debt price (`chi`) as of `timestamp`."""
+        age = self._age(timestamp, self.state.era)
+        if not self._accrues():
+            return self.state.chi
+        return Ray(rmul(self.state.chi.value, self.state.tax.rpow(age).value))
+
+    def par(self, timestamp: int) -> Wad:
+        """Returns the accrued holder fee (`par`) as of `timestamp`."""
+        age = self._age(timestamp, self.state.era)
+        return Wad(rmul(self.state.par.value, self.state.way.rpow(age).value))
+
+    def _rum(self) -> int:
+        # the `Tub` keeps the total debt in internal units (`rum`), `ice` is `rmul(rum, chi)` as of the last `drip()`
+        chi, ice = self.state.chi.value, self.state.ice.value
+        if self.state.era > self.state.rho:
+            tax = self.state.tax.rpow(self.state.era - self.state.rho).value
+            chi = rdiv(chi, tax)
+        rum = rdiv(ice, chi)
+        return next((candidate for candidate in (rum, rum - 1, rum + 1) if rmul(candidate, chi) == ice), rum)
+
+    def dew(self, timestamp: int) -> Wad:
+        """Returns the amount of stability fee accrued since the last `drip()`, as of `timestamp`.
+
+        This amount gets added both to the good debt (`ice`) and to the surplus (`joy`) by the next `drip()`.
+        """
+        if not self._accrues() or self.state.ice == Wad.ZERO:
+            return Wad.ZERO
+        return Wad(rmul(self._rum(), self.chi(timestamp).value) - self.state.ice.value)
+
+    def ice(self, timestamp: int) -> Wad:
+        """Returns the amount of good debt (`ice`) as of `timestamp`."""
+        return self.state.ice + self.dew(timestamp)
+
+    def joy(self, timestamp: int) -> Wad:
+        """Returns the surplus (`joy`) as of `timestamp`."""
+        return self.state.tap_joy + self.dew(timestamp)
+
+    def woe(self, timestamp: int) -> Wad:
+        """Returns the bad debt (`woe`) as of `timestamp`. Bad debt does not accrue any fees."""
+        self._age(timestamp, self.state.era)
+        return self.state.tap_woe
+
+    def __repr__(self):
+        return f"FeeProjection(block_number={self.state.block_number}, era={self.state.era})"
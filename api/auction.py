@@ -19,6 +19,7 @@ import datetime
 from pprint import pformat
 
 from api import Contract, Address
+from api.logs import LogPoller, LogScanner
 from api.token import ERC20Token
 from api.numeric import Wad
 
@@ -50,10 +51,12 @@ class AuctionManager(Contract):
         self._on_split_handler = None
         self._on_auction_reversal_handler = None
 
-        self._contract.on('LogNewAuction', None, self._on_new_auction)
-        self._contract.on('LogBid', None, self._on_bid)
-        self._contract.on('LogSplit', None, self._on_split)
-        self._contract.on('LogAuctionReversal', None, self._on_auction_reversal)
+        log_poller = LogPoller.for_web3(web3)
+        log_poller.subscribe_event(self._contract, 'LogNewAuction', self._on_new_auction)
+        log_poller.subscribe_event(self._contract, 'LogBid', self._on_bid)
+        log_poller.subscribe_event(self._contract, 'LogSplit', self._on_split)
+        log_poller.subscribe_event(self._contract, 'LogAuctionReversal', self._on_auction_reversal)
+        log_poller.start()
 
     def _on_new_auction(self, log):
         if log['transactionHash'] not in self._our_tx_hashes:
@@ -87,10 +90,11 @@ class AuctionManager(Contract):
 
     def discover_recent_auctionlets(self, on_auctionlet_discovered):
         """Scan over LogNewAuction and LogSplit events and determine which auctionlets can still be active."""
-        self._contract.pastEvents('LogNewAuction', {'fromBlock': 0},
-                                  lambda log: on_auctionlet_discovered(log['args']['base_id']))
-        self._contract.pastEvents('LogSplit', {'fromBlock': 0},
-                                  lambda log: on_auctionlet_discovered(log['args']['split_id']))
+        log_scanner = LogScanner.for_web3(self.web3)
+        for log in log_scanner.scan(self._contract, 'LogNewAuction', 0):
+            on_auctionlet_discovered(log['args']['base_id'])
+        for log in log_scanner.scan(self._contract, 'LogSplit', 0):
+            on_auctionlet_discovered(log['args']['split_id'])
 
     def get_auction(self, auction_id):
         """Returns the auction with specified identifier."""
@@ -0,0 +1,180 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import threading
+from typing import Callable, List, Optional
+
+from eth_utils import force_bytes, force_obj_to_text, force_text
+from web3 import HTTPProvider, Web3
+from web3.utils.compat import make_post_request
+
+from api.cache import block_cache
+
+
+class _Deferred(BaseException):
+    """Raised inside a call evaluated by `multi_call()` when it reaches a request which hasn't been sent yet.
+
+    Derives from `BaseException` so it doesn't get swallowed by `except Exception` clauses of the call.
+    """
+    pass
+
+
+class _Recording:
+    def __init__(self, responses: list, block_identifier: Optional[str]):
+        self.responses = responses
+        self.block_identifier = block_identifier
+        self.position = 0
+        self.pending = None
+
+
+class BatchHTTPProvider(HTTPProvider):
+    """`HTTPProvider` which is able to send multiple JSON-RPC requests in one HTTP round trip.
+
+    On its own it behaves exactly like `HTTPProvider`. Batching happens only inside `multi_call()`.
+
+    Nodes reject (or time out on) very large batches, so batches bigger than `max_batch_size` get split
+    into chunks sent one after another.
+
+    Attributes:
+        max_batch_size: Maximum number of requests sent in one HTTP request.
+        round_trips: Number of HTTP requests sent so far, batched or not.
+    """
+
+    logger = logging.getLogger('api')
+
+    BATCHABLE_METHODS = {'eth_call', 'eth_getBalance', 'eth_getCode', 'eth_getStorageAt', 'eth_getTransactionReceipt',
+                         'eth_getBlockByNumber'}
+
+    def __init__(self, endpoint_uri, request_kwargs=None, max_batch_size: int = 500):
+        assert(isinstance(max_batch_size, int))
+        assert(max_batch_size > 0)
+        super().__init__(endpoint_uri, request_kwargs)
+        self.max_batch_size = max_batch_size
+        self.round_trips = 0
+        self._local = threading.local()
+
+    def make_request(self, method, params):
+        recording = getattr(self._local, 'recording', None)
+        if recording is not None and method in self.BATCHABLE_METHODS:
+            # the block identifier is the last parameter of all batchable methods which take one
+            if recording.block_identifier is not None and len(params) > 0 and params[-1] == 'latest':
+                params = list(params[:-1]) + [recording.block_identifier]
+
+            if recording.position == len(recording.responses):
+                recording.pending = (method, params)
+                raise _Deferred()
+
+            recorded_method, recorded_params, response = recording.responses[recording.position]
+            recording.position += 1
+            if recorded_method == method and recorded_params == params:
+                return response
+
+            self.logger.warning(f"Call evaluated by multi_call() made {method}{params} instead of"
+                                f" {recorded_method}{recorded_params} it made before, sending it unbatched")
+
+        self.round_trips += 1
+        return super().make_request(method, params)
+
+    def make_batch_request(self, requests: list) -> list:
+        """Sends a list of `(method, params)` requests in one HTTP request, or more if there are more
+        than `max_batch_size` of them.
+
+        Returns:
+            Responses (as dictionaries) to all the requests, in the same order as `requests`.
+        """
+        responses = []
+        for index in range(0, len(requests), self.max_batch_size):
+            responses += self._make_batch_request(requests[index:index + self.max_batch_size])
+        return responses
+
+    def _make_batch_request(self, requests: list) -> list:
+        ids = [next(self.request_counter) for _ in requests]
+        request_data = force_bytes(json.dumps(force_obj_to_text([{"jsonrpc": "2.0",
+                                                                   "method": method,
+                                                                   "params": params or [],
+                                                                   "id": request_id}
+                                                                  for request_id, (method, params) in zip(ids, requests)])))
+        self.round_trips += 1
+        response_raw = make_post_request(self.endpoint_uri, request_data, **self.get_request_kwargs())
+        responses = {response['id']: response for response in json.loads(force_text(response_raw))}
+        return [responses[request_id] for request_id in ids]
+
+
+def multi_call(web3: Web3, calls: List[Callable], block_number: Optional[int] = None) -> list:
+    """Evaluates a list of calls, sending all the JSON-RPC requests they make in as few round trips as possible.
+
+    Each call is a function with no arguments, for example `lambda: tub.tag()`, which reads something
+    from the chain. All the calls get evaluated, the read-only requests they make get collected and sent
+    as one JSON-RPC batch, and then the calls get evaluated again with the responses already in place.
+    Calls which make more than one request in sequence need more than one batch, but the number of round trips
+    depends on the longest such sequence, not on the number of calls.
+
+    As calls can be evaluated more than once, they must not have any side effects.
+
+    If `block_number` is given, the requests read the state as of that block instead of the latest one,
+    so all the values returned are consistent with each other even if a new block arrives in the meantime.
+    Values read that way get cached in `block_cache` separately from the ones read from the current block.
+
+    If `web3` is not connected through a `BatchHTTPProvider`, the calls just get evaluated one by one.
+    They can only read the latest block then, so any other `block_number` raises a `ValueError`.
+
+    Args:
+        web3: An instance of `Web3` from `web3.py`.
+        calls: Functions (taking no arguments) to evaluate.
+        block_number: Number of the block to read the state as of. The latest block if `None`.
+
+    Returns:
+        A list of values returned by `calls`, in the same order.
+    """
+    provider = web3.currentProvider
+    if not isinstance(provider, BatchHTTPProvider):
+        if block_number is not None and block_number != web3.eth.blockNumber:
+            raise ValueError(f"Reading block #{block_number} other than the latest one requires BatchHTTPProvider")
+        return [call() for call in calls]
+
+    if block_number is not None:
+        with block_cache.pinned(block_number):
+            return _multi_call(provider, calls, block_number)
+    else:
+        return _multi_call(provider, calls, block_number)
+
+
+def _multi_call(provider: BatchHTTPProvider, calls: List[Callable], block_number: Optional[int]) -> list:
+    results = [None] * len(calls)
+    responses = [[] for _ in calls]
+    remaining = list(range(len(calls)))
+    while len(remaining) > 0:
+        pending = []
+        for index in remaining:
+            recording = _Recording(responses[index], hex(block_number) if block_number is not None else None)
+            previous_recording = getattr(provider._local, 'recording', None)
+            provider._local.recording = recording
+            try:
+                results[index] = calls[index]()
+            except _Deferred:
+                pending.append((index, recording.pending))
+            finally:
+                provider._local.recording = previous_recording
+
+        batch_responses = provider.make_batch_request([request for index, request in pending])
+        for (index, (method, params)), response in zip(pending, batch_responses):
+            responses[index].append((method, params, response))
+        remaining = [index for index, request in pending]
+
+    return results
@@ -0,0 +1,155 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+
+class BlockCache:
+    """Cache of values returned by contract view methods, valid within a single block.
+
+    The cache is disabled by default, so using the API outside of keepers doesn't change its behaviour.
+    Keepers enable it when they start watching for new blocks (see `Keeper.on_block`), and the whole cache
+    gets cleared every time a new block arrives and every time one of our own transactions gets mined.
+    Cached values are also keyed by the `Web3` instance and the number of the block they come from, so a value
+    can never be served for a different chain or for a block other than the one it has been read in. Reads of the state as of an older block (see `pinned()`)
+    get keyed by that block, so they neither get served values of the current block nor leak into it.
+
+    Only methods decorated with `@block_cached` are subject to caching. Individual methods can be excluded
+    at runtime with `exclude()`, using their qualified names (for example `'Tub.tag'`).
+
+    Attributes:
+        enabled: Whether the cache is active.
+        block_number: Number of the block the cached values come from.
+        hits: Number of cache hits, per qualified method name.
+        misses: Number of cache misses, per qualified method name.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.block_number = None
+        self.hits = Counter()
+        self.misses = Counter()
+        self._excluded = set()
+        self._values = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.invalidate()
+
+    def exclude(self, method_name: str):
+        """Excludes the method with the given qualified name (e.g. `'Tub.tag'`) from caching."""
+        self._excluded.add(method_name)
+
+    def include(self, method_name: str):
+        """Reverses the effect of `exclude()`."""
+        self._excluded.discard(method_name)
+
+    def new_block(self, block_number: int):
+        """Clears the cache if `block_number` is different from the block the cached values come from."""
+        with self._lock:
+            if block_number != self.block_number:
+                self._values = {}
+                self.block_number = block_number
+
+    def current_block_number(self):
+        """Returns the number of the block values read now are expected to come from."""
+        pinned_block_number = getattr(self._local, 'pinned_block_number', None)
+        return pinned_block_number if pinned_block_number is not None else self.block_number
+
+    @contextmanager
+    def pinned(self, block_number: int):
+        """Makes the current thread key values by `block_number` instead of the current block, while in the block.
+
+        Meant to be used around code reading the state as of `block_number`, for example by `multi_call()`.
+        """
+        previous_block_number = getattr(self._local, 'pinned_block_number', None)
+        self._local.pinned_block_number = block_number
+        try:
+            yield
+        finally:
+            self._local.pinned_block_number = previous_block_number
+
+    def invalidate(self):
+        """Clears the cache."""
+        with self._lock:
+            self._values = {}
+
+    def get(self, method_name: str, key, func):
+        if not self.enabled or method_name in self._excluded:
+            return func()
+
+        with self._lock:
+            values = self._values
+            if key in values:
+                self.hits[method_name] += 1
+                return values[key]
+
+            self.misses[method_name] += 1
+
+        value = func()
+
+        with self._lock:
+            # do not store the value if the cache has been cleared in the meantime
+            if values is self._values:
+                values[key] = value
+        return value
+
+
+block_cache = BlockCache()
+
+
+def block_cached(method):
+    """Marks a contract view method as cacheable within a block. See `BlockCache` for details.
+
+    The instance the method gets called on must have `web3` and `address` attributes, and all its arguments
+    must be hashable.
+    """
+    method_name = method.__qualname__
+
+    @wraps(method)
+    def wrapper(self, *args):
+        key = (method_name, id(self.web3), self.address, args, block_cache.current_block_number())
+        return block_cache.get(method_name, key, lambda: method(self, *args))
+
+    return wrapper
+
+
+def immutable(method):
+    """Marks a contract getter returning a value which never changes once the contract has been deployed.
+
+    The value gets read only once per contract instance and then served from memory. All immutable values
+    of a contract can be read upfront, in one JSON-RPC batch if possible, with `Contract.prefetch_immutables()`.
+    """
+    method_name = method.__name__
+
+    @wraps(method)
+    def wrapper(self):
+        values = self.__dict__.setdefault('_immutable_values', {})
+        if method_name not in values:
+            values[method_name] = method(self)
+        return values[method_name]
+
+    wrapper.immutable = True
+    return wrapper
@@ -16,9 +16,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 import pkg_resources
 import pytest
+from eth_utils import force_obj_to_text, decode_hex
 from web3 import EthereumTesterProvider
 from web3 import Web3
 
@@ -26,7 +29,9 @@ from api import Address
 from api import Wad
 from api.approval import directly
 from api.auth import DSGuard
+from api.batch import BatchHTTPProvider
 from api.feed import DSValue
+from api.logs import LogPoller
 from api.sai import Tub, Tap, Top
 from api.token import DSToken
 from api.vault import DSVault
@@ -52,6 +57,59 @@ class SaiDeployment:
         self.top = top
 
 
+class JsonRpcServer:
+    """Local stand-in JSON-RPC server, forwarding requests to another provider and counting HTTP round trips.
+
+    `EthereumTesterProvider` does not support `eth_getStorageAt`, so these requests are served
+    by the server itself, straight from the state of the test chain.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.round_trips = 0
+        self.requests = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server.round_trips += 1
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if isinstance(request, list):
+                    response = [server.handle(item) for item in request]
+                else:
+                    response = server.handle(request)
+                body = json.dumps(force_obj_to_text(response)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint_uri = f"http://127.0.0.1:{self.http_server.server_address[1]}"
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def handle(self, request):
+        self.requests.append(request)
+        if request['method'] == 'eth_getStorageAt':
+            result = self.get_storage_at(*request['params'])
+        else:
+            result = self.provider.make_request(request['method'], request['params'])['result']
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+    def get_storage_at(self, address: str, position: str, block_identifier: str = 'latest'):
+        block = self.provider.rpc_methods.client.evm.block
+        return '0x' + format(block.get_storage_data(decode_hex(address), int(position, 16)), '064x')
+
+    def shutdown(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+
 @pytest.fixture(scope='session')
 def new_sai() -> SaiDeployment:
     def deploy(web3, contract_name, args=None):
@@ -99,3 +157,27 @@ def sai(new_sai: SaiDeployment) -> SaiDeployment:
     new_sai.web3.currentProvider.rpc_methods.evm_revert()
     new_sai.web3.currentProvider.rpc_methods.evm_snapshot()
     return new_sai
+
+
+@pytest.fixture()
+def poller(sai: SaiDeployment, monkeypatch) -> LogPoller:
+    """Shared `LogPoller` of the test chain, which doesn't start its thread, so it has to be polled explicitly."""
+    poller = LogPoller(sai.web3)
+    monkeypatch.setattr(LogPoller, 'for_web3', classmethod(lambda cls, web3: poller))
+    monkeypatch.setattr(poller, 'start', lambda: None)
+    return poller
+
+
+@pytest.fixture()
+def server(sai: SaiDeployment) -> JsonRpcServer:
+    server = JsonRpcServer(sai.web3.currentProvider)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture()
+def tub(sai: SaiDeployment, server: JsonRpcServer) -> Tub:
+    """`Tub` of the test chain, connected through a `BatchHTTPProvider` talking to `server`."""
+    web3 = Web3(BatchHTTPProvider(server.endpoint_uri))
+    web3.eth.defaultAccount = sai.web3.eth.defaultAccount
+    return Tub(web3=web3, address=sai.tub.address)
@@ -27,8 +27,9 @@ from eth_abi.encoding import get_single_encoder
 from eth_utils import coerce_return_to_text, encode_hex
 from web3 import Web3
 
-from api import Contract, Address, Receipt
+from api import Contract, Address, Receipt, Transact
 from api.numeric import Wad
+from api.signer import LocalSigner
 from api.token import ERC20Token
 from api.util import bytes_to_hexstring, hexstring_to_bytes
 
@@ -585,7 +586,7 @@ class EtherDelta(Contract):
                                                       order.r if hasattr(order, 'r') else bytes(),
                                                       order.s if hasattr(order, 's') else bytes()))
 
-    def trade(self, order: Order, amount: Wad) -> Optional[Receipt]:
+    def trade(self, order: Order, amount: Wad) -> Transact:
         """Takes (buys) an order.
 
         `amount` is in `token_get` terms, it is the amount you want to buy with. It can not be higher
@@ -600,27 +601,23 @@ class EtherDelta(Contract):
                 in order to buy a corresponding amount of `token_have` tokens.
 
         Returns:
-            A `Receipt` if the Ethereum transaction was successful and so was the trade.
-            `None` if the Ethereum transaction failed.
+            A `Transact` instance, which can be used to trigger the transaction.
         """
         assert(isinstance(order, Order))
         assert(isinstance(amount, Wad))
 
-        return self._transact(self.web3, f"EtherDelta('{self.address}').trade('{order.token_get}',"
-                                         f" '{order.amount_get}', '{order.token_give}', '{order.amount_give}',"
-                                         f" '{order.expires}', '{order.nonce}', '{order.user}', '0x...', '0x...',"
-                                         f" '0x...', '{amount}')",
-                              lambda: self._contract.transact().trade(order.token_get.address,
-                                                                      order.amount_get.value,
-                                                                      order.token_give.address,
-                                                                      order.amount_give.value,
-                                                                      order.expires,
-                                                                      order.nonce,
-                                                                      order.user.address,
-                                                                      order.v if hasattr(order, 'v') else 0,
-                                                                      order.r if hasattr(order, 'r') else bytes(),
-                                                                      order.s if hasattr(order, 's') else bytes(),
-                                                                      amount.value))
+        return Transact(self, self.web3, self.abi, self.address, self._contract, 'trade',
+                        [order.token_get.address,
+                         order.amount_get.value,
+                         order.token_give.address,
+                         order.amount_give.value,
+                         order.expires,
+                         order.nonce,
+                         order.user.address,
+                         order.v if hasattr(order, 'v') else 0,
+                         order.r if hasattr(order, 'r') else bytes(),
+                         order.s if hasattr(order, 's') else bytes(),
+                         amount.value])
 
     def can_trade(self, order: Order, amount: Wad) -> bool:
         """Verifies whether a trade can be executed.
@@ -684,6 +681,10 @@ class EtherDelta(Contract):
 
     @coerce_return_to_text
     def _eth_sign(self, account, data_hash):
+        signer = LocalSigner.for_account(self.web3, Address(account))
+        if signer is not None:
+            return signer.sign(data_hash)
+
         return self.web3._requestManager.request_blocking(
             "eth_sign", [account, encode_hex(data_hash)],
         )
@@ -20,6 +20,7 @@ import array
 from web3 import Web3
 
 from api import Contract, Address, Transact
+from api.cache import block_cached
 
 
 class DSValue(Contract):
@@ -59,6 +60,7 @@ class DSValue(Contract):
         self._assert_contract_exists(web3, address)
         self._contract = web3.eth.contract(abi=self.abi)(address=address.address)
 
+    @block_cached
     def has_value(self) -> bool:
         """Checks whether this instance contains a value.
 
@@ -67,6 +69,7 @@ class DSValue(Contract):
         """
         return self._contract.call().peek()[1]
 
+    @block_cached
     def read(self) -> bytes:
         """Reads the current value from this instance as a byte array.
 
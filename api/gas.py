@@ -0,0 +1,172 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from typing import List, Optional
+
+from web3 import Web3
+
+from api.batch import multi_call
+
+
+class GasPrice:
+    """Abstract class, which can be inherited for implementing different gas price strategies.
+
+    `GasPrice` class contains only one method, `get_gas_price`, which is responsible for
+    returning the gas price (in Wei) for a transaction which has been pending for a given number
+    of blocks. It gets called when the transaction is sent (with `blocks_pending` equal to zero)
+    and then once in a while until it gets mined. If it returns a price higher than the one
+    the transaction has been sent with, the transaction gets replaced with a new one, with the same
+    nonce but with the higher gas price.
+
+    If `get_gas_price` returns `None`, it means that the gas price should be chosen by the node.
+    """
+
+    def get_gas_price(self, blocks_pending: int) -> Optional[int]:
+        """Return gas price applicable for a transaction pending for `blocks_pending` blocks.
+
+        Args:
+            blocks_pending: Number of blocks mined since the transaction has been sent.
+
+        Returns:
+            Gas price in Wei, or `None` if the gas price should be chosen by the node.
+        """
+        raise NotImplementedError("Please implement this method")
+
+
+class DefaultGasPrice(GasPrice):
+    """Default gas price.
+
+    Leaves choosing the gas price to the node, so transactions never get replaced.
+    """
+
+    def get_gas_price(self, blocks_pending: int) -> Optional[int]:
+        return None
+
+
+class FixedGasPrice(GasPrice):
+    """Fixed gas price.
+
+    Args:
+        gas_price: Gas price to be used (in Wei).
+    """
+
+    def __init__(self, gas_price: int):
+        assert(isinstance(gas_price, int))
+        self.gas_price = gas_price
+
+    def get_gas_price(self, blocks_pending: int) -> Optional[int]:
+        return self.gas_price
+
+
+class NodeGasPrice(GasPrice):
+    """Gas price suggested by the node (`eth_gasPrice`), read when it's needed.
+
+    Args:
+        web3: An instance of `Web3` from `web3.py`.
+    """
+
+    def __init__(self, web3: Web3):
+        assert(isinstance(web3, Web3))
+        self.web3 = web3
+
+    def get_gas_price(self, blocks_pending: int) -> Optional[int]:
+        return self.web3.eth.gasPrice
+
+
+class PercentileGasPrice(GasPrice):
+    """Gas price being a percentile of gas prices paid by transactions in recent blocks.
+
+    All the blocks get read in one JSON-RPC batch if `web3` is connected through a `BatchHTTPProvider`.
+    The result is cached until a new block arrives. If there are no transactions in recent blocks,
+    the gas price suggested by the node is used.
+
+    Args:
+        web3: An instance of `Web3` from `web3.py`.
+        percentile: Percentile (0-100) of gas prices paid to use, 50 being the median.
+        number_of_blocks: Number of recent blocks to take into account.
+    """
+
+    def __init__(self, web3: Web3, percentile: float = 50, number_of_blocks: int = 20):
+        assert(isinstance(web3, Web3))
+        assert(0 <= percentile <= 100)
+        assert(isinstance(number_of_blocks, int))
+        assert(number_of_blocks > 0)
+        self.web3 = web3
+        self.percentile = percentile
+        self.number_of_blocks = number_of_blocks
+        self._cached = None
+        self._lock = threading.Lock()
+
+    def get_gas_price(self, blocks_pending: int) -> Optional[int]:
+        block_number = self.web3.eth.blockNumber
+        with self._lock:
+            if self._cached is not None and self._cached[0] == block_number:
+                return self._cached[1]
+
+        gas_prices = self._recent_gas_prices(block_number)
+        gas_price = self._percentile_of(gas_prices) if len(gas_prices) > 0 else self.web3.eth.gasPrice
+        with self._lock:
+            self._cached = (block_number, gas_price)
+        return gas_price
+
+    def _recent_gas_prices(self, block_number: int) -> List[int]:
+        block_numbers = range(max(block_number - self.number_of_blocks + 1, 0), block_number + 1)
+        blocks = multi_call(self.web3, [lambda number=number: self.web3.eth.getBlock(number, True)
+                                        for number in block_numbers])
+        return [transaction['gasPrice'] for block in blocks if block is not None
+                for transaction in block['transactions']]
+
+    def _percentile_of(self, values: List[int]) -> int:
+        values = sorted(values)
+        index = round((len(values) - 1) * self.percentile / 100)
+        return values[int(index)]
+
+
+class IncreasingGasPrice(GasPrice):
+    """Gas price increasing by a constant factor every few blocks, up to a cap.
+
+    The transaction gets sent with the gas price returned by the `gas_price` strategy. Every `every_blocks`
+    blocks it stays pending that price gets multiplied by `increase` once more, so the transaction gets replaced
+    with one paying more. Nodes accept replacements only if they pay at least 10% (geth) or 12.5% (parity)
+    more than the transaction replaced, hence the default `increase`.
+
+    Args:
+        gas_price: Strategy to get the initial gas price from.
+        every_blocks: Number of blocks after which the gas price increases.
+        increase: Factor the gas price gets multiplied by every `every_blocks` blocks.
+        max_price: Gas price (in Wei) which will never be exceeded. No limit if `None`.
+    """
+
+    def __init__(self, gas_price: GasPrice, every_blocks: int, increase: float = 1.125, max_price: Optional[int] = None):
+        assert(isinstance(gas_price, GasPrice))
+        assert(isinstance(every_blocks, int))
+        assert(every_blocks > 0)
+        assert(increase > 1)
+        assert(isinstance(max_price, int) or max_price is None)
+        self.gas_price = gas_price
+        self.every_blocks = every_blocks
+        self.increase = increase
+        self.max_price = max_price
+
+    def get_gas_price(self, blocks_pending: int) -> Optional[int]:
+        gas_price = self.gas_price.get_gas_price(blocks_pending)
+        if gas_price is None:
+            return None
+
+        gas_price = int(gas_price * self.increase ** (blocks_pending // self.every_blocks))
+        return min(gas_price, self.max_price) if self.max_price is not None else gas_price
@@ -0,0 +1,418 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+from eth_utils import encode_hex, event_abi_to_log_topic
+from web3 import Web3
+from web3.formatters import input_filter_params_formatter, output_log_formatter
+from web3.utils.events import get_event_data
+
+
+_get_logs_unsupported = set()
+
+
+def get_logs(web3: Web3, filter_params: dict) -> list:
+    """Returns logs matching `filter_params`, using `eth_getLogs` if the node supports it.
+
+    Nodes which do not implement `eth_getLogs` (for example `eth-testrpc`) get a temporary filter created
+    instead. As they do not always interpret nested topic arrays in the standard way, for these nodes
+    only the `address` part of `filter_params` is taken into account.
+
+    Returns:
+        A list of logs in the `web3.py` format, but not decoded.
+    """
+    request_manager = web3._requestManager
+    filter_params = input_filter_params_formatter(filter_params)
+    if id(web3) not in _get_logs_unsupported:
+        try:
+            logs = request_manager.request_blocking('eth_getLogs', [filter_params])
+            return [output_log_formatter(log) for log in logs]
+        except (AttributeError, ValueError) as e:
+            if not _method_not_found(e):
+                raise
+            _get_logs_unsupported.add(id(web3))
+
+    filter_params = {key: value for key, value in filter_params.items() if key != 'topics'}
+    filter_id = request_manager.request_blocking('eth_newFilter', [filter_params])
+    try:
+        logs = request_manager.request_blocking('eth_getFilterLogs', [filter_id])
+    finally:
+        request_manager.request_blocking('eth_uninstallFilter', [filter_id])
+    return [output_log_formatter(log) for log in logs]
+
+
+def _response_too_large(exception: Exception) -> bool:
+    """Tells whether `exception` means that the node couldn't return all the logs requested at once,
+    either because there are too many of them or because looking them up took too long."""
+    if isinstance(exception, (socket.timeout, requests.exceptions.Timeout)):
+        return True
+    error = exception.args[0] if len(exception.args) > 0 else None
+    message = str(error.get('message', '')) if isinstance(error, dict) else str(exception)
+    return (isinstance(error, dict) and error.get('code') == -32005) or \
+        any(phrase in message.lower() for phrase in ['more than', 'too many', 'limit exceeded', 'timeout', 'timed out'])
+
+
+def _method_not_found(exception: Exception) -> bool:
+    if isinstance(exception, AttributeError):
+        return True
+    error = exception.args[0] if len(exception.args) > 0 else None
+    return isinstance(error, dict) and error.get('code') == -32601
+
+
+def _event_abi(contract, event: str) -> dict:
+    return [abi for abi in contract.abi if abi.get('type') == 'event' and abi.get('name') == event][0]
+
+
+class LogPoller:
+    """Watches for new blocks and for contract events, in one thread, using `eth_getLogs`.
+
+    Instead of having a separate `web3.py` filter (and a separate thread) for each watched event,
+    all subscriptions are served by one loop, which fetches the logs of all of them with one `eth_getLogs`
+    call per new range of blocks and then dispatches them to the handlers. Errors (for example
+    HTTP errors while communicating with the node) get logged and the same block range gets retried
+    on the next iteration, so the poller never silently stops working.
+
+    Usually there is one poller per `Web3` instance, available via `LogPoller.for_web3()`. Handlers get called
+    only after the polling thread has been started with `start()`, but with all the logs emitted since the first
+    subscription, so nothing gets missed by subscribers which read their initial state before the first poll.
+
+    Attributes:
+        web3: An instance of `Web` from `web3.py`.
+        poll_interval: Number of seconds to wait between checking for new blocks.
+        last_block_number: Number of the last block processed.
+        last_poll_time: Time (as returned by `time.time()`) of the last successful poll.
+    """
+
+    logger = logging.getLogger('api')
+
+    _pollers = {}
+    _pollers_lock = threading.Lock()
+
+    def __init__(self, web3: Web3, poll_interval: float = 1.0):
+        assert(isinstance(web3, Web3))
+        self.web3 = web3
+        self.poll_interval = poll_interval
+        self.last_block_number = None
+        self.last_poll_time = None
+        self._subscriptions = []
+        self._block_handlers = []
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @classmethod
+    def for_web3(cls, web3: Web3) -> 'LogPoller':
+        """Returns the poller shared by all users of `web3`, creating it if necessary."""
+        with cls._pollers_lock:
+            if id(web3) not in cls._pollers:
+                cls._pollers[id(web3)] = (web3, LogPoller(web3))
+            return cls._pollers[id(web3)][1]
+
+    def subscribe(self, address: str, topic: str, handler):
+        """Calls `handler` with each new log emitted by the contract at `address` with the first topic `topic`.
+
+        Logs are passed to the handler in the `web3.py` format, but not decoded.
+        """
+        with self._lock:
+            self._start_from_current_block()
+            self._subscriptions.append((address.lower(), topic, handler))
+
+    def subscribe_event(self, contract, event: str, handler):
+        """Calls `handler` with each new `event` emitted by `contract` (a `web3.py` contract).
+
+        Events are passed to the handler decoded, in the same format as `web3.py` filters pass them.
+        """
+        event_abi = _event_abi(contract, event)
+        self.subscribe(contract.address, encode_hex(event_abi_to_log_topic(event_abi)),
+                       lambda log: handler(get_event_data(event_abi, log)))
+
+    def on_block(self, handler):
+        """Calls `handler` with the hash of the most recent block every time new blocks arrive."""
+        with self._lock:
+            self._start_from_current_block()
+            self._block_handlers.append(handler)
+
+    def active(self) -> bool:
+        """Returns `True` if there is anything being watched."""
+        with self._lock:
+            return len(self._subscriptions) > 0 or len(self._block_handlers) > 0
+
+    def alive(self) -> bool:
+        """Returns `True` if the polling thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts the polling thread, unless it is already running."""
+        with self._lock:
+            self._start_from_current_block()
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='LogPoller', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 60):
+        """Stops the polling thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._stopping.set()
+            thread.join(timeout)
+
+    def _start_from_current_block(self):
+        if self.last_block_number is None:
+            self.last_block_number = self.web3.eth.blockNumber
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.poll()
+            except:
+                self.logger.warning("Polling for new logs failed, will retry", exc_info=True)
+            self._stopping.wait(self.poll_interval)
+
+    def poll(self):
+        """Checks for new blocks and dispatches all new logs to the subscribers.
+
+        It is called periodically by the polling thread, it can also be called directly.
+        """
+        with self._lock:
+            block_number = self.web3.eth.blockNumber
+            if self.last_block_number is None:
+                self.last_block_number = block_number
+            elif block_number > self.last_block_number:
+                from_block = self.last_block_number + 1
+                subscriptions = list(self._subscriptions)
+                if len(subscriptions) > 0:
+                    logs = get_logs(self.web3, {'fromBlock': from_block,
+                                           'toBlock': block_number,
+                                           'address': sorted(set(address for address, _, _ in subscriptions)),
+                                           'topics': [sorted(set(topic for _, topic, _ in subscriptions))]})
+                    for log in logs:
+                        self._dispatch(subscriptions, log)
+
+                self.last_block_number = block_number
+                if len(self._block_handlers) > 0:
+                    block_hash = self.web3.eth.getBlock(block_number)['hash']
+                    for handler in list(self._block_handlers):
+                        self._call(handler, block_hash)
+
+            self.last_poll_time = time.time()
+
+    def _dispatch(self, subscriptions: list, log: dict):
+        address = log['address'].lower()
+        topic = log['topics'][0] if len(log['topics']) > 0 else None
+        for subscription_address, subscription_topic, handler in subscriptions:
+            if subscription_address == address and subscription_topic == topic:
+                self._call(handler, log)
+
+    def _call(self, handler, argument):
+        try:
+            handler(argument)
+        except:
+            self.logger.exception(f"Handler {handler} failed")
+
+
+class LogScanner:
+    """Scans past logs, splitting the block range into chunks which get fetched concurrently.
+
+    Scanning a large block range with one filter is slow and frequently times out on real nodes.
+    The scanner divides the range into chunks of `chunk_size` blocks and fetches them on a pool
+    of `max_workers` threads. If the node rejects a chunk because it would return too many results
+    or takes too long to process, the chunk gets split in half and retried, and the chunk size used
+    for subsequent scans gets reduced as well, down to `min_chunk_size` blocks. Each scan which goes
+    through without any chunk having to be split doubles the chunk size again, up to the initial one.
+    Any other error (for example a dropped connection) gets retried on the same chunk up to `max_retries`
+    times, `retry_delay` seconds apart.
+
+    If `checkpoint_file` is set, logs found by each scan are saved in that file, together with
+    the number of the last block scanned. Subsequent scans of the same subscription, even after
+    the process has been restarted, only fetch blocks newer than that. Only blocks with at least
+    `confirmations` confirmations are saved, so chain reorganizations do not corrupt the checkpoint.
+    To keep the file small, only logs from the most recent `checkpoint_blocks` blocks are saved,
+    logs from older blocks get fetched from the chain again whenever they are needed.
+
+    Usually there is one scanner per `Web3` instance, available via `LogScanner.for_web3()`.
+
+    Attributes:
+        web3: An instance of `Web` from `web3.py`.
+        chunk_size: Number of blocks fetched in one request, initially (and at most) `max_chunk_size`.
+        min_chunk_size: Minimum number of blocks fetched in one request.
+        max_chunk_size: Maximum number of blocks fetched in one request.
+        max_workers: Maximum number of requests running concurrently.
+        max_retries: Number of times a chunk gets retried after an error not caused by its size.
+        retry_delay: Number of seconds to wait before retrying a chunk.
+        checkpoint_file: Name of the file to keep checkpoints in, or `None` if no checkpoints should be kept.
+        confirmations: Number of confirmations a block needs to have for its logs to be saved in the checkpoint.
+        checkpoint_blocks: Number of most recent blocks the logs of which are saved in the checkpoint.
+    """
+
+    logger = logging.getLogger('api')
+
+    _scanners = {}
+    _scanners_lock = threading.Lock()
+
+    def __init__(self, web3: Web3, chunk_size: int = 20000, min_chunk_size: int = 10, max_workers: int = 4,
+                 checkpoint_file: Optional[str] = None, confirmations: int = 12, max_retries: int = 3,
+                 retry_delay: float = 1.0, checkpoint_blocks: int = 100000):
+        assert(isinstance(web3, Web3))
+        assert(chunk_size >= min_chunk_size > 0)
+        assert(max_workers > 0)
+        assert(max_retries >= 0)
+        assert(checkpoint_blocks > 0)
+        self.web3 = web3
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.checkpoint_file = checkpoint_file
+        self.confirmations = confirmations
+        self.checkpoint_blocks = checkpoint_blocks
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_web3(cls, web3: Web3) -> 'LogScanner':
+        """Returns the scanner shared by all users of `web3`, creating it if necessary."""
+        with cls._scanners_lock:
+            if id(web3) not in cls._scanners:
+                cls._scanners[id(web3)] = (web3, LogScanner(web3))
+            return cls._scanners[id(web3)][1]
+
+    def scan(self, contract, event: str, from_block: int, to_block: Optional[int] = None) -> list:
+        """Returns all `event`s emitted by `contract` (a `web3.py` contract) between two blocks (inclusive).
+
+        Args:
+            contract: The `web3.py` contract to get the events of.
+            event: Name of the event.
+            from_block: Number of the first block to scan.
+            to_block: Number of the last block to scan, the most recent block if `None`.
+
+        Returns:
+            Events, decoded in the same format as `web3.py` filters pass them, ordered as they happened.
+        """
+        event_abi = _event_abi(contract, event)
+        topic = encode_hex(event_abi_to_log_topic(event_abi))
+        checkpoint_key = f"{contract.address.lower()}:{topic}"
+
+        latest_block = self.web3.eth.blockNumber
+        if to_block is None:
+            to_block = latest_block
+        from_block = max(from_block, 0)
+
+        checkpoint = self._read_checkpoint(checkpoint_key)
+        if checkpoint is not None and checkpoint['from_block'] <= to_block \
+                and from_block <= checkpoint['last_block'] + 1:
+            known_from_block = min(from_block, checkpoint['from_block'])
+            known_last_block = checkpoint['last_block']
+            known_logs = self._fetch(contract.address, topic, from_block, checkpoint['from_block'] - 1) \
+                         + checkpoint['logs'] \
+                         + self._fetch(contract.address, topic, checkpoint['last_block'] + 1, to_block)
+        else:
+            known_from_block = from_block
+            known_last_block = from_block - 1
+            known_logs = self._fetch(contract.address, topic, from_block, to_block)
+
+        safe_block = min(to_block, latest_block - self.confirmations)
+        if safe_block > known_last_block:
+            window_from_block = max(known_from_block, safe_block - self.checkpoint_blocks + 1)
+            self._write_checkpoint(checkpoint_key, window_from_block, safe_block,
+                                   [log for log in known_logs if window_from_block <= log['blockNumber'] <= safe_block])
+
+        logs = [log for log in known_logs if from_block <= log['blockNumber'] <= to_block]
+
+        return [get_event_data(event_abi, log) for log in logs]
+
+    def _fetch(self, address: str, topic: str, from_block: int, to_block: int) -> list:
+        chunk_size = self.chunk_size
+        chunks = [(chunk_start, min(chunk_start + chunk_size - 1, to_block))
+                  for chunk_start in range(from_block, to_block + 1, chunk_size)]
+        if len(chunks) == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+            results = executor.map(lambda chunk: self._fetch_chunk(address, topic, chunk[0], chunk[1]), chunks)
+            logs = [log for result in results for log in result]
+
+        # no chunk had to be split, so the node might cope with bigger chunks again
+        with self._lock:
+            if self.chunk_size == chunk_size:
+                self.chunk_size = min(chunk_size * 2, self.max_chunk_size)
+
+        return [log for log in logs if log['address'].lower() == address.lower()
+                and len(log['topics']) > 0 and log['topics'][0] == topic]
+
+    def _fetch_chunk(self, address: str, topic: str, from_block: int, to_block: int, retries: int = 0) -> list:
+        try:
+            return get_logs(self.web3, {'fromBlock': from_block, 'toBlock': to_block,
+                                        'address': address, 'topics': [topic]})
+        except Exception as e:
+            if not _response_too_large(e):
+                if retries >= self.max_retries:
+                    raise
+
+                self.logger.info(f"Fetching logs from blocks #{from_block}-#{to_block} failed ({e}), retrying")
+                time.sleep(self.retry_delay)
+                return self._fetch_chunk(address, topic, from_block, to_block, retries + 1)
+
+            if to_block - from_block + 1 <= self.min_chunk_size:
+                raise
+
+            middle_block = (from_block + to_block) // 2
+            with self._lock:
+                self.chunk_size = max(min(self.chunk_size, (to_block - from_block + 1) // 2), self.min_chunk_size)
+            self.logger.info(f"Fetching logs from blocks #{from_block}-#{to_block} failed ({e}),"
+                             f" splitting into two chunks and retrying")
+            return self._fetch_chunk(address, topic, from_block, middle_block) + \
+                   self._fetch_chunk(address, topic, middle_block + 1, to_block)
+
+    def _read_checkpoints(self) -> dict:
+        if self.checkpoint_file is None or not os.path.isfile(self.checkpoint_file):
+            return {}
+
+        with open(self.checkpoint_file) as file:
+            return json.load(file)
+
+    def _read_checkpoint(self, key: str) -> Optional[dict]:
+        with self._lock:
+            return self._read_checkpoints().get(key)
+
+    def _write_checkpoint(self, key: str, from_block: int, last_block: int, logs: list):
+        if self.checkpoint_file is None:
+            return
+
+        with self._lock:
+            checkpoints = self._read_checkpoints()
+            checkpoints[key] = {'from_block': from_block,
+                                'last_block': last_block,
+                                'logs': [dict(log) for log in logs]}
+
+            # write to a temporary file first so the checkpoint never gets corrupted
+            temporary_file = self.checkpoint_file + '.tmp'
+            with open(temporary_file, 'w') as file:
+                json.dump(checkpoints, file)
+            os.replace(temporary_file, self.checkpoint_file)
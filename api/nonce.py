@@ -0,0 +1,177 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from web3 import Web3
+
+from api import Address
+from api.logs import LogPoller
+
+
+class NonceManager:
+    """Allocates nonces of transactions sent from one account locally, instead of leaving it to the node.
+
+    With nonces assigned by the node, transactions sent concurrently race with each other, and the next
+    transaction cannot be sent before the previous one has been seen by the node. The manager hands out
+    consecutive nonces itself, so any number of transactions can be sent at once and can get mined in
+    the same block.
+
+    Transactions which have been sent but not mined yet are tracked. On every new block (as reported
+    by the `LogPoller` of the same `Web3` instance) the manager compares them with the number of transactions
+    of the account known to the node. If the number of mined transactions goes down (a chain reorganization),
+    the node doesn't know about some of the transactions sent (they have been dropped) or knows about more
+    transactions than have been sent through the manager, the next nonce gets read from the node again.
+    The same happens if sending a transaction fails, as the node may have accepted it nevertheless.
+
+    Contract transactions get their nonces from the manager if it is passed to `Transact.transact()`
+    or `Transact.transact_async()`. Other transactions can be sent with `send()`.
+
+    Usually there is one manager per account and `Web3` instance, available via `NonceManager.for_account()`.
+
+    Attributes:
+        web3: An instance of `Web` from `web3.py`.
+        address: Address of the account the nonces are managed for.
+    """
+
+    logger = logging.getLogger('api')
+
+    _managers = {}
+    _managers_lock = threading.Lock()
+
+    def __init__(self, web3: Web3, address: Address):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(address, Address))
+        self.web3 = web3
+        self.address = address
+        self._next_nonce = None
+        self._mined_count = None
+        self._in_flight = {}
+        self._lock = threading.RLock()
+        self._watching = False
+
+    @classmethod
+    def for_account(cls, web3: Web3, address: Address) -> 'NonceManager':
+        """Returns the manager shared by all users of `address` on `web3`, creating it if necessary."""
+        with cls._managers_lock:
+            key = (id(web3), address.address.lower())
+            if key not in cls._managers:
+                cls._managers[key] = (web3, NonceManager(web3, address))
+            return cls._managers[key][1]
+
+    def send(self, send_transaction: Callable[[int], str]) -> Tuple[int, str]:
+        """Sends a transaction with a nonce allocated by this manager.
+
+        Args:
+            send_transaction: Function sending the transaction with the nonce passed to it and returning its hash.
+
+        Returns:
+            The nonce allocated and the hash of the transaction sent.
+        """
+        assert(callable(send_transaction))
+
+        nonce = self.allocate()
+        try:
+            transaction_hash = send_transaction(nonce)
+        except:
+            self.release(nonce)
+            raise
+
+        self.sent(nonce, transaction_hash)
+        return nonce, transaction_hash
+
+    def allocate(self) -> int:
+        """Allocates the next nonce. It has to be followed by either `sent()` or `release()`."""
+        with self._lock:
+            if self._next_nonce is None:
+                self._next_nonce = self.web3.eth.getTransactionCount(self.address.address, 'pending')
+                self._mined_count = self.web3.eth.getTransactionCount(self.address.address, 'latest')
+
+            nonce = self._next_nonce
+            self._next_nonce += 1
+            self._in_flight[nonce] = None
+            return nonce
+
+    def sent(self, nonce: int, transaction_hash: str):
+        """Records that the transaction with an allocated `nonce` has been sent."""
+        assert(isinstance(nonce, int))
+        assert(isinstance(transaction_hash, str))
+        with self._lock:
+            self._in_flight[nonce] = transaction_hash
+        self._watch()
+
+    def release(self, nonce: int):
+        """Gives back an allocated `nonce` if sending the transaction failed.
+
+        The transaction might have reached the node anyway (for example if the request timed out), so the nonce
+        doesn't get reused straight away. Instead, the next nonce gets read from the node again.
+        """
+        assert(isinstance(nonce, int))
+        with self._lock:
+            self._in_flight.pop(nonce, None)
+            self._next_nonce = None
+
+    def in_flight(self) -> Dict[int, Optional[str]]:
+        """Returns hashes of the transactions sent but not mined yet, by nonce."""
+        with self._lock:
+            return dict(self._in_flight)
+
+    def check(self):
+        """Forgets the transactions which have been mined and resynchronizes with the node on reorgs and drops.
+
+        It is called on every new block, it can also be called directly.
+        """
+        with self._lock:
+            if self._next_nonce is None:
+                return
+
+            mined_count = self.web3.eth.getTransactionCount(self.address.address, 'latest')
+            pending_count = self.web3.eth.getTransactionCount(self.address.address, 'pending')
+
+            for nonce in list(self._in_flight.keys()):
+                if nonce < mined_count and self._in_flight[nonce] is not None:
+                    del self._in_flight[nonce]
+
+            if self._mined_count is not None and mined_count < self._mined_count:
+                self.logger.warning(f"Number of mined transactions of {self.address} went down from"
+                                    f" {self._mined_count} to {mined_count}, resynchronizing nonces")
+                self._next_nonce = None
+            elif pending_count < self._next_nonce and all(self._in_flight.values()):
+                dropped = {nonce: transaction_hash for nonce, transaction_hash in self._in_flight.items()
+                           if nonce >= pending_count}
+                self.logger.warning(f"Transactions {dropped} of {self.address} have been dropped, resynchronizing nonces")
+                for nonce in dropped:
+                    del self._in_flight[nonce]
+                self._next_nonce = None
+            elif pending_count > self._next_nonce:
+                self.logger.warning(f"Node knows about {pending_count - self._next_nonce} more transaction(s)"
+                                    f" of {self.address} than have been sent, resynchronizing nonces")
+                self._next_nonce = None
+
+            self._mined_count = mined_count
+
+    def _watch(self):
+        with self._lock:
+            if self._watching:
+                return
+            self._watching = True
+
+        log_poller = LogPoller.for_web3(self.web3)
+        log_poller.on_block(lambda block_hash: self.check())
+        log_poller.start()
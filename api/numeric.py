@@ -15,9 +15,53 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import math
-from functools import total_ordering, reduce
-from decimal import *
+from fractions import Fraction
+from functools import total_ordering, reduce, lru_cache
+
+WAD = 10 ** 18
+RAY = 10 ** 27
+
+
+def _div_down(x: int, y: int) -> int:
+    """Integer division truncating towards zero, like `decimal.ROUND_DOWN` does (so "down" means towards zero).
+
+    For non-negative operands (the only ones Maker contracts deal with) this is plain floor division,
+    exactly like the `/` operator on `uint` in Solidity. Negative results get truncated towards zero,
+    not floored, so for example `_div_down(-3, 2)` is `-1`.
+    """
+    result = x // y
+    if result < 0 and result * y != x:
+        result += 1
+    return result
+
+
+def wmul(x: int, y: int) -> int:
+    """Multiplies two integers representing wads, rounding half up exactly like DS-math `wmul` does."""
+    return (x * y + WAD // 2) // WAD
+
+
+def rmul(x: int, y: int) -> int:
+    """Multiplies an integer by another one representing a ray, rounding half up exactly like DS-math `rmul` does."""
+    return (x * y + RAY // 2) // RAY
+
+
+def wdiv(x: int, y: int) -> int:
+    """Divides two integers, returning a wad and rounding half up exactly like DS-math `wdiv` does."""
+    return (x * WAD + y // 2) // y
+
+
+def rdiv(x: int, y: int) -> int:
+    """Divides two integers, returning a ray and rounding half up exactly like DS-math `rdiv` does."""
+    return (x * RAY + y // 2) // y
+
+
+_set_value = object.__setattr__
+
+
+def _from_number(number, scale: int) -> int:
+    # `str()` gives the shortest representation of a float which round-trips, so `0.1` becomes
+    # exactly 1/10 here and not the nearest binary fraction. `round()` on a `Fraction` rounds half to even.
+    return round(Fraction(str(number)) * scale)
 
 
 @total_ordering
@@ -33,8 +77,19 @@ class Wad:
     Notes:
         The internal representation of `Wad` is an unbounded integer, the last 18 digits of it being treated
         as decimal places. It is similar to the representation used in Maker contracts (`uint128`).
+        All arithmetic is done on integers only. The results of multiplication and division get truncated
+        towards zero (i.e. floored for the non-negative values Maker contracts deal with), the same way
+        the `decimal.ROUND_DOWN` based implementation used to do it. Note that it is not how DS-math does
+        it, its `wmul` and `rmul` round half up.
+
+        Instances of `Wad` are immutable, so they can be freely shared. `Wad.ZERO`, `Wad.ONE`, `Wad.MICRO`
+        (0.000001) and `Wad.EPSILON` (0.0000000001, the tolerance for rounding errors of amounts calculated
+        from rates) are predefined, and results of `from_number()` are cached, so using them in loops doesn't
+        cause any new objects to be allocated.
     """
 
+    __slots__ = ('value',)
+
     def __init__(self, value):
         """Creates a new Wad number.
 
@@ -43,22 +98,36 @@ class Wad:
                 of Maker contracts is used which means that passing `1` will create an instance of `Wad`
                 with a value of `0.000000000000000001'.
         """
-        if isinstance(value, Wad):
-            self.value = value.value
-        elif isinstance(value, Ray):
-            self.value = int((Decimal(value.value) / (Decimal(10)**Decimal(9))).quantize(1, rounding=ROUND_DOWN))
-        elif isinstance(value, int):
+        if isinstance(value, int):
             # assert(value >= 0)
-            self.value = value
+            _set_value(self, 'value', value)
+        elif isinstance(value, Wad):
+            _set_value(self, 'value', value.value)
+        elif isinstance(value, Ray):
+            _set_value(self, 'value', _div_down(value.value, RAY // WAD))
         else:
             raise ArithmeticError
 
     @classmethod
+    @lru_cache(maxsize=1024)
     def from_number(cls, number):
         # assert(number >= 0)
-        pwr = Decimal(10) ** 18
-        dec = Decimal(str(number)) * pwr
-        return Wad(int(dec.quantize(1)))
+        return Wad(_from_number(number, WAD))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Wad is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("Wad is immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return Wad, (self.value,)
 
     def __repr__(self):
         return "Wad(" + str(self.value) + ")"
@@ -82,19 +151,17 @@ class Wad:
     # z = cast((uint256(x) * y + WAD / 2) / WAD);
     def __mul__(self, other):
         if isinstance(other, Wad):
-            result = Decimal(self.value) * Decimal(other.value) / (Decimal(10) ** Decimal(18))
-            return Wad(int(result.quantize(1, rounding=ROUND_DOWN)))
+            return Wad(_div_down(self.value * other.value, WAD))
         elif isinstance(other, Ray):
-            result = Decimal(self.value) * Decimal(other.value) / (Decimal(10) ** Decimal(27))
-            return Wad(int(result.quantize(1, rounding=ROUND_DOWN)))
+            return Wad(_div_down(self.value * other.value, RAY))
         elif isinstance(other, int):
-            return Wad(int((Decimal(self.value) * Decimal(other)).quantize(1)))
+            return Wad(self.value * other)
         else:
             raise ArithmeticError
 
     def __truediv__(self, other):
         if isinstance(other, Wad):
-            return Wad(int((Decimal(self.value) * (Decimal(10) ** Decimal(18)) / Decimal(other.value)).quantize(1, rounding=ROUND_DOWN)))
+            return Wad(_div_down(self.value * WAD, other.value))
         else:
             raise ArithmeticError
 
@@ -137,8 +204,18 @@ class Ray:
     Notes:
         The internal representation of `Ray` is an unbounded integer, the last 27 digits of it being treated
         as decimal places. It is similar to the representation used in Maker contracts (`uint128`).
+        All arithmetic is done on integers only. The results of multiplication and division get truncated
+        towards zero (i.e. floored for the non-negative values Maker contracts deal with), the same way
+        the `decimal.ROUND_DOWN` based implementation used to do it. Note that it is not how DS-math does
+        it, its `wmul` and `rmul` round half up.
+
+        Instances of `Ray` are immutable, so they can be freely shared. `Ray.ZERO` and `Ray.ONE`
+        are predefined, and results of `from_number()` are cached, so using them in loops doesn't cause
+        any new objects to be allocated.
     """
 
+    __slots__ = ('value',)
+
     def __init__(self, value):
         """Creates a new Ray number.
 
@@ -147,22 +224,36 @@ class Ray:
                 of Maker contracts is used which means that passing `1` will create an instance of `Ray`
                 with a value of `0.000000000000000000000000001'.
         """
-        if isinstance(value, Ray):
-            self.value = value.value
-        elif isinstance(value, Wad):
-            self.value = int((Decimal(value.value) * (Decimal(10)**Decimal(9))).quantize(1))
-        elif isinstance(value, int):
+        if isinstance(value, int):
             # assert(value >= 0)
-            self.value = value
+            _set_value(self, 'value', value)
+        elif isinstance(value, Ray):
+            _set_value(self, 'value', value.value)
+        elif isinstance(value, Wad):
+            _set_value(self, 'value', value.value * (RAY // WAD))
         else:
             raise ArithmeticError
 
     @classmethod
+    @lru_cache(maxsize=1024)
     def from_number(cls, number):
         assert(number >= 0)
-        pwr = Decimal(10) ** 27
-        dec = Decimal(str(number)) * pwr
-        return Ray(int(dec.quantize(1)))
+        return Ray(_from_number(number, RAY))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Ray is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("Ray is immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return Ray, (self.value,)
 
     def __repr__(self):
         return "Ray(" + str(self.value) + ")"
@@ -185,19 +276,17 @@ class Ray:
 
     def __mul__(self, other):
         if isinstance(other, Ray):
-            result = Decimal(self.value) * Decimal(other.value) / (Decimal(10) ** Decimal(27))
-            return Ray(int(result.quantize(1, rounding=ROUND_DOWN)))
+            return Ray(_div_down(self.value * other.value, RAY))
         elif isinstance(other, Wad):
-            result = Decimal(self.value) * Decimal(other.value) / (Decimal(10) ** Decimal(18))
-            return Ray(int(result.quantize(1, rounding=ROUND_DOWN)))
+            return Ray(_div_down(self.value * other.value, WAD))
         elif isinstance(other, int):
-            return Ray(int((Decimal(self.value) * Decimal(other)).quantize(1)))
+            return Ray(self.value * other)
         else:
             raise ArithmeticError
 
     def __truediv__(self, other):
         if isinstance(other, Ray):
-            return Ray(int((Decimal(self.value) * (Decimal(10) ** Decimal(27)) / Decimal(other.value)).quantize(1, rounding=ROUND_DOWN)))
+            return Ray(_div_down(self.value * RAY, other.value))
         else:
             raise ArithmeticError
 
@@ -216,6 +305,31 @@ class Ray:
         else:
             raise ArithmeticError
 
+    def rpow(self, n: int) -> 'Ray':
+        """Raises the number to the power of `n`, exactly like the `rpow` function of DS-math does.
+
+        Uses exponentiation by squaring, so it takes `O(log n)` multiplications. Unlike the `*` operator,
+        the result of each multiplication gets rounded half up, as `rmul` in DS-math does, so that
+        values like `chi` and `par` accrued by Maker contracts can be reproduced exactly.
+
+        Args:
+            n: The exponent, a non-negative integer.
+
+        Returns:
+            The number raised to the power of `n`.
+        """
+        assert(isinstance(n, int))
+        assert(n >= 0)
+        x = self.value
+        z = x if n % 2 != 0 else RAY
+        n //= 2
+        while n != 0:
+            x = (x * x + RAY // 2) // RAY
+            if n % 2 != 0:
+                z = (z * x + RAY // 2) // RAY
+            n //= 2
+        return Ray(z)
+
     @staticmethod
     def min(*args):
         """Returns the lower of the Ray values"""
@@ -225,3 +339,200 @@ class Ray:
     def max(*args):
         """Returns the higher of the Ray values"""
         return reduce(lambda x, y: x if x > y else y, args[1:], args[0])
+
+
+Wad.ZERO = Wad(0)
+Wad.ONE = Wad(WAD)
+Wad.MICRO = Wad(WAD // 10**6)
+Wad.EPSILON = Wad(WAD // 10**10)
+Ray.ZERO = Ray(0)
+Ray.ONE = Ray(RAY)
+
+
+class _NumericArray:
+    """Base class for `WadArray` and `RayArray`. Not to be used directly."""
+
+    _scalar = None
+    _scale = None
+
+    __slots__ = ('values',)
+
+    def __init__(self, values=()):
+        scalar = self._scalar
+        if isinstance(values, type(self)):
+            _set_value(self, 'values', values.values)
+        else:
+            _set_value(self, 'values', tuple(value if isinstance(value, int) else scalar(value).value
+                                             for value in values))
+
+    @classmethod
+    def _from_values(cls, values):
+        result = cls.__new__(cls)
+        _set_value(result, 'values', tuple(values))
+        return result
+
+    def _operand_values(self, other, scalar_type, array_type) -> tuple:
+        if isinstance(other, array_type):
+            if len(other.values) != len(self.values):
+                raise ValueError(f"Length mismatch ({len(self.values)} vs {len(other.values)})")
+            return other.values
+        elif isinstance(other, scalar_type):
+            return (other.value,) * len(self.values)
+        else:
+            raise ArithmeticError
+
+    def _other_values(self, other) -> tuple:
+        if isinstance(other, type(self)):
+            if len(other.values) != len(self.values):
+                raise ValueError(f"Length mismatch ({len(self.values)} vs {len(other.values)})")
+            return other.values
+        elif isinstance(other, self._scalar):
+            return (other.value,) * len(self.values)
+        else:
+            raise ArithmeticError
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        scalar = self._scalar
+        return (scalar(value) for value in self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._from_values(self.values[index])
+        else:
+            return self._scalar(self.values[index])
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self.values)})"
+
+    def __eq__(self, other):
+        if isinstance(other, type(self)):
+            return self.values == other.values
+        else:
+            raise ArithmeticError
+
+    def __hash__(self):
+        return hash(self.values)
+
+    def __add__(self, other):
+        return self._from_values(x + y for x, y in zip(self.values, self._other_values(other)))
+
+    def __sub__(self, other):
+        return self._from_values(x - y for x, y in zip(self.values, self._other_values(other)))
+
+    def __mul__(self, other):
+        if isinstance(other, int):
+            return self._from_values(x * other for x in self.values)
+        elif isinstance(other, (Wad, Ray)):
+            scale = WAD if isinstance(other, Wad) else RAY
+            y = other.value
+            return self._from_values(_div_down(x * y, scale) for x in self.values)
+        elif isinstance(other, (WadArray, RayArray)):
+            if len(other.values) != len(self.values):
+                raise ValueError(f"Length mismatch ({len(self.values)} vs {len(other.values)})")
+            scale = WAD if isinstance(other, WadArray) else RAY
+            return self._from_values(_div_down(x * y, scale) for x, y in zip(self.values, other.values))
+        else:
+            raise ArithmeticError
+
+    def __truediv__(self, other):
+        scale = self._scale
+        return self._from_values(_div_down(x * scale, y) for x, y in zip(self.values, self._other_values(other)))
+
+    def wmul(self, other):
+        """Multiplies the values by a `Wad` (or elementwise by a `WadArray`) using DS-math `wmul` (rounding half up)."""
+        return self._from_values(wmul(x, y) for x, y in zip(self.values, self._operand_values(other, Wad, WadArray)))
+
+    def rmul(self, other):
+        """Multiplies the values by a `Ray` (or elementwise by a `RayArray`) using DS-math `rmul` (rounding half up)."""
+        return self._from_values(rmul(x, y) for x, y in zip(self.values, self._operand_values(other, Ray, RayArray)))
+
+    def wdiv(self, other) -> 'WadArray':
+        """Divides the values by a number (or elementwise by an array) of the same type using DS-math `wdiv`.
+
+        As in DS-math, the result is a `WadArray`, rounded half up.
+        """
+        return WadArray._from_values(wdiv(x, y) for x, y in zip(self.values, self._other_values(other)))
+
+    def rdiv(self, other) -> 'RayArray':
+        """Divides the values by a number (or elementwise by an array) of the same type using DS-math `rdiv`.
+
+        As in DS-math, the result is a `RayArray`, rounded half up.
+        """
+        return RayArray._from_values(rdiv(x, y) for x, y in zip(self.values, self._other_values(other)))
+
+    def __lt__(self, other):
+        return [x < y for x, y in zip(self.values, self._other_values(other))]
+
+    def __le__(self, other):
+        return [x <= y for x, y in zip(self.values, self._other_values(other))]
+
+    def __gt__(self, other):
+        return [x > y for x, y in zip(self.values, self._other_values(other))]
+
+    def __ge__(self, other):
+        return [x >= y for x, y in zip(self.values, self._other_values(other))]
+
+    def sum(self):
+        """Returns the sum of all the values, zero if the array is empty."""
+        return self._scalar(sum(self.values))
+
+    def min(self):
+        """Returns the lowest of the values."""
+        return self._scalar(min(self.values))
+
+    def max(self):
+        """Returns the highest of the values."""
+        return self._scalar(max(self.values))
+
+    def argmin(self) -> int:
+        """Returns the index of the lowest of the values (the first one if there is more than one)."""
+        return min(range(len(self.values)), key=self.values.__getitem__)
+
+    def argmax(self) -> int:
+        """Returns the index of the highest of the values (the first one if there is more than one)."""
+        return max(range(len(self.values)), key=self.values.__getitem__)
+
+
+class WadArray(_NumericArray):
+    """Represents an immutable sequence of `Wad` numbers, operated on in batch.
+
+    Keepers often need to apply the same operation to every offer or every cup. Doing it with a `WadArray`
+    avoids creating an intermediate `Wad` object for every single operation, as all the arithmetic is done
+    directly on the underlying integers. The operators use the same rounding rules as `Wad` itself.
+
+    Addition, subtraction and division work with other instances of `WadArray` of the same length, or with
+    a `Wad`, which is then applied to every element. Multiplication works with instances of `Wad`, `Ray`,
+    `WadArray`, `RayArray` and with `int` numbers. The result of all these operations is always a `WadArray`.
+
+    To reproduce the values calculated by the contracts, use `wmul()`, `rmul()`, `wdiv()` and `rdiv()`
+    instead, which round half up exactly like their DS-math counterparts.
+
+    Ordering comparisons (`<`, `<=`, `>`, `>=`) are applied elementwise and return a list of booleans,
+    whereas `==` compares whole arrays.
+    """
+
+    __slots__ = ()
+
+    _scalar = Wad
+    _scale = WAD
+
+
+class RayArray(_NumericArray):
+    """Represents an immutable sequence of `Ray` numbers, operated on in batch.
+
+    It is the `Ray` counterpart of `WadArray`, see `WadArray` for the description of supported operations.
+    """
+
+    __slots__ = ()
+
+    _scalar = Ray
+    _scale = RAY
@@ -15,13 +15,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import math
+import threading
+from fractions import Fraction
+from functools import partial
+from itertools import islice
 from pprint import pformat
 from typing import Optional, List
 
+from sortedcontainers import SortedDict, SortedListWithKey
 from web3 import Web3
 
-from api import Contract, Address, Receipt, Calldata, Transact
-from api.numeric import Wad
+from api import Contract, Address, Calldata, Transact
+from api.batch import multi_call
+from api.numeric import Wad, WAD
 from api.token import ERC20Token
 from api.util import int_to_bytes32, bytes_to_int
 
@@ -56,6 +63,14 @@ class OfferInfo:
         return pformat(vars(self))
 
 
+class ItemUpdate:
+    def __init__(self, args):
+        self.id = args['id']
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
 class LogMake:
     def __init__(self, args):
         self.id = bytes_to_int(args['id'])
@@ -140,6 +155,9 @@ class SimpleMarket(Contract):
         for token in tokens:
             approval_function(token, self.address, 'OasisDEX')
 
+    def on_item_update(self, handler):
+        self._on_event(self._contract, 'ItemUpdate', ItemUpdate, handler)
+
     def on_make(self, handler):
         self._on_event(self._contract, 'LogMake', LogMake, handler)
 
@@ -224,7 +242,7 @@ class SimpleMarket(Contract):
         return Transact(self, self.web3, self.abi, self.address, self._contract,
                         'make', [have_token.address, want_token.address, have_amount.value, want_amount.value])
 
-    def take(self, offer_id: int, quantity: Wad) -> Optional[Receipt]:
+    def take(self, offer_id: int, quantity: Wad) -> Transact:
         """Takes (buys) an offer.
 
         If `quantity` is equal to `sell_how_much`, the whole offer will be taken (bought) which will make it
@@ -236,11 +254,10 @@ class SimpleMarket(Contract):
             quantity: Quantity of `sell_which_token` that you want to buy.
 
         Returns:
-            A `Receipt` if the Ethereum transaction was successful and the offer has been taken (bought).
-            `None` if the Ethereum transaction failed.
+            A `Transact` instance, which can be used to trigger the transaction.
         """
-        return self._transact(self.web3, f"SimpleMarket('{self.address}').take('{offer_id}', '{quantity}')",
-                              lambda: self._contract.transact().take(int_to_bytes32(offer_id), quantity.value))
+        return Transact(self, self.web3, self.abi, self.address, self._contract,
+                        'take', [int_to_bytes32(offer_id), quantity.value])
 
     def take_calldata(self, offer_id: int, quantity: Wad) -> Calldata:
         return Calldata(self.web3.eth.contract(abi=self.abi).encodeABI('take', [int_to_bytes32(offer_id), quantity.value]))
@@ -261,3 +278,182 @@ class SimpleMarket(Contract):
 
     def __repr__(self):
         return f"SimpleMarket('{self.address}')"
+
+
+class OfferIndex:
+    """Index of offers, grouped by token pairs and sorted by price, with offers also indexed by their owners.
+
+    Offers of each (`sell_which_token`, `buy_which_token`) pair are kept sorted from the best one (from the
+    taker's point of view), i.e. from the one with the lowest `buy_how_much` / `sell_how_much` ratio.
+    Offers with the same price are sorted by their ids. Adding and removing an offer, as well as looking up
+    the best offers, takes logarithmic time.
+    """
+
+    def __init__(self):
+        self._offers = {}
+        self._by_pair = {}
+        self._by_owner = {}
+
+    @staticmethod
+    def _price_key(offer: OfferInfo):
+        if offer.sell_how_much.value > 0:
+            return False, Fraction(offer.buy_how_much.value, offer.sell_how_much.value), offer.offer_id
+        else:
+            return True, 0, offer.offer_id
+
+    def add(self, offer: OfferInfo):
+        """Adds an offer to the index, replacing the previous version of it if already present."""
+        self.remove(offer.offer_id)
+        self._offers[offer.offer_id] = offer
+        pair = (offer.sell_which_token, offer.buy_which_token)
+        if pair not in self._by_pair:
+            self._by_pair[pair] = SortedListWithKey(key=self._price_key)
+        self._by_pair[pair].add(offer)
+        self._by_owner.setdefault(offer.owner, SortedDict())[offer.offer_id] = offer
+
+    def remove(self, offer_id: int):
+        """Removes an offer from the index. Does nothing if the offer is not present."""
+        offer = self._offers.pop(offer_id, None)
+        if offer is not None:
+            pair = (offer.sell_which_token, offer.buy_which_token)
+            self._by_pair[pair].remove(offer)
+            if len(self._by_pair[pair]) == 0:
+                del self._by_pair[pair]
+            del self._by_owner[offer.owner][offer_id]
+            if len(self._by_owner[offer.owner]) == 0:
+                del self._by_owner[offer.owner]
+
+    def offers(self) -> List[OfferInfo]:
+        """Returns all offers present in the index, ordered by their ids."""
+        return [self._offers[offer_id] for offer_id in sorted(self._offers)]
+
+    def pairs(self) -> List[tuple]:
+        """Returns all (`sell_which_token`, `buy_which_token`) pairs there are offers for."""
+        return list(self._by_pair.keys())
+
+    def offers_for(self, sell_which_token: Address, buy_which_token: Address) -> List[OfferInfo]:
+        """Returns all offers of a token pair, starting from the best one."""
+        return list(self._by_pair.get((sell_which_token, buy_which_token), []))
+
+    def best_offer(self, sell_which_token: Address, buy_which_token: Address) -> Optional[OfferInfo]:
+        """Returns the best offer of a token pair, or `None` if there are no offers for this pair."""
+        offers = self._by_pair.get((sell_which_token, buy_which_token))
+        return offers[0] if offers else None
+
+    def top_offers(self, sell_which_token: Address, buy_which_token: Address, count: int) -> List[OfferInfo]:
+        """Returns up to `count` best offers of a token pair, starting from the best one."""
+        return list(islice(self._by_pair.get((sell_which_token, buy_which_token), []), count))
+
+    def depth(self, sell_which_token: Address, buy_which_token: Address, amount: Wad,
+              max_price: Optional[Wad] = None) -> List[OfferInfo]:
+        """Returns the best offers of a token pair which are needed to buy `amount` of `sell_which_token`.
+
+        If `max_price` is given, only offers with a `buy_how_much` / `sell_how_much` ratio not higher
+        than it are taken into account. The last offer returned may need to be taken only partially.
+        If the total amount available is lower than `amount`, all these offers get returned.
+        """
+        offers = self._by_pair.get((sell_which_token, buy_which_token))
+        if offers is None:
+            return []
+
+        max_key = (False, Fraction(max_price.value, WAD), math.inf) if max_price is not None else None
+        result = []
+        remaining = amount.value
+        for offer in offers.irange_key(max_key=max_key):
+            if remaining <= 0:
+                break
+            result.append(offer)
+            remaining -= offer.sell_how_much.value
+        return result
+
+    def offers_owned_by(self, owner: Address, sell_which_token: Optional[Address] = None,
+                        buy_which_token: Optional[Address] = None) -> List[OfferInfo]:
+        """Returns offers owned by `owner`, ordered by their ids, optionally only the ones of a token pair."""
+        return [offer for offer in self._by_owner.get(owner, SortedDict()).values()
+                if (sell_which_token is None or offer.sell_which_token == sell_which_token)
+                and (buy_which_token is None or offer.buy_which_token == buy_which_token)]
+
+    def __len__(self):
+        return len(self._offers)
+
+
+class SimpleMarketOrderBook:
+    """Keeps a local copy of the `SimpleMarket` order book, updated incrementally from contract events.
+
+    `SimpleMarket.active_offers()` has to query every offer ever created on the market, which gets slower
+    and slower as the market grows. The order book queries all of them only once, on the first call
+    to `offers()`. From that moment it watches `ItemUpdate`, `LogMake`, `LogBump`, `LogTake` and `LogKill`
+    events and only re-reads the offers these events refer to. As an additional safety net, offers
+    created since the last call are detected by checking `last_offer_id`, which costs only one call.
+    Offers get re-read using `multi_call()`, so they are fetched in one JSON-RPC batch if possible.
+
+    Offers are kept in an `OfferIndex`, available as the `index` attribute, so they can be queried
+    by token pair, price and owner. The index reflects the state as of the last `refresh()` or `offers()` call.
+
+    If `reader` is given (usually an `OfferStorageReader`), offers get read through it instead of
+    `SimpleMarket.get_offer()`, which makes reading the whole order book much faster.
+
+    Attributes:
+        market: The `SimpleMarket` the order book is kept for.
+        index: `OfferIndex` of all active offers.
+        reader: Optional object used to read offers, with an `offers(offer_ids)` method.
+    """
+
+    def __init__(self, market: SimpleMarket, reader=None):
+        self.market = market
+        self.reader = reader
+        self.index = OfferIndex()
+        self._last_offer_id = 0
+        self._changed_offer_ids = set()
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _on_change(self, event):
+        with self._lock:
+            self._changed_offer_ids.add(event.id)
+
+    def _initialize(self):
+        # we start watching events before reading the offers, so we do not miss anything which
+        # happens in between. at worst some offers will get read twice.
+        self.market.on_item_update(self._on_change)
+        self.market.on_make(self._on_change)
+        self.market.on_bump(self._on_change)
+        self.market.on_take(self._on_change)
+        self.market.on_kill(self._on_change)
+        self._initialized = True
+
+    def refresh(self):
+        """Brings the order book up to date, re-reading only the offers which have changed."""
+        if not self._initialized:
+            self._initialize()
+
+        with self._lock:
+            changed_offer_ids = self._changed_offer_ids
+            self._changed_offer_ids = set()
+
+        last_offer_id = self.market.get_last_offer_id()
+        changed_offer_ids.update(range(self._last_offer_id + 1, last_offer_id + 1))
+        self._last_offer_id = max(self._last_offer_id, last_offer_id)
+
+        offer_ids = sorted(changed_offer_ids)
+        if self.reader is not None:
+            offers = self.reader.offers(offer_ids)
+        else:
+            offers = multi_call(self.market.web3, [partial(self.market.get_offer, offer_id) for offer_id in offer_ids])
+        for offer_id, offer in zip(offer_ids, offers):
+            if offer is not None:
+                self.index.add(offer)
+            else:
+                self.index.remove(offer_id)
+
+    def offers(self) -> List[OfferInfo]:
+        """Returns all active offers, in the same form as `SimpleMarket.active_offers()` does.
+
+        Returns:
+            A list of `OfferInfo` of all offers which are active, ordered by their ids.
+        """
+        self.refresh()
+        return self.index.offers()
+
+    def __repr__(self):
+        return f"SimpleMarketOrderBook('{self.market.address}')"
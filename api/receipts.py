@@ -0,0 +1,167 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from web3 import Web3
+
+from api.batch import multi_call
+
+
+class ReceiptTracker:
+    """Waits for receipts of pending transactions, looking all of them up at once every time a new block arrives.
+
+    Instead of each transaction polling for its own receipt, transactions get registered with the tracker
+    and wait on a future. The tracker watches for new blocks in its own thread, running only while there are
+    any transactions pending. On each new block receipts of all pending transactions get fetched together,
+    in one JSON-RPC batch if `web3` is connected through a `BatchHTTPProvider`, and the futures of the ones
+    which have been mined get resolved. So the number of requests depends on the number of blocks,
+    not on the number of transactions waited for.
+
+    The tracker doesn't use the `LogPoller` thread on purpose. Keepers send transactions from `LogPoller`
+    callbacks and wait for them to get mined, so it must not depend on that thread being free.
+
+    The receipt of each transaction is also looked up once when it gets registered, so transactions which
+    have already been mined by then do not have to wait for the next block.
+
+    Usually there is one tracker per `Web3` instance, available via `ReceiptTracker.for_web3()`.
+
+    Attributes:
+        web3: An instance of `Web` from `web3.py`.
+        poll_interval: Number of seconds to wait between checking for new blocks.
+        last_block_number: Number of the last block the receipts have been looked up at.
+    """
+
+    logger = logging.getLogger('api')
+
+    _trackers = {}
+    _trackers_lock = threading.Lock()
+
+    def __init__(self, web3: Web3, poll_interval: float = 1.0):
+        assert(isinstance(web3, Web3))
+        self.web3 = web3
+        self.poll_interval = poll_interval
+        self.last_block_number = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @classmethod
+    def for_web3(cls, web3: Web3) -> 'ReceiptTracker':
+        """Returns the tracker shared by all users of `web3`, creating it if necessary."""
+        with cls._trackers_lock:
+            if id(web3) not in cls._trackers:
+                cls._trackers[id(web3)] = (web3, ReceiptTracker(web3))
+            return cls._trackers[id(web3)][1]
+
+    def track(self, transaction_hash: str) -> Future:
+        """Registers a pending transaction.
+
+        Returns:
+            A `concurrent.futures.Future` which will get resolved with the receipt of the transaction
+            once it gets mined.
+        """
+        assert(isinstance(transaction_hash, str))
+        with self._lock:
+            if transaction_hash in self._pending:
+                return self._pending[transaction_hash]
+            future = Future()
+            self._pending[transaction_hash] = future
+
+        try:
+            self._check([transaction_hash])
+        except:
+            self.logger.warning(f"Looking up receipt of {transaction_hash} failed, will retry", exc_info=True)
+
+        if not future.done():
+            self._watch()
+        return future
+
+    def wait(self, transaction_hash: str) -> dict:
+        """Waits until the transaction gets mined and returns its receipt."""
+        return self.track(transaction_hash).result()
+
+    async def async_wait(self, transaction_hash: str) -> dict:
+        """Waits (asynchronously) until the transaction gets mined and returns its receipt."""
+        return await asyncio.wrap_future(self.track(transaction_hash))
+
+    def forget(self, transaction_hash: str):
+        """Stops waiting for the transaction, cancelling its future.
+
+        Used when a transaction is not expected to get mined anymore, for example when
+        it has been replaced by another one with the same nonce.
+        """
+        assert(isinstance(transaction_hash, str))
+        with self._lock:
+            future = self._pending.pop(transaction_hash, None)
+        if future is not None:
+            future.cancel()
+
+    def pending(self) -> List[str]:
+        """Returns hashes of all the transactions still waiting to be mined."""
+        with self._lock:
+            return list(self._pending.keys())
+
+    def poll(self):
+        """Checks for a new block and if there is one, looks up receipts of all the pending transactions.
+
+        It is called periodically by the watching thread, it can also be called directly.
+        """
+        block_number = self.web3.eth.blockNumber
+        if block_number != self.last_block_number:
+            self.last_block_number = block_number
+            self.check()
+
+    def check(self):
+        """Looks up receipts of all the pending transactions and resolves the ones which have been mined."""
+        self._check(self.pending())
+
+    def _check(self, transaction_hashes: List[str]):
+        receipts = multi_call(self.web3, [lambda transaction_hash=transaction_hash:
+                                          self.web3.eth.getTransactionReceipt(transaction_hash)
+                                          for transaction_hash in transaction_hashes])
+
+        for transaction_hash, receipt in zip(transaction_hashes, receipts):
+            if receipt is not None and receipt['blockNumber'] is not None:
+                with self._lock:
+                    future = self._pending.pop(transaction_hash, None)
+                if future is not None:
+                    future.set_result(receipt)
+
+    def _watch(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ReceiptTracker', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._pending) == 0:
+                    self._thread = None
+                    return
+
+            try:
+                self.poll()
+            except:
+                self.logger.warning("Looking up transaction receipts failed, will retry", exc_info=True)
+            time.sleep(self.poll_interval)
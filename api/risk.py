@@ -0,0 +1,201 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from fractions import Fraction
+from typing import List, Optional
+
+from sortedcontainers import SortedListWithKey
+
+from api import Address
+from api.batch import multi_call
+from api.numeric import Wad, Ray, WadArray, WAD, rdiv
+from api.sai import Cup, CupIndex, Tub, TubState
+
+
+class CupRisk:
+    """Collateralization of a single cup, as evaluated by `RiskEngine`.
+
+    Attributes:
+        cup: The cup evaluated.
+        tab: The amount of debt in the cup, in SAI. Equal to what `Tub.tab()` would return.
+        ratio: The collateralization ratio, i.e. the value of the collateral divided by the value
+            of the debt. `None` if the cup has no debt.
+        safe: `True` if the cup is safe. Equal to what `Tub.safe()` would return.
+        liquidation_price: The lowest reference price (REF per SKR, the same unit as `Tub.tag()`)
+            at which the cup is still safe. `None` if the cup has no debt or has debt, but no collateral.
+    """
+    def __init__(self, cup: Cup, tab: Wad, ratio: Optional[Ray], safe: bool, liquidation_price: Optional[Wad]):
+        self.cup = cup
+        self.tab = tab
+        self.ratio = ratio
+        self.safe = safe
+        self.liquidation_price = liquidation_price
+
+    def __repr__(self):
+        return f"CupRisk(cup_id={self.cup.cup_id}, tab={self.tab}, ratio={self.ratio}, safe={self.safe}," \
+               f" liquidation_price={self.liquidation_price})"
+
+
+class RiskEngine:
+    """Evaluates the collateralization of many cups at once, without calling the `Tub`.
+
+    Given one snapshot of the `Tub` parameters, the engine calculates the debt, the collateralization
+    ratio, safety and the liquidation price of any number of cups locally. The arithmetic follows
+    the `Tub` contract exactly, including the DS-math rounding (half up), so `tab` and `safe`
+    are the same as `Tub.tab()` and `Tub.safe()` would return in the block the snapshot was taken at.
+
+    Attributes:
+        tag: Reference price (REF per SKR).
+        chi: Internal debt price.
+        par: Accrued holder fee (REF per SAI).
+        mat: Liquidation ratio.
+    """
+    def __init__(self, tag: Wad, chi: Ray, par: Wad, mat: Ray):
+        assert(isinstance(tag, Wad))
+        assert(isinstance(chi, Ray))
+        assert(isinstance(par, Wad))
+        assert(isinstance(mat, Ray))
+        self.tag = tag
+        self.chi = chi
+        self.par = par
+        self.mat = mat
+
+    @classmethod
+    def for_tub(cls, tub: Tub) -> 'RiskEngine':
+        """Creates an engine for the current state of `tub`, reading all the parameters in one batch."""
+        assert(isinstance(tub, Tub))
+        tag, chi, par, mat = multi_call(tub.web3, [tub.tag, tub.chi, tub.par, tub.mat])
+        return cls(tag=tag, chi=chi, par=par, mat=mat)
+
+    @classmethod
+    def from_state(cls, state: TubState) -> 'RiskEngine':
+        """Creates an engine for the `Tub` parameters captured in `state`."""
+        assert(isinstance(state, TubState))
+        return cls(tag=state.tag, chi=state.chi, par=state.par, mat=state.mat)
+
+    def tabs(self, cups: List[Cup]) -> WadArray:
+        """Returns the debt of each of `cups`, in SAI."""
+        return WadArray(cup.art for cup in cups).rmul(self.chi)
+
+    def evaluate(self, cups: List[Cup]) -> List[CupRisk]:
+        """Evaluates the collateralization of `cups`.
+
+        Args:
+            cups: The cups to evaluate, for example `CupIndex.cups()`.
+
+        Returns:
+            A list of `CupRisk`, one for each cup, in the same order as `cups`.
+        """
+        inks = WadArray(cup.ink for cup in cups)
+        tabs = self.tabs(cups)
+        pros = inks.wmul(self.tag)
+        cons = tabs.wmul(self.par)
+        mins = cons.rmul(self.mat)
+
+        def risk(cup: Cup, ink: int, tab: int, pro: int, con: int, min: int) -> CupRisk:
+            if con > 0 and ink > 0:
+                # `wmul(tag, ink) >= min` holds for all `tag >= ceil((min * WAD - WAD/2) / ink)`
+                liquidation_price = Wad(max(-((WAD // 2 - min * WAD) // ink), 0))
+            else:
+                liquidation_price = None
+            return CupRisk(cup=cup,
+                           tab=Wad(tab),
+                           ratio=Ray(rdiv(pro, con)) if con > 0 else None,
+                           safe=pro >= min,
+                           liquidation_price=liquidation_price)
+
+        return list(map(risk, cups, inks.values, tabs.values, pros.values, cons.values, mins.values))
+
+    def unsafe(self, cups: List[Cup]) -> List[CupRisk]:
+        """Returns the `CupRisk` of each of `cups` which is not safe."""
+        return [risk for risk in self.evaluate(cups) if not risk.safe]
+
+    def __repr__(self):
+        return f"RiskEngine(tag={self.tag}, chi={self.chi}, par={self.par}, mat={self.mat})"
+
+
+class LiquidationQueue:
+    """Cups with debt, ordered from the one closest to liquidation.
+
+    The liquidation price of a cup is proportional to its `art` / `ink` ratio, as all the other factors
+    (`chi`, `par` and `mat`) are the same for all cups. So ordering cups by this ratio gives the order
+    of their liquidation prices, and it does not change when `chi` or `par` accrue. Only changes of the cups
+    themselves, which the queue learns about from `CupIndex`, require reordering. Cups with debt, but without
+    any collateral, are always at the front of the queue.
+
+    Thanks to that, finding the unsafe cups requires evaluating only these cups, plus the first safe one,
+    instead of all of them. The only imprecision comes from rounding, which can swap the order of two cups
+    whose liquidation prices differ by less than a wei.
+
+    Attributes:
+        cup_index: The `CupIndex` the queue follows.
+    """
+
+    def __init__(self, cup_index: CupIndex):
+        assert(isinstance(cup_index, CupIndex))
+        self.cup_index = cup_index
+        self._cups = {}
+        self._queue = SortedListWithKey(key=self._risk_key)
+        self.cup_index.on_change(self._update)
+        for cup in self.cup_index.cups():
+            self._update(cup)
+
+    @staticmethod
+    def _risk_key(cup: Cup):
+        if cup.ink.value > 0:
+            return True, -Fraction(cup.art.value, cup.ink.value), cup.cup_id
+        else:
+            return False, 0, cup.cup_id
+
+    def _update(self, cup: Cup):
+        previous = self._cups.pop(cup.cup_id, None)
+        if previous is not None:
+            self._queue.remove(previous)
+        if cup.art.value > 0 and cup.lad != Address('0x0000000000000000000000000000000000000000'):
+            self._cups[cup.cup_id] = cup
+            self._queue.add(cup)
+
+    def refresh(self):
+        """Brings the queue up to date with the cups, see `CupIndex.refresh()`."""
+        self.cup_index.refresh()
+
+    def cups(self) -> List[Cup]:
+        """Returns all cups with debt, starting from the one closest to liquidation."""
+        self.refresh()
+        return list(self._queue)
+
+    def unsafe(self, engine: RiskEngine) -> List[CupRisk]:
+        """Returns the `CupRisk` of each unsafe cup, starting from the one closest to liquidation.
+
+        Args:
+            engine: The `RiskEngine` with the current `Tub` parameters, used to evaluate the cups.
+        """
+        assert(isinstance(engine, RiskEngine))
+        self.refresh()
+        result = []
+        for cup in self._queue:
+            risk = engine.evaluate([cup])[0]
+            if risk.safe:
+                break
+            result.append(risk)
+        return result
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __repr__(self):
+        return f"LiquidationQueue({self.cup_index})"
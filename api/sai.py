@@ -15,14 +15,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Optional
+import threading
+from functools import partial
+from pprint import pformat
+from typing import Optional, List
 
+from eth_utils import encode_hex, function_abi_to_4byte_selector
 from web3 import Web3
 
 from api import Address, Wad, Contract, Receipt, Calldata, Transact
+from api.batch import BatchHTTPProvider, multi_call
+from api.cache import block_cached, immutable
+from api.logs import LogPoller
 from api.numeric import Ray
 from api.token import ERC20Token
-from api.util import int_to_bytes32
+from api.util import int_to_bytes32, bytes_to_int
 
 
 class Cup:
@@ -52,6 +59,40 @@ class Cup:
         return f"Cup(cup_id={self.cup_id}, lad={repr(self.lad)}, art={self.art}, ink={self.ink})"
 
 
+class LogNewCup:
+    def __init__(self, args):
+        self.lad = Address(args['lad'])
+        self.cup_id = bytes_to_int(args['cup'])
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
+class LogNote:
+    """Represents a `LogNote` event, emitted by the `Tub` on each call to a `note`-annotated function.
+
+    `LogNote` is an anonymous event and its data does not follow the ABI encoding rules, so unlike
+    other events it gets decoded straight from the raw log, using its topics and the first data word.
+
+    Attributes:
+        sig: Selector of the function called, as a hex string.
+        guy: Address of the caller.
+        foo: The first argument of the call, as an integer.
+        bar: The second argument of the call, as an integer.
+        wad: The amount of ETH sent with the call.
+    """
+    def __init__(self, log):
+        topics = log['topics']
+        self.sig = topics[0][0:10]
+        self.guy = Address('0x' + topics[1][26:])
+        self.foo = int(topics[2], 16)
+        self.bar = int(topics[3], 16)
+        self.wad = Wad(int(log['data'][2:66], 16))
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
 class Tub(Contract):
     """A client for the `Tub` contract, the primary contract driving the `SAI Stablecoin System`.
 
@@ -81,9 +122,11 @@ class Tub(Contract):
         self.address = address
         self._assert_contract_exists(web3, address)
         self._contractTub = web3.eth.contract(abi=self.abiTub)(address=address.address)
-        self._contractTip = web3.eth.contract(abi=self.abiTip)(address=self._contractTub.call().tip())
-        self._contractJar = web3.eth.contract(abi=self.abiJar)(address=self._contractTub.call().jar())
-        self._contractJug = web3.eth.contract(abi=self.abiJug)(address=self._contractTub.call().jug())
+        if isinstance(web3.currentProvider, BatchHTTPProvider):
+            self.prefetch_immutables()
+        self._contractTip = web3.eth.contract(abi=self.abiTip)(address=self.tip().address)
+        self._contractJar = web3.eth.contract(abi=self.abiJar)(address=self.jar().address)
+        self._contractJug = web3.eth.contract(abi=self.abiJug)(address=self.jug().address)
 
     @staticmethod
     def deploy(web3: Web3, jar: Address, jug: Address, pot: Address, pit: Address, tip: Address):
@@ -109,6 +152,19 @@ class Tub(Contract):
         approval_function(ERC20Token(web3=self.web3, address=self.skr()), self.pit(), 'Tub.pit')
         approval_function(ERC20Token(web3=self.web3, address=self.sai()), self.pit(), 'Tub.pit')
 
+    def on_new_cup(self, handler):
+        self._on_event(self._contractTub, 'LogNewCup', LogNewCup, handler)
+
+    def on_note(self, function: str, handler):
+        """Calls `handler` with a `LogNote` each time `function` gets called on the `Tub`."""
+        assert(isinstance(function, str))
+        function_abi = next(abi for abi in self.abiTub if abi.get('type') == 'function' and abi.get('name') == function)
+        topic = encode_hex(function_abi_to_4byte_selector(function_abi)) + '00' * 28
+        log_poller = LogPoller.for_web3(self.web3)
+        log_poller.subscribe(self.address.address, topic, lambda log: handler(LogNote(log)))
+        log_poller.start()
+
+    @block_cached
     def era(self) -> int:
         """Return the current SAI contracts timestamp.
 
@@ -131,6 +187,7 @@ class Tub(Contract):
         """
         return Transact(self, self.web3, self.abiTip, self.tip(), self._contractTip, 'warp', [seconds])
 
+    @immutable
     def sai(self) -> Address:
         """Get the SAI token.
 
@@ -139,6 +196,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().sai())
 
+    @immutable
     def sin(self) -> Address:
         """Get the SIN token.
 
@@ -147,6 +205,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().sin())
 
+    @immutable
     def jug(self) -> Address:
         """Get the SAI/SIN tracker.
 
@@ -155,6 +214,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().jug())
 
+    @immutable
     def jar(self) -> Address:
         """Get the collateral vault.
 
@@ -163,6 +223,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().jar())
 
+    @immutable
     def pit(self) -> Address:
         """Get the liquidator vault.
 
@@ -171,6 +232,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().pit())
 
+    @immutable
     def pot(self) -> Address:
         """Get the good debt vault.
 
@@ -179,6 +241,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().pot())
 
+    @immutable
     def skr(self) -> Address:
         """Get the SKR token.
 
@@ -187,6 +250,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().skr())
 
+    @immutable
     def gem(self) -> Address:
         """Get the collateral token (eg. W-ETH).
 
@@ -195,6 +259,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().gem())
 
+    @block_cached
     def pip(self) -> Address:
         """Get the GEM price feed.
 
@@ -203,6 +268,7 @@ class Tub(Contract):
         """
         return Address(self._contractJar.call().pip())
 
+    @immutable
     def tip(self) -> Address:
         """Get the target price engine.
 
@@ -211,6 +277,7 @@ class Tub(Contract):
         """
         return Address(self._contractTub.call().tip())
 
+    @block_cached
     def axe(self) -> Ray:
         """Get the liquidation penalty.
 
@@ -219,6 +286,7 @@ class Tub(Contract):
         """
         return Ray(self._contractTub.call().axe())
 
+    @block_cached
     def hat(self) -> Wad:
         """Get the debt ceiling.
 
@@ -227,6 +295,7 @@ class Tub(Contract):
         """
         return Wad(self._contractTub.call().hat())
 
+    @block_cached
     def mat(self) -> Ray:
         """Get the liquidation ratio.
 
@@ -235,6 +304,7 @@ class Tub(Contract):
         """
         return Ray(self._contractTub.call().mat())
 
+    @block_cached
     def tax(self) -> Ray:
         """Get the stability fee.
 
@@ -243,6 +313,7 @@ class Tub(Contract):
         """
         return Ray(self._contractTub.call().tax())
 
+    @block_cached
     def way(self) -> Ray:
         """Get the holder fee (interest rate).
 
@@ -251,6 +322,7 @@ class Tub(Contract):
         """
         return Ray(self._contractTip.call().way())
 
+    @block_cached
     def reg(self) -> int:
         """Get the Tub stage ('register').
 
@@ -259,6 +331,7 @@ class Tub(Contract):
         """
         return self._contractTub.call().reg()
 
+    @block_cached
     def fit(self) -> Ray:
         """Get the GEM per SKR settlement price.
 
@@ -267,6 +340,7 @@ class Tub(Contract):
         """
         return Ray(self._contractTub.call().fit())
 
+    @block_cached
     def rho(self) -> int:
         """Get the time of the last drip.
 
@@ -275,6 +349,7 @@ class Tub(Contract):
         """
         return self._contractTub.call().rho()
 
+    @block_cached
     def tau(self) -> int:
         """Get the time of the last prod.
 
@@ -283,6 +358,7 @@ class Tub(Contract):
         """
         return self._contractTip.call().tau()
 
+    @block_cached
     def chi(self) -> Ray:
         """Get the internal debt price.
 
@@ -371,6 +447,7 @@ class Tub(Contract):
         """
         return Transact(self, self.web3, self.abiTip, self.tip(), self._contractTip, 'prod', [])
 
+    @block_cached
     def ice(self) -> Wad:
         """Get the amount of good debt.
 
@@ -379,6 +456,7 @@ class Tub(Contract):
         """
         return Wad(self._contractTub.call().ice())
 
+    @block_cached
     def pie(self) -> Wad:
         """Get the amount of raw collateral.
 
@@ -387,6 +465,7 @@ class Tub(Contract):
         """
         return Wad(self._contractTub.call().pie())
 
+    @block_cached
     def air(self) -> Wad:
         """Get the amount of backing collateral.
 
@@ -395,6 +474,7 @@ class Tub(Contract):
         """
         return Wad(self._contractTub.call().air())
 
+    @block_cached
     def tag(self) -> Wad:
         """Get the reference price (REF per SKR).
 
@@ -406,6 +486,7 @@ class Tub(Contract):
         """
         return Wad(self._contractJar.call().tag())
 
+    @block_cached
     def par(self) -> Wad:
         """Get the accrued holder fee (REF per SAI).
 
@@ -418,6 +499,7 @@ class Tub(Contract):
         """
         return Wad(self._contractTip.call().par())
 
+    @block_cached
     def per(self) -> Ray:
         """Get the current average entry/exit price (GEM per SKR).
 
@@ -430,6 +512,7 @@ class Tub(Contract):
         return Ray(self._contractJar.call().per())
 
     # TODO these prefixed methods are ugly, the ultimate solution would be to have a class per smart contract
+    @block_cached
     def jar_gap(self) -> Wad:
         """Get the current spread for `join` and `exit`.
 
@@ -454,6 +537,7 @@ class Tub(Contract):
                               lambda: self._contractJar.transact().jump(new_gap.value))
 
     # TODO these prefixed methods are ugly, the ultimate solution would be to have a class per smart contract
+    @block_cached
     def jar_bid(self) -> Ray:
         """Get the current `exit()` price (GEM per SKR).
 
@@ -463,6 +547,7 @@ class Tub(Contract):
         return Ray(self._contractJar.call().bid())
 
     # TODO these prefixed methods are ugly, the ultimate solution would be to have a class per smart contract
+    @block_cached
     def jar_ask(self) -> Ray:
         """Get the current `join()` price (GEM per SKR).
 
@@ -471,6 +556,7 @@ class Tub(Contract):
         """
         return Ray(self._contractJar.call().ask())
 
+    @block_cached
     def cupi(self) -> int:
         """Get the last cup id
 
@@ -479,6 +565,7 @@ class Tub(Contract):
         """
         return self._contractTub.call().cupi()
 
+    @block_cached
     def cups(self, cup_id: int) -> Cup:
         """Get the cup details.
 
@@ -492,6 +579,7 @@ class Tub(Contract):
         array = self._contractTub.call().cups(int_to_bytes32(cup_id))
         return Cup(cup_id, Address(array[0]), Wad(array[1]), Wad(array[2]))
 
+    @block_cached
     def tab(self, cup_id: int) -> Wad:
         """Get the amount of debt in a cup.
 
@@ -504,6 +592,7 @@ class Tub(Contract):
         assert isinstance(cup_id, int)
         return Wad(self._contractTub.call().tab(int_to_bytes32(cup_id)))
 
+    @block_cached
     def ink(self, cup_id: int) -> Wad:
         """Get the amount of SKR collateral locked in a cup.
 
@@ -516,6 +605,7 @@ class Tub(Contract):
         assert isinstance(cup_id, int)
         return Wad(self._contractTub.call().ink(int_to_bytes32(cup_id)))
 
+    @block_cached
     def lad(self, cup_id: int) -> Address:
         """Get the owner of a cup.
 
@@ -528,6 +618,7 @@ class Tub(Contract):
         assert isinstance(cup_id, int)
         return Address(self._contractTub.call().lad(int_to_bytes32(cup_id)))
 
+    @block_cached
     def safe(self, cup_id: int) -> bool:
         """Determine if a cup is safe.
 
@@ -678,19 +769,17 @@ class Tub(Contract):
         return self._transact(self.web3, f"Tub('{self.address}').give('{cup_id}', '{new_lad}')",
                               lambda: self._contractTub.transact().give(int_to_bytes32(cup_id), new_lad.address))
 
-    def bite(self, cup_id: int) -> Optional[Receipt]:
+    def bite(self, cup_id: int) -> Transact:
         """Initiate liquidation of an undercollateralized cup.
 
         Args:
             cup_id: Id of the cup to liquidate.
 
         Returns:
-            A `Receipt` if the Ethereum transaction was successful.
-            `None` if the Ethereum transaction failed.
+            A `Transact` instance, which can be used to trigger the transaction.
         """
         assert isinstance(cup_id, int)
-        return self._transact(self.web3, f"Tub('{self.address}').bite('{cup_id}')",
-                              lambda: self._contractTub.transact().bite(int_to_bytes32(cup_id)))
+        return Transact(self, self.web3, self.abiTub, self.address, self._contractTub, 'bite', [int_to_bytes32(cup_id)])
 
     def __eq__(self, other):
         assert(isinstance(other, Tub))
@@ -700,6 +789,117 @@ class Tub(Contract):
         return f"Tub('{self.address}')"
 
 
+class CupIndex:
+    """Keeps a local copy of all cups of a `Tub`, updated incrementally from contract events.
+
+    Going through all cups using `Tub.cups()` requires one call per cup ever created, on every
+    block. The index reads all of them only once, on the first call to `refresh()` (or to any method
+    which calls it). From that moment it watches `LogNewCup` events and the `LogNote` events emitted
+    by `lock`, `free`, `draw`, `wipe`, `give`, `bite` and `shut`, and only re-reads the cups
+    these events refer to. Cups created since the last refresh are also detected by checking `cupi()`.
+    Cups which have been shut are not kept in the index.
+
+    If `reader` is given (usually a `CupStorageReader`), cups get read through it instead of `Tub.cups()`,
+    which makes reading all the cups much faster.
+
+    Attributes:
+        tub: The `Tub` the index is kept for.
+        reader: Optional object used to read cups, with a `cups(cup_ids)` method.
+    """
+
+    CUP_FUNCTIONS = ['lock', 'free', 'draw', 'wipe', 'give', 'bite', 'shut']
+
+    def __init__(self, tub: Tub, reader=None):
+        self.tub = tub
+        self.reader = reader
+        self._cups = {}
+        self._cups_by_lad = {}
+        self._last_cup_id = 0
+        self._changed_cup_ids = set()
+        self._change_handlers = []
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _on_new_cup(self, event: LogNewCup):
+        with self._lock:
+            self._changed_cup_ids.add(event.cup_id)
+
+    def _on_note(self, event: LogNote):
+        with self._lock:
+            self._changed_cup_ids.add(event.foo)
+
+    def _initialize(self):
+        # we start watching events before reading the cups, so we do not miss anything which
+        # happens in between. at worst some cups will get read twice.
+        self.tub.on_new_cup(self._on_new_cup)
+        for function in self.CUP_FUNCTIONS:
+            self.tub.on_note(function, self._on_note)
+        self._initialized = True
+
+    def _update(self, cup: Cup):
+        self._remove(cup.cup_id)
+        if cup.lad != Address('0x0000000000000000000000000000000000000000'):
+            self._cups[cup.cup_id] = cup
+            self._cups_by_lad.setdefault(cup.lad, set()).add(cup.cup_id)
+        for handler in self._change_handlers:
+            handler(cup)
+
+    def _remove(self, cup_id: int):
+        cup = self._cups.pop(cup_id, None)
+        if cup is not None:
+            self._cups_by_lad[cup.lad].discard(cup_id)
+            if len(self._cups_by_lad[cup.lad]) == 0:
+                del self._cups_by_lad[cup.lad]
+
+    def on_change(self, handler):
+        """Calls `handler` with each cup re-read by `refresh()`.
+
+        Cups which have been shut are passed to the handler as well, with their `lad` set to zero.
+        """
+        self._change_handlers.append(handler)
+
+    def refresh(self):
+        """Brings the index up to date, re-reading only the cups which have changed."""
+        if not self._initialized:
+            self._initialize()
+
+        with self._lock:
+            changed_cup_ids = self._changed_cup_ids
+            self._changed_cup_ids = set()
+
+        last_cup_id = self.tub.cupi()
+        changed_cup_ids.update(range(self._last_cup_id + 1, last_cup_id + 1))
+        self._last_cup_id = max(self._last_cup_id, last_cup_id)
+
+        cup_ids = sorted(changed_cup_ids)
+        if self.reader is not None:
+            cups = self.reader.cups(cup_ids)
+        else:
+            cups = multi_call(self.tub.web3, [partial(self.tub.cups, cup_id) for cup_id in cup_ids])
+        for cup in cups:
+            self._update(cup)
+
+    def cups(self) -> List[Cup]:
+        """Returns all cups which haven't been shut, ordered by their ids."""
+        self.refresh()
+        return [self._cups[cup_id] for cup_id in sorted(self._cups)]
+
+    def cups_of(self, lad: Address) -> List[Cup]:
+        """Returns all cups owned by `lad` which haven't been shut, ordered by their ids."""
+        assert(isinstance(lad, Address))
+        self.refresh()
+        return [self._cups[cup_id] for cup_id in sorted(self._cups_by_lad.get(lad, set()))]
+
+    def cup(self, cup_id: int) -> Optional[Cup]:
+        """Returns the cup with the given id, or `None` if it doesn't exist or has been shut."""
+        assert(isinstance(cup_id, int))
+        self.refresh()
+        return self._cups.get(cup_id)
+
+    def __repr__(self):
+        return f"CupIndex('{self.tub.address}')"
+
+
 class Tap(Contract):
     """A client for the `Tap` contract, on of the contracts driving the `SAI Stablecoin System`.
 
@@ -727,6 +927,7 @@ class Tap(Contract):
         assert(isinstance(address, Address))
         return Transact(self, self.web3, self.abi, self.address, self._contract, 'setAuthority', [address.address])
 
+    @block_cached
     def woe(self) -> Wad:
         """Get the amount of bad debt.
 
@@ -735,6 +936,7 @@ class Tap(Contract):
         """
         return Wad(self._contract.call().woe())
 
+    @block_cached
     def fog(self) -> Wad:
         """Get the amount of SKR pending liquidation.
 
@@ -743,17 +945,19 @@ class Tap(Contract):
         """
         return Wad(self._contract.call().fog())
 
-    #TODO beware that it doesn't call drip() underneath so if `tax`>1.0 we won't get an up-to-date value of joy()
+    @block_cached
     def joy(self) -> Wad:
         """Get the amount of surplus SAI.
 
-        Surplus SAI can be processed using `boom()`.
+        Surplus SAI can be processed using `boom()`. The value doesn't include the stability fee accrued
+        since the last `drip()`, use `FeeProjection.joy()` to get an up-to-date one.
 
         Returns:
             The amount of surplus SAI accumulated in the Tub.
         """
         return Wad(self._contract.call().joy())
 
+    @block_cached
     def gap(self) -> Wad:
         """Get the current spread for `boom` and `bust`.
 
@@ -776,6 +980,7 @@ class Tap(Contract):
         return self._transact(self.web3, f"Tap('{self.address}').jump('{new_gap}')",
                               lambda: self._contract.transact().jump(new_gap.value))
 
+    @block_cached
     def s2s(self) -> Wad:
         """Get the current SKR per SAI rate (for `boom` and `bust`).
 
@@ -784,6 +989,7 @@ class Tap(Contract):
         """
         return Wad(self._contract.call().s2s())
 
+    @block_cached
     def bid(self) -> Wad:
         """Get the current price of SKR in SAI for `boom`.
 
@@ -792,6 +998,7 @@ class Tap(Contract):
         """
         return Wad(self._contract.call().bid())
 
+    @block_cached
     def ask(self) -> Wad:
         """Get the current price of SKR in SAI for `bust`.
 
@@ -800,36 +1007,32 @@ class Tap(Contract):
         """
         return Wad(self._contract.call().ask())
 
-    def boom(self, amount_in_skr: Wad) -> Optional[Receipt]:
+    def boom(self, amount_in_skr: Wad) -> Transact:
         """Buy some amount of SAI to process `joy` (surplus).
 
         Args:
             amount_in_skr: The amount of SKR we want to send in order to receive SAI.
 
         Returns:
-            A `Receipt` if the Ethereum transaction was successful.
-            `None` if the Ethereum transaction failed.
+            A `Transact` instance, which can be used to trigger the transaction.
         """
         assert isinstance(amount_in_skr, Wad)
-        return self._transact(self.web3, f"Tap('{self.address}').boom('{amount_in_skr}')",
-                              lambda: self._contract.transact().boom(amount_in_skr.value))
+        return Transact(self, self.web3, self.abi, self.address, self._contract, 'boom', [amount_in_skr.value])
 
     def boom_calldata(self, amount_in_skr: Wad) -> Calldata:
         return Calldata(self.web3.eth.contract(abi=self.abi).encodeABI('boom', [amount_in_skr]))
 
-    def bust(self, amount_in_skr: Wad) -> Optional[Receipt]:
+    def bust(self, amount_in_skr: Wad) -> Transact:
         """Sell some amount of SAI to process `woe` (bad debt).
 
         Args:
             amount_in_skr: The amount of SKR we want to receive in exchange for our SAI.
 
         Returns:
-            A `Receipt` if the Ethereum transaction was successful.
-            `None` if the Ethereum transaction failed.
+            A `Transact` instance, which can be used to trigger the transaction.
         """
         assert isinstance(amount_in_skr, Wad)
-        return self._transact(self.web3, f"Tap('{self.address}').bust('{amount_in_skr}')",
-                              lambda: self._contract.transact().bust(amount_in_skr.value))
+        return Transact(self, self.web3, self.abi, self.address, self._contract, 'bust', [amount_in_skr.value])
 
     def bust_calldata(self, amount_in_skr: Wad) -> Calldata:
         return Calldata(self.web3.eth.contract(abi=self.abi).encodeABI('bust', [amount_in_skr]))
@@ -842,6 +1045,91 @@ class Tap(Contract):
         return f"Tap('{self.address}')"
 
 
+class TubState:
+    """Values of all the `Tub` and `Tap` parameters a keeper usually needs, as of a single block.
+
+    Use `TubState.read()` to get the current state. All the values get read in one batch (see `multi_call()`),
+    pinned to one block, so they are consistent with each other.
+
+    Attributes:
+        block_number: Number of the block the values have been read as of.
+        era: Current time of the system, see `Tub.era()`.
+        reg: The `Tub` stage, see `Tub.reg()`.
+        tax: Stability fee, see `Tub.tax()`.
+        way: Holder fee, see `Tub.way()`.
+        rho: Time of the last `drip`, see `Tub.rho()`.
+        tau: Time of the last `prod`, see `Tub.tau()`.
+        tag: Reference price (REF per SKR), see `Tub.tag()`.
+        par: Accrued holder fee (REF per SAI), see `Tub.par()`.
+        per: Average entry/exit price (GEM per SKR), see `Tub.per()`.
+        chi: Internal debt price, see `Tub.chi()`.
+        mat: Liquidation ratio, see `Tub.mat()`.
+        axe: Liquidation penalty, see `Tub.axe()`.
+        hat: Debt ceiling, see `Tub.hat()`.
+        ice: Good debt, see `Tub.ice()`.
+        air: Backing collateral in SKR, see `Tub.air()`.
+        pie: Raw collateral in GEM, see `Tub.pie()`.
+        jar_bid: SKR exit price, see `Tub.jar_bid()`.
+        jar_ask: SKR entry price, see `Tub.jar_ask()`.
+        tap_joy: Surplus, see `Tap.joy()`.
+        tap_woe: Bad debt, see `Tap.woe()`.
+        tap_fog: Collateral pending liquidation, see `Tap.fog()`.
+        tap_bid: Price of `boom`, see `Tap.bid()`.
+        tap_ask: Price of `bust`, see `Tap.ask()`.
+    """
+
+    TUB_FIELDS = ['era', 'reg', 'tax', 'way', 'rho', 'tau', 'tag', 'par', 'per', 'chi', 'mat', 'axe', 'hat', 'ice', 'air',
+                  'pie', 'jar_bid', 'jar_ask']
+    TAP_FIELDS = ['joy', 'woe', 'fog', 'bid', 'ask']
+
+    def __init__(self, block_number: int, era: int, reg: int, tax: Ray, way: Ray, rho: int, tau: int,
+                 tag: Wad, par: Wad, per: Ray, chi: Ray, mat: Ray, axe: Ray, hat: Wad,
+                 ice: Wad, air: Wad, pie: Wad, jar_bid: Ray, jar_ask: Ray,
+                 tap_joy: Wad, tap_woe: Wad, tap_fog: Wad, tap_bid: Wad, tap_ask: Wad):
+        self.block_number = block_number
+        self.era = era
+        self.reg = reg
+        self.tax = tax
+        self.way = way
+        self.rho = rho
+        self.tau = tau
+        self.tag = tag
+        self.par = par
+        self.per = per
+        self.chi = chi
+        self.mat = mat
+        self.axe = axe
+        self.hat = hat
+        self.ice = ice
+        self.air = air
+        self.pie = pie
+        self.jar_bid = jar_bid
+        self.jar_ask = jar_ask
+        self.tap_joy = tap_joy
+        self.tap_woe = tap_woe
+        self.tap_fog = tap_fog
+        self.tap_bid = tap_bid
+        self.tap_ask = tap_ask
+
+    @classmethod
+    def read(cls, tub: Tub, tap: Tap, block_number: Optional[int] = None) -> 'TubState':
+        """Reads the state of `tub` and `tap` as of `block_number`, or as of the latest block if not given.
+
+        All the values get read in one round trip if `tub` is connected through a `BatchHTTPProvider`.
+        """
+        assert(isinstance(tub, Tub))
+        assert(isinstance(tap, Tap))
+        if block_number is None:
+            block_number = tub.web3.eth.blockNumber
+
+        calls = [getattr(tub, field) for field in cls.TUB_FIELDS] + [getattr(tap, field) for field in cls.TAP_FIELDS]
+        values = multi_call(tub.web3, calls, block_number)
+        return cls(block_number, *values)
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
 class Top(Contract):
     """A client for the `Top` contract, one of the `SAI Stablecoin System` contracts.
 
@@ -869,6 +1157,7 @@ class Top(Contract):
         assert(isinstance(address, Address))
         return Transact(self, self.web3, self.abi, self.address, self._contract, 'setAuthority', [address.address])
 
+    @block_cached
     def fix(self) -> Ray:
         """Get the GEM per SAI settlement price.
 
@@ -914,12 +1203,15 @@ class Lpc(Contract):
         self.address = address
         self._assert_contract_exists(web3, address)
         self._contract = web3.eth.contract(abi=self.abi)(address=address.address)
-        self._contractTip = web3.eth.contract(abi=self.abiTip)(address=self._contract.call().tip())
+        if isinstance(web3.currentProvider, BatchHTTPProvider):
+            self.prefetch_immutables()
+        self._contractTip = web3.eth.contract(abi=self.abiTip)(address=self.tip().address)
 
     def approve(self, approval_function):
         approval_function(ERC20Token(web3=self.web3, address=self.ref()), self.address, 'Lpc')
         approval_function(ERC20Token(web3=self.web3, address=self.alt()), self.address, 'Lpc')
 
+    @immutable
     def ref(self) -> Address:
         """Get the ref token.
 
@@ -928,6 +1220,7 @@ class Lpc(Contract):
         """
         return Address(self._contract.call().ref())
 
+    @immutable
     def alt(self) -> Address:
         """Get the alt token.
 
@@ -946,6 +1239,7 @@ class Lpc(Contract):
         """
         return Address(self._contract.call().pip())
 
+    @immutable
     def tip(self) -> Address:
         """Get the target price engine.
 
@@ -954,6 +1248,7 @@ class Lpc(Contract):
         """
         return Address(self._contract.call().tip())
 
+    @block_cached
     def gap(self) -> Wad:
         """Get the spread, charged on `take()`.
 
@@ -962,6 +1257,7 @@ class Lpc(Contract):
         """
         return Wad(self._contract.call().gap())
 
+    @immutable
     def lps(self) -> Address:
         """Get the LPS token (liquidity provider shares).
 
@@ -984,6 +1280,7 @@ class Lpc(Contract):
         return self._transact(self.web3, f"Lpc('{self.address}').jump('{new_gap}')",
                               lambda: self._contract.transact().jump(new_gap.value))
 
+    @block_cached
     def tag(self) -> Wad:
         """Get the current price (refs per alt).
 
@@ -994,6 +1291,7 @@ class Lpc(Contract):
         """
         return Wad(self._contract.call().tag())
 
+    @block_cached
     def pie(self) -> Wad:
         """Get the total pool value (in ref).
 
@@ -1002,6 +1300,7 @@ class Lpc(Contract):
         """
         return Wad(self._contract.call().pie())
 
+    @block_cached
     def par(self) -> Wad:
         """Get the accrued holder fee.
 
@@ -1014,6 +1313,7 @@ class Lpc(Contract):
         """
         return Wad(self._contractTip.call().par())
 
+    @block_cached
     def per(self) -> Ray:
         """Get the lps per ref ratio.
 
@@ -1063,7 +1363,7 @@ class Lpc(Contract):
         return self._transact(self.web3, f"Lpc('{self.address}').exit('{token}', '{amount}')",
                               lambda: self._contract.transact().exit(token.address, amount.value))
 
-    def take(self, token: Address, amount: Wad) -> Optional[Receipt]:
+    def take(self, token: Address, amount: Wad) -> Transact:
         """Perform an exchange.
 
         If `token` is ref, credits `amount` of ref to your account, taking the equivalent amount of alts from you.
@@ -1076,13 +1376,11 @@ class Lpc(Contract):
             amount: The value (in `token`) you want to get from the pool.
 
         Returns:
-            A `Receipt` if the Ethereum transaction was successful.
-            `None` if the Ethereum transaction failed.
+            A `Transact` instance, which can be used to trigger the transaction.
         """
         assert isinstance(token, Address)
         assert isinstance(amount, Wad)
-        return self._transact(self.web3, f"Lpc('{self.address}').take('{token}', '{amount}')",
-                              lambda: self._contract.transact().take(token.address, amount.value))
+        return Transact(self, self.web3, self.abi, self.address, self._contract, 'take', [token.address, amount.value])
 
     def take_calldata(self, token: Address, amount: Wad) -> Calldata:
         return Calldata(self.web3.eth.contract(abi=self.abi).encodeABI('take', [token.address, amount.value]))
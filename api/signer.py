@@ -0,0 +1,150 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+from typing import Optional
+
+import rlp
+from eth_utils import decode_hex, encode_hex, keccak
+from ethereum.keys import decode_keystore_json
+from ethereum.transactions import Transaction
+from ethereum.utils import privtoaddr
+from secp256k1 import PrivateKey
+from web3 import Web3
+from web3.utils.transactions import get_buffered_gas_estimate
+
+from api import Address
+
+
+class LocalSigner:
+    """Signs transactions and messages in-process, with the private key of one account.
+
+    Once attached to a `Web3` instance with `attach()`, all the transactions sent from the account through
+    `web3.eth.sendTransaction` (which includes all the transactions sent by the contract wrappers) get built
+    and signed locally and then submitted with `eth_sendRawTransaction`. So the node doesn't need to hold
+    the key, and there is no need to have the account unlocked. Nonce, gas price and gas limit, if not
+    specified in the transaction, get filled in the same way the node would fill them.
+
+    Attributes:
+        address: Address of the account.
+    """
+
+    _signers = {}
+    _signers_lock = threading.Lock()
+
+    def __init__(self, private_key: bytes):
+        assert(isinstance(private_key, bytes))
+        assert(len(private_key) == 32)
+        self._private_key = private_key
+        self.address = Address(encode_hex(privtoaddr(private_key)))
+
+    @staticmethod
+    def from_keystore(keystore_file: str, password: str) -> 'LocalSigner':
+        """Creates a signer using the key from a JSON key store file (the format used by `geth` and `parity`)."""
+        assert(isinstance(keystore_file, str))
+        assert(isinstance(password, str))
+        with open(keystore_file) as file:
+            keystore = json.load(file)
+        return LocalSigner(decode_keystore_json(keystore, password))
+
+    @classmethod
+    def for_account(cls, web3: Web3, address: Address) -> Optional['LocalSigner']:
+        """Returns the signer attached to `web3` for `address`, or `None` if there isn't any."""
+        with cls._signers_lock:
+            signer = cls._signers.get((id(web3), address.address))
+            return signer[1] if signer is not None else None
+
+    def attach(self, web3: Web3):
+        """Makes `web3.eth.sendTransaction` sign all the transactions sent from our account with this signer.
+
+        All the signers attached to the same `Web3` instance share a single wrapper of `web3.eth.sendTransaction`,
+        which is the only one there can be, so the method must not be wrapped by anything else beforehand.
+        """
+        assert(isinstance(web3, Web3))
+        with self._signers_lock:
+            if (id(web3), self.address.address) in self._signers:
+                return
+            if not self._is_signing(web3):
+                # anything wrapping `sendTransaction` before us would have its changes bypassed by raw transactions
+                assert(getattr(web3.eth.sendTransaction, '__self__', None) is web3.eth)
+                web3.eth.sendTransaction = self._send_transaction_signed(web3, web3.eth.sendTransaction)
+            self._signers[(id(web3), self.address.address)] = (web3, self)
+
+    @staticmethod
+    def _is_signing(web3: Web3) -> bool:
+        return getattr(web3.eth.sendTransaction, 'signs_locally', False)
+
+    @staticmethod
+    def _send_transaction_signed(web3: Web3, send_transaction):
+        def send_transaction_signed(transaction: dict):
+            sender = transaction.get('from', web3.eth.defaultAccount)
+            signer = LocalSigner.for_account(web3, Address(sender)) if isinstance(sender, str) else None
+            if signer is None:
+                return send_transaction(transaction)
+            return signer.send_transaction(web3, transaction)
+
+        send_transaction_signed.signs_locally = True
+        return send_transaction_signed
+
+    def send_transaction(self, web3: Web3, transaction: dict) -> str:
+        """Signs `transaction` and submits it with `eth_sendRawTransaction`.
+
+        Returns:
+            Hash of the transaction sent.
+        """
+        assert(isinstance(web3, Web3))
+        assert(isinstance(transaction, dict))
+
+        transaction = dict(transaction, **{'from': self.address.address})
+        if 'nonce' not in transaction:
+            transaction['nonce'] = web3.eth.getTransactionCount(self.address.address, 'pending')
+        if 'gasPrice' not in transaction:
+            transaction['gasPrice'] = web3.eth.gasPrice
+        if 'gas' not in transaction:
+            estimate_transaction = {key: value for key, value in transaction.items() if key in ['from', 'to', 'data', 'value']}
+            transaction['gas'] = get_buffered_gas_estimate(web3, estimate_transaction) if 'data' in transaction else 90000
+
+        return web3.eth.sendRawTransaction(self.sign_transaction(transaction))
+
+    def sign_transaction(self, transaction: dict) -> str:
+        """Signs `transaction`, which has to have `nonce`, `gasPrice` and `gas` specified.
+
+        Returns:
+            The signed transaction, encoded as hex as expected by `eth_sendRawTransaction`.
+        """
+        assert(isinstance(transaction, dict))
+        signed_transaction = Transaction(nonce=transaction['nonce'],
+                                         gasprice=transaction['gasPrice'],
+                                         startgas=transaction['gas'],
+                                         to=decode_hex(transaction['to']) if transaction.get('to') else b'',
+                                         value=transaction.get('value', 0),
+                                         data=decode_hex(transaction.get('data', '0x'))).sign(self._private_key)
+        return encode_hex(rlp.encode(signed_transaction))
+
+    def sign(self, data: bytes) -> str:
+        """Signs `data` in the same way `eth_sign` does, i.e. with the `Ethereum Signed Message` prefix.
+
+        Returns:
+            The signature, encoded as hex in the same format `eth_sign` returns it (`r`, `s` and `v`).
+        """
+        assert(isinstance(data, bytes))
+        message_hash = keccak(b"\x19Ethereum Signed Message:\n" + str(len(data)).encode() + data)
+        private_key = PrivateKey(self._private_key, raw=True)
+        signature, recovery_id = private_key.ecdsa_recoverable_serialize(
+            private_key.ecdsa_sign_recoverable(message_hash, raw=True))
+        return encode_hex(signature + bytes([recovery_id + 27]))
@@ -0,0 +1,171 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from functools import partial
+from typing import List, Optional
+
+from eth_utils import keccak
+from web3 import Web3
+
+from api import Address, Wad
+from api.batch import multi_call
+from api.oasis import SimpleMarket, OfferInfo
+from api.sai import Tub, Cup
+
+
+def mapping_slot(slot: int, key: int) -> int:
+    """Returns the storage slot at which the value of `key` in the Solidity mapping kept at `slot` starts."""
+    return int.from_bytes(keccak(key.to_bytes(32, 'big') + slot.to_bytes(32, 'big')), 'big')
+
+
+def storage_at(web3: Web3, address: Address, slot: int) -> int:
+    """Returns the contents of the storage slot `slot` of the contract at `address`, as an integer."""
+    value = web3.eth.getStorageAt(address.address, slot)
+    return int(value, 16) if isinstance(value, str) else int.from_bytes(value, 'big')
+
+
+def _address(value: int) -> Address:
+    return Address('0x' + format(value & (2**160 - 1), '040x'))
+
+
+class StorageReader:
+    """Base class for readers of Solidity mappings, decoding entries straight from the contract storage.
+
+    Reading an entry through the ABI getter needs an `eth_call`, which executes contract code on the node.
+    Reading the raw storage slots with `eth_getStorageAt` is much cheaper for the node, and all the slots of
+    many entries can be read in one batch (see `multi_call()`).
+
+    As the storage layout is not a part of the contract ABI, the first entries read are also read through
+    the ABI getter and compared. If they do not match, the reader logs a warning and from that moment
+    reads all the entries through the ABI getter instead, so the results are always correct.
+
+    Not to be used directly, see `CupStorageReader` and `OfferStorageReader`.
+    """
+
+    logger = logging.getLogger('api')
+
+    # number of entries compared with the results of the ABI getter before the storage layout gets trusted
+    VALIDATION_SAMPLE = 3
+
+    # number of storage slots taken by each entry
+    SLOTS_PER_ENTRY = None
+
+    def __init__(self, web3: Web3, address: Address, slot: int):
+        self.web3 = web3
+        self.address = address
+        self.slot = slot
+        self._validated = 0
+        self._broken = False
+
+    def _decode(self, key: int, slots: List[int]):
+        raise NotImplementedError("_decode() not implemented")
+
+    def _read_abi(self, key: int):
+        raise NotImplementedError("_read_abi() not implemented")
+
+    def _read_raw(self, keys: List[int]) -> list:
+        count = self.SLOTS_PER_ENTRY
+        slots = multi_call(self.web3, [partial(storage_at, self.web3, self.address, mapping_slot(self.slot, key) + offset)
+                                       for key in keys for offset in range(count)])
+        return [self._decode(key, slots[index*count:(index+1)*count]) for index, key in enumerate(keys)]
+
+    def read(self, keys: List[int]) -> list:
+        """Reads the entries for all `keys`, in as few round trips as possible."""
+        if self._broken:
+            return multi_call(self.web3, [partial(self._read_abi, key) for key in keys])
+
+        values = self._read_raw(keys)
+        if self._validated < self.VALIDATION_SAMPLE:
+            # empty entries do not tell much about the layout, so we prefer to validate the other ones
+            sample = sorted(zip(keys, values), key=lambda item: item[1] is None)
+            sample = sample[0:self.VALIDATION_SAMPLE - self._validated]
+            expected = multi_call(self.web3, [partial(self._read_abi, key) for key, value in sample])
+            if [self._as_tuple(value) for key, value in sample] != [self._as_tuple(value) for value in expected]:
+                self.logger.warning(f"Storage layout of {self.address} does not match, falling back to ABI calls")
+                self._broken = True
+                return self.read(keys)
+            self._validated += len([value for key, value in sample if value is not None])
+
+        return values
+
+    @staticmethod
+    def _as_tuple(value) -> Optional[tuple]:
+        return tuple(vars(value).items()) if value is not None else None
+
+
+class CupStorageReader(StorageReader):
+    """Reads `Tub` cups straight from its storage.
+
+    Each cup takes two storage slots: `lad` and then `art` and `ink` packed together, 128 bits each.
+    """
+
+    CUPS_SLOT = 16
+    SLOTS_PER_ENTRY = 2
+
+    def __init__(self, tub: Tub, slot: int = CUPS_SLOT):
+        assert(isinstance(tub, Tub))
+        super().__init__(tub.web3, tub.address, slot)
+        self.tub = tub
+
+    def _decode(self, cup_id: int, slots: List[int]) -> Cup:
+        lad, art_and_ink = slots
+        return Cup(cup_id, _address(lad), Wad(art_and_ink & (2**128 - 1)), Wad(art_and_ink >> 128))
+
+    def _read_abi(self, cup_id: int) -> Cup:
+        return self.tub.cups(cup_id)
+
+    def cups(self, cup_ids: List[int]) -> List[Cup]:
+        """Reads the cups with ids `cup_ids`. The result is the same as calling `Tub.cups()` for each of them."""
+        return self.read(cup_ids)
+
+
+class OfferStorageReader(StorageReader):
+    """Reads `SimpleMarket` offers straight from its storage.
+
+    Each offer takes five storage slots: `sell_how_much`, `sell_which_token`, `buy_how_much`, `buy_which_token`
+    and then `owner`, `active` and `timestamp` packed together.
+    """
+
+    OFFERS_SLOT = 1
+    SLOTS_PER_ENTRY = 5
+
+    def __init__(self, market: SimpleMarket, slot: int = OFFERS_SLOT):
+        assert(isinstance(market, SimpleMarket))
+        super().__init__(market.web3, market.address, slot)
+        self.market = market
+
+    def _decode(self, offer_id: int, slots: List[int]) -> Optional[OfferInfo]:
+        sell_how_much, sell_which_token, buy_how_much, buy_which_token, packed = slots
+        active = (packed >> 160) & 0xff
+        if not active:
+            return None
+        return OfferInfo(offer_id=offer_id,
+                         sell_how_much=Wad(sell_how_much),
+                         sell_which_token=_address(sell_which_token),
+                         buy_how_much=Wad(buy_how_much),
+                         buy_which_token=_address(buy_which_token),
+                         owner=_address(packed),
+                         timestamp=(packed >> 168) & (2**64 - 1))
+
+    def _read_abi(self, offer_id: int) -> Optional[OfferInfo]:
+        return self.market.get_offer(offer_id)
+
+    def offers(self, offer_ids: List[int]) -> List[Optional[OfferInfo]]:
+        """Reads the offers with ids `offer_ids`. The result is the same as calling `SimpleMarket.get_offer()`
+        for each of them, i.e. `None` for offers which are not active anymore."""
+        return self.read(offer_ids)
@@ -0,0 +1,93 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from api.accrual import FeeProjection
+from api.conftest import SaiDeployment
+from api.feed import DSValue
+from api.numeric import Wad, Ray
+
+
+class TestFeeProjection:
+    @pytest.fixture()
+    def tub_with_debt(self, sai: SaiDeployment) -> SaiDeployment:
+        sai.tub.join(Wad.from_number(100)).transact()
+        sai.tub.cork(Wad.from_number(1000000)).transact()
+        DSValue(web3=sai.web3, address=sai.tub.pip()).poke_with_int(Wad.from_number(250.45).value).transact()
+        sai.tub.open()
+        sai.tub.lock(1, Wad.from_number(10))
+        sai.tub.draw(1, Wad(1234567891234567891234))
+        sai.tub.crop(Ray(1000000000158153903837946257)).transact()
+        sai.tub.coax(Ray(1000000000070000000000000007)).transact()
+        sai.tub.drip().transact()
+        sai.tub.prod().transact()
+        return sai
+
+    @pytest.mark.parametrize("seconds", [1, 7, 1001, 86399, 2678403])
+    def test_should_project_chi_and_par(self, tub_with_debt: SaiDeployment, seconds: int):
+        # given
+        sai = tub_with_debt
+        projection = FeeProjection.read(sai.tub, sai.tap)
+
+        # when
+        sai.tub.warp(seconds).transact()
+
+        # then
+        assert projection.chi(sai.tub.era()) == sai.tub.chi()
+        assert projection.par(sai.tub.era()) == sai.tub.par()
+
+    @pytest.mark.parametrize("seconds", [1, 7, 1001, 86399, 2678403])
+    def test_should_project_ice_and_joy(self, tub_with_debt: SaiDeployment, seconds: int):
+        # given
+        sai = tub_with_debt
+        projection = FeeProjection.read(sai.tub, sai.tap)
+        sai.tub.warp(seconds).transact()
+        era = sai.tub.era()
+
+        # when
+        sai.tub.drip().transact()
+
+        # then
+        assert projection.dew(era) > Wad(0)
+        assert projection.ice(era) == sai.tub.ice()
+        assert projection.joy(era) == sai.tap.joy()
+        assert projection.woe(era) == sai.tap.woe()
+
+    def test_should_not_project_into_the_past(self, tub_with_debt: SaiDeployment):
+        # given
+        sai = tub_with_debt
+        projection = FeeProjection.read(sai.tub, sai.tap)
+
+        # expect
+        with pytest.raises(AssertionError):
+            projection.chi(projection.state.era - 1)
+
+    def test_should_project_joy_from_a_snapshot_taken_after_drip(self, tub_with_debt: SaiDeployment):
+        # given
+        sai = tub_with_debt
+        sai.tub.warp(3600).transact()
+        projection = FeeProjection.read(sai.tub, sai.tap)
+        sai.tub.warp(86400).transact()
+        era = sai.tub.era()
+
+        # when
+        sai.tub.drip().transact()
+
+        # then
+        assert abs((projection.joy(era) - sai.tap.joy()).value) <= 10
+        assert abs((projection.chi(era) - sai.tub.chi()).value) <= 10
@@ -0,0 +1,160 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from web3 import Web3
+
+from api.batch import BatchHTTPProvider, multi_call
+from api.cache import block_cache
+from api.conftest import SaiDeployment, JsonRpcServer
+from api.numeric import Wad
+from api.sai import Tub
+
+
+class TestMultiCall:
+    def test_should_return_the_same_values_as_direct_calls(self, sai: SaiDeployment, tub: Tub):
+        # when
+        values = multi_call(tub.web3, [tub.axe, tub.mat, tub.tax, tub.hat, tub.per, tub.era])
+
+        # then
+        assert values == [sai.tub.axe(), sai.tub.mat(), sai.tub.tax(), sai.tub.hat(), sai.tub.per(), sai.tub.era()]
+
+    def test_should_send_all_calls_in_one_round_trip(self, sai: SaiDeployment, tub: Tub, server: JsonRpcServer):
+        # given
+        server.round_trips = 0
+
+        # when
+        multi_call(tub.web3, [tub.axe, tub.mat, tub.tax, tub.hat, tub.per, tub.era])
+
+        # then
+        assert server.round_trips == 1
+
+        # and
+        server.round_trips = 0
+        [tub.axe(), tub.mat(), tub.tax(), tub.hat(), tub.per(), tub.era()]
+        assert server.round_trips == 6
+
+    def test_should_batch_sequential_calls_in_rounds(self, sai: SaiDeployment, tub: Tub, server: JsonRpcServer):
+        # given
+        server.round_trips = 0
+
+        # when
+        values = multi_call(tub.web3, [lambda: (tub.axe(), tub.mat()), lambda: (tub.tax(), tub.hat())])
+
+        # then
+        assert values == [(sai.tub.axe(), sai.tub.mat()), (sai.tub.tax(), sai.tub.hat())]
+        assert server.round_trips == 2
+
+    def test_should_pin_calls_to_block(self, sai: SaiDeployment, tub: Tub, server: JsonRpcServer):
+        # given
+        server.requests = []
+
+        # when
+        values = multi_call(tub.web3, [tub.axe, tub.mat], 5)
+
+        # then
+        assert values == [sai.tub.axe(), sai.tub.mat()]
+        assert [request['params'][-1] for request in server.requests] == ['0x5', '0x5']
+
+    def test_should_not_mix_pinned_calls_with_values_cached_for_the_current_block(self, sai: SaiDeployment, tub: Tub,
+                                                                                  server: JsonRpcServer):
+        # given
+        hat, axe = sai.tub.hat(), sai.tub.axe()
+        block_cache.enable()
+        block_cache.new_block(6)
+        block_cache.get('Tub.hat', ('Tub.hat', id(tub.web3), tub.address, (), 6), lambda: Wad.from_number(777))
+        server.requests = []
+
+        try:
+            # when
+            values = multi_call(tub.web3, [tub.hat, tub.axe], 5)
+
+            # then
+            assert values == [hat, axe]
+            assert [request['params'][-1] for request in server.requests] == ['0x5', '0x5']
+
+            # when
+            server.requests = []
+
+            # then
+            assert tub.hat() == Wad.from_number(777)
+            assert tub.axe() == axe
+            assert len(server.requests) == 1
+        finally:
+            block_cache.disable()
+
+    def test_should_split_large_batches_into_chunks(self, sai: SaiDeployment, server: JsonRpcServer):
+        # given
+        web3 = Web3(BatchHTTPProvider(server.endpoint_uri, max_batch_size=4))
+        web3.eth.defaultAccount = sai.web3.eth.defaultAccount
+        tub = Tub(web3=web3, address=sai.tub.address)
+        server.round_trips = 0
+
+        # when
+        values = multi_call(web3, [tub.axe, tub.mat, tub.tax, tub.hat, tub.per, tub.era])
+
+        # then
+        assert values == [sai.tub.axe(), sai.tub.mat(), sai.tub.tax(), sai.tub.hat(), sai.tub.per(), sai.tub.era()]
+        assert server.round_trips == 2
+
+    def test_should_do_nothing_for_empty_list_of_calls(self, tub: Tub, server: JsonRpcServer):
+        # given
+        server.round_trips = 0
+
+        # expect
+        assert multi_call(tub.web3, []) == []
+        assert server.round_trips == 0
+
+    def test_should_evaluate_calls_one_by_one_if_provider_does_not_support_batches(self, sai: SaiDeployment):
+        assert multi_call(sai.web3, [sai.tub.axe, sai.tub.mat]) == [sai.tub.axe(), sai.tub.mat()]
+        assert multi_call(sai.web3, [sai.tub.axe], sai.web3.eth.blockNumber) == [sai.tub.axe()]
+
+    def test_should_refuse_to_read_past_blocks_if_provider_does_not_support_batches(self, sai: SaiDeployment):
+        with pytest.raises(ValueError):
+            multi_call(sai.web3, [sai.tub.axe, sai.tub.mat], sai.web3.eth.blockNumber - 1)
+
+    def test_should_warn_if_call_makes_different_requests_when_replayed(self, sai: SaiDeployment, tub: Tub,
+                                                                        server: JsonRpcServer, caplog):
+        # given
+        calls = iter([tub.axe, tub.mat])
+
+        # when
+        values = multi_call(tub.web3, [lambda: next(calls)()])
+
+        # then
+        assert values == [sai.tub.mat()]
+        assert "instead of" in caplog.text
+
+
+class TestPrefetchImmutables:
+    def test_should_read_all_immutable_values_in_one_round_trip(self, sai: SaiDeployment):
+        # given
+        server = JsonRpcServer(sai.web3.currentProvider)
+        web3 = Web3(BatchHTTPProvider(server.endpoint_uri))
+        web3.eth.defaultAccount = sai.web3.eth.defaultAccount
+
+        try:
+            # when
+            tub = Tub(web3=web3, address=sai.tub.address)
+            server.round_trips = 0
+
+            # then
+            assert [tub.sai(), tub.skr(), tub.gem(), tub.jar(), tub.pit()] == \
+                   [sai.sai.address, sai.skr.address, sai.gem.address, sai.tub.jar(), sai.tub.pit()]
+            assert server.round_trips == 0
+        finally:
+            server.shutdown()
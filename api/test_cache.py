@@ -0,0 +1,183 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from api import Address
+from api.cache import BlockCache, block_cache, block_cached, immutable
+from api.conftest import SaiDeployment
+from api.numeric import Wad
+from api.sai import Tub
+
+
+class Counting:
+    def __init__(self, address: Address, web3=None):
+        self.web3 = web3
+        self.address = address
+        self.calls = 0
+
+    @block_cached
+    def value(self, multiplier: int = 1):
+        self.calls += 1
+        return self.calls * multiplier
+
+
+class Wired:
+    def __init__(self):
+        self.calls = 0
+
+    @immutable
+    def component(self):
+        self.calls += 1
+        return self.calls
+
+
+@pytest.fixture()
+def enabled_cache():
+    block_cache.enable()
+    block_cache.new_block(1)
+    block_cache.hits.clear()
+    block_cache.misses.clear()
+    yield block_cache
+    block_cache.disable()
+    block_cache.include('Counting.value')
+
+
+class TestBlockCache:
+    def setup_method(self):
+        self.counting = Counting(Address('0x0000000000000000000000000000000000000001'))
+
+    def test_should_be_disabled_by_default(self):
+        # expect
+        assert BlockCache().enabled is False
+
+        # and
+        assert self.counting.value() == 1
+        assert self.counting.value() == 2
+
+    def test_should_cache_values_within_a_block(self, enabled_cache: BlockCache):
+        # expect
+        assert self.counting.value() == 1
+        assert self.counting.value() == 1
+        assert self.counting.value(10) == 20
+        assert self.counting.value(10) == 20
+        assert enabled_cache.hits['Counting.value'] == 2
+        assert enabled_cache.misses['Counting.value'] == 2
+
+    def test_should_cache_values_separately_for_each_instance(self, enabled_cache: BlockCache):
+        # given
+        other = Counting(Address('0x0000000000000000000000000000000000000002'))
+
+        # expect
+        assert self.counting.value() == 1
+        assert other.value() == 1
+        assert self.counting.calls == 1
+        assert other.calls == 1
+
+    def test_should_cache_values_separately_for_each_web3(self, enabled_cache: BlockCache):
+        # given
+        address = Address('0x0000000000000000000000000000000000000001')
+        counting, other = Counting(address, object()), Counting(address, object())
+
+        # expect
+        assert counting.value() == 1
+        assert other.value() == 1
+        assert counting.calls == 1
+        assert other.calls == 1
+
+    def test_should_clear_values_on_new_block(self, enabled_cache: BlockCache):
+        # given
+        assert self.counting.value() == 1
+
+        # when
+        enabled_cache.new_block(1)
+
+        # then
+        assert self.counting.value() == 1
+
+        # when
+        enabled_cache.new_block(2)
+
+        # then
+        assert self.counting.value() == 2
+
+    def test_should_not_serve_values_read_in_another_block(self, enabled_cache: BlockCache):
+        # given
+        assert self.counting.value() == 1
+        assert ('Counting.value', id(None), self.counting.address, (), 1) in enabled_cache._values
+
+        # when
+        enabled_cache.block_number = 2
+
+        # then
+        assert self.counting.value() == 2
+        assert self.counting.value() == 2
+
+    def test_should_not_cache_excluded_methods(self, enabled_cache: BlockCache):
+        # when
+        enabled_cache.exclude('Counting.value')
+
+        # then
+        assert self.counting.value() == 1
+        assert self.counting.value() == 2
+        assert enabled_cache.misses['Counting.value'] == 0
+
+    def test_should_clear_values_when_our_transaction_gets_mined(self, sai: SaiDeployment, enabled_cache: BlockCache):
+        # given
+        assert sai.gem.balance_of(sai.our_address) == Wad.from_number(1000000)
+        assert sai.gem.balance_of(sai.our_address) == Wad.from_number(1000000)
+        assert enabled_cache.hits['ERC20Token.balance_of'] == 1
+
+        # when
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000002'), Wad.from_number(1)).transact()
+
+        # then
+        assert sai.gem.balance_of(sai.our_address) == Wad.from_number(999999)
+
+
+class TestImmutable:
+    def test_should_read_the_value_only_once(self):
+        # given
+        wired = Wired()
+
+        # expect
+        assert wired.component() == 1
+        assert wired.component() == 1
+        assert wired.calls == 1
+
+    def test_should_keep_values_separately_for_each_instance(self):
+        # given
+        wired_1 = Wired()
+        wired_2 = Wired()
+        wired_1.calls = 10
+
+        # expect
+        assert wired_1.component() == 11
+        assert wired_2.component() == 1
+
+    def test_should_serve_tub_wiring_from_memory(self, sai: SaiDeployment):
+        # given
+        tub = Tub(web3=sai.web3, address=sai.tub.address)
+
+        # expect
+        assert set(tub._immutable_values.keys()) == {'tip', 'jar', 'jug'}
+
+        # and
+        assert tub.sai() == sai.sai.address
+        assert tub.skr() == sai.skr.address
+        assert tub.gem() == sai.gem.address
+        assert set(tub._immutable_values.keys()) == {'tip', 'jar', 'jug', 'sai', 'skr', 'gem'}
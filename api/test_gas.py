@@ -0,0 +1,154 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from api import Address, Wad
+from api.conftest import SaiDeployment
+from api.gas import DefaultGasPrice, FixedGasPrice, NodeGasPrice, PercentileGasPrice, IncreasingGasPrice
+from api.nonce import NonceManager
+from api.receipts import ReceiptTracker
+
+GWEI = 1000000000
+STUCK_HASH = '0x' + 'ab' * 32
+
+
+class TestGasPrice:
+    def test_default_gas_price_should_leave_it_to_the_node(self):
+        assert DefaultGasPrice().get_gas_price(0) is None
+        assert DefaultGasPrice().get_gas_price(100) is None
+
+    def test_fixed_gas_price_should_never_change(self):
+        assert FixedGasPrice(20 * GWEI).get_gas_price(0) == 20 * GWEI
+        assert FixedGasPrice(20 * GWEI).get_gas_price(100) == 20 * GWEI
+
+    def test_node_gas_price_should_be_read_from_the_node(self, sai: SaiDeployment):
+        assert NodeGasPrice(sai.web3).get_gas_price(0) == sai.web3.eth.gasPrice
+
+    def test_increasing_gas_price_should_increase_every_few_blocks(self):
+        # given
+        gas_price = IncreasingGasPrice(FixedGasPrice(8 * GWEI), every_blocks=3, increase=1.5)
+
+        # expect
+        assert [gas_price.get_gas_price(blocks) for blocks in range(0, 7)] == \
+               [8 * GWEI, 8 * GWEI, 8 * GWEI, 12 * GWEI, 12 * GWEI, 12 * GWEI, 18 * GWEI]
+
+    def test_increasing_gas_price_should_not_exceed_max_price(self):
+        # given
+        gas_price = IncreasingGasPrice(FixedGasPrice(8 * GWEI), every_blocks=1, increase=1.5, max_price=15 * GWEI)
+
+        # expect
+        assert [gas_price.get_gas_price(blocks) for blocks in range(0, 4)] == \
+               [8 * GWEI, 12 * GWEI, 15 * GWEI, 15 * GWEI]
+
+    def test_increasing_gas_price_should_leave_it_to_the_node_if_base_does(self):
+        assert IncreasingGasPrice(DefaultGasPrice(), every_blocks=1).get_gas_price(10) is None
+
+    def test_percentile_gas_price_should_be_based_on_recent_blocks(self, sai: SaiDeployment):
+        # given
+        for gas_price in [5, 1, 4, 2, 3]:
+            sai.web3.eth.sendTransaction({'from': sai.web3.eth.defaultAccount,
+                                          'to': '0x0000000000000000000000000000000000000001',
+                                          'value': 1,
+                                          'gasPrice': gas_price * GWEI})
+
+        # expect
+        assert PercentileGasPrice(sai.web3, 50, number_of_blocks=5).get_gas_price(0) == 3 * GWEI
+        assert PercentileGasPrice(sai.web3, 100, number_of_blocks=5).get_gas_price(0) == 5 * GWEI
+        assert PercentileGasPrice(sai.web3, 0, number_of_blocks=5).get_gas_price(0) == 1 * GWEI
+        assert PercentileGasPrice(sai.web3, 50, number_of_blocks=2).get_gas_price(0) == 2 * GWEI
+
+
+class TestTransactGasPrice:
+    @pytest.fixture(autouse=True)
+    def fast_tracker(self, sai: SaiDeployment, monkeypatch):
+        monkeypatch.setattr(ReceiptTracker.for_web3(sai.web3), 'poll_interval', 0.05)
+
+    @pytest.fixture()
+    def sent(self, sai: SaiDeployment, monkeypatch):
+        sent = []
+        send_transaction = sai.web3.eth.sendTransaction
+        get_transaction = sai.web3.eth.getTransaction
+
+        def stuck_send_transaction(transaction):
+            sent.append(dict(transaction))
+            if 'nonce' not in transaction:
+                # the original transaction never gets mined, but other transactions keep the blocks coming
+                send_transaction({'from': sai.web3.eth.defaultAccount,
+                                  'to': '0x0000000000000000000000000000000000000001',
+                                  'value': 1})
+                return STUCK_HASH
+            else:
+                return send_transaction({key: value for key, value in transaction.items() if key != 'nonce'})
+
+        monkeypatch.setattr(sai.web3.eth, 'sendTransaction', stuck_send_transaction)
+        monkeypatch.setattr(sai.web3.eth, 'getTransaction',
+                            lambda transaction_hash: {'nonce': 7} if transaction_hash == STUCK_HASH
+                            else get_transaction(transaction_hash))
+        return sent
+
+    def test_should_send_transaction_with_gas_price(self, sai: SaiDeployment):
+        # when
+        receipt = sai.sai.approve(Address('0x0000000000000000000000000000000000000002'), Wad(1)) \
+            .transact(FixedGasPrice(7 * GWEI))
+
+        # then
+        assert receipt is not None
+        assert sai.web3.eth.getTransaction(receipt.transaction_hash)['gasPrice'] == 7 * GWEI
+
+    def test_should_replace_pending_transaction_with_same_nonce_and_higher_gas_price(self, sai: SaiDeployment, sent):
+        # when
+        receipt = sai.sai.approve(Address('0x0000000000000000000000000000000000000002'), Wad(1)) \
+            .transact(IncreasingGasPrice(FixedGasPrice(8 * GWEI), every_blocks=1, increase=1.5))
+
+        # then
+        assert receipt is not None
+        assert receipt.transaction_hash != STUCK_HASH
+        assert [transaction.get('gasPrice') for transaction in sent] == [8 * GWEI, 12 * GWEI]
+        assert [transaction.get('nonce') for transaction in sent] == [None, 7]
+
+        # and
+        assert ReceiptTracker.for_web3(sai.web3).pending() == []
+
+    def test_should_replace_transaction_sent_with_nonce_manager(self, sai: SaiDeployment, poller, monkeypatch):
+        # given
+        sent = []
+        send_transaction = sai.web3.eth.sendTransaction
+
+        def stuck_send_transaction(transaction):
+            sent.append(dict(transaction))
+            if len(sent) == 1:
+                send_transaction({'from': sai.web3.eth.defaultAccount,
+                                  'to': '0x0000000000000000000000000000000000000001',
+                                  'value': 1})
+                return STUCK_HASH
+            else:
+                return send_transaction({key: value for key, value in transaction.items() if key != 'nonce'})
+
+        monkeypatch.setattr(sai.web3.eth, 'sendTransaction', stuck_send_transaction)
+        monkeypatch.setattr(sai.web3.eth, 'getTransaction', lambda transaction_hash: None)
+        nonce = sai.web3.eth.getTransactionCount(sai.web3.eth.defaultAccount)
+
+        # when
+        receipt = sai.sai.approve(Address('0x0000000000000000000000000000000000000002'), Wad(1)) \
+            .transact(IncreasingGasPrice(FixedGasPrice(8 * GWEI), every_blocks=1, increase=1.5),
+                      NonceManager(sai.web3, sai.our_address))
+
+        # then
+        assert receipt is not None
+        assert [transaction.get('gasPrice') for transaction in sent] == [8 * GWEI, 12 * GWEI]
+        assert [transaction.get('nonce') for transaction in sent] == [nonce, nonce]
@@ -0,0 +1,318 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+import api.logs
+from api import Address
+from api.conftest import SaiDeployment
+from api.logs import LogPoller, LogScanner
+from api.numeric import Wad
+
+
+class TestLogPoller:
+    def test_should_dispatch_events_from_new_blocks_only(self, sai: SaiDeployment):
+        # given
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact()
+        events = []
+        poller = LogPoller(sai.web3)
+        poller.subscribe_event(sai.gem._contract, 'Transfer', events.append)
+        poller.poll()
+
+        # when
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000002'), Wad(2)).transact()
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000003'), Wad(3)).transact()
+        poller.poll()
+
+        # then
+        assert len(events) == 2
+        assert events[0]['event'] == 'Transfer'
+        assert events[0]['args']['value'] == 2
+        assert events[1]['args']['value'] == 3
+
+        # when
+        poller.poll()
+
+        # then
+        assert len(events) == 2
+
+    def test_should_dispatch_events_emitted_between_subscribing_and_the_first_poll(self, sai: SaiDeployment):
+        # given
+        events = []
+        poller = LogPoller(sai.web3)
+        poller.subscribe_event(sai.gem._contract, 'Transfer', events.append)
+
+        # when
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact()
+        poller.poll()
+
+        # then
+        assert len(events) == 1
+        assert events[0]['args']['value'] == 1
+
+    def test_should_dispatch_events_of_many_contracts_at_once(self, sai: SaiDeployment):
+        # given
+        gem_events = []
+        sai_events = []
+        skr_events = []
+        poller = LogPoller(sai.web3)
+        poller.subscribe_event(sai.gem._contract, 'Transfer', gem_events.append)
+        poller.subscribe_event(sai.sai._contract, 'Transfer', sai_events.append)
+        poller.subscribe_event(sai.skr._contract, 'Transfer', skr_events.append)
+        poller.poll()
+
+        # when
+        sai.tub.join(Wad.from_number(10)).transact()
+        poller.poll()
+
+        # then
+        assert len(gem_events) == 1
+        assert len(sai_events) == 0
+        assert len(skr_events) == 1
+
+    def test_should_notify_about_new_blocks(self, sai: SaiDeployment):
+        # given
+        blocks = []
+        poller = LogPoller(sai.web3)
+        poller.on_block(blocks.append)
+        poller.poll()
+
+        # when
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact()
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact()
+        poller.poll()
+
+        # then
+        assert blocks == [sai.web3.eth.getBlock('latest')['hash']]
+
+    def test_should_survive_failing_handlers(self, sai: SaiDeployment):
+        # given
+        events = []
+
+        def failing_handler(event):
+            raise Exception("Handler failed")
+
+        poller = LogPoller(sai.web3)
+        poller.subscribe_event(sai.gem._contract, 'Transfer', failing_handler)
+        poller.subscribe_event(sai.gem._contract, 'Transfer', events.append)
+        poller.poll()
+
+        # when
+        sai.gem.transfer(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact()
+        poller.poll()
+
+        # then
+        assert len(events) == 1
+
+    def test_should_be_shared_per_web3_instance(self, sai: SaiDeployment):
+        assert LogPoller.for_web3(sai.web3) is LogPoller.for_web3(sai.web3)
+
+
+class TestLogScanner:
+    @staticmethod
+    def transfer(sai: SaiDeployment, values: list):
+        for value in values:
+            sai.gem.transfer(Address('0x0000000000000000000000000000000000000001'), Wad(value)).transact()
+
+    @staticmethod
+    def values(events: list) -> list:
+        return [event['args']['value'] for event in events]
+
+    def test_should_scan_in_chunks(self, sai: SaiDeployment):
+        # given
+        from_block = sai.web3.eth.blockNumber + 1
+        self.transfer(sai, [1, 2, 3, 4, 5, 6, 7])
+
+        # when
+        events = LogScanner(sai.web3, chunk_size=2, min_chunk_size=1, max_workers=3).scan(sai.gem._contract, 'Transfer',
+                                                                                         from_block)
+
+        # then
+        assert self.values(events) == [1, 2, 3, 4, 5, 6, 7]
+
+    def test_should_scan_up_to_the_given_block(self, sai: SaiDeployment):
+        # given
+        from_block = sai.web3.eth.blockNumber + 1
+        self.transfer(sai, [1, 2, 3, 4])
+
+        # when
+        events = LogScanner(sai.web3, chunk_size=2, min_chunk_size=1).scan(sai.gem._contract, 'Transfer',
+                                                                           from_block + 1, from_block + 2)
+
+        # then
+        assert self.values(events) == [2, 3]
+
+    def test_should_split_chunks_rejected_by_the_node(self, sai: SaiDeployment, monkeypatch):
+        # given
+        from_block = sai.web3.eth.blockNumber + 1
+        self.transfer(sai, [1, 2, 3, 4, 5, 6, 7, 8])
+        get_logs = api.logs.get_logs
+
+        def limited_get_logs(web3, filter_params):
+            if filter_params['toBlock'] - filter_params['fromBlock'] + 1 > 2:
+                raise ValueError({'code': -32005, 'message': 'query returned more than 1 result'})
+            return get_logs(web3, filter_params)
+
+        monkeypatch.setattr(api.logs, 'get_logs', limited_get_logs)
+        scanner = LogScanner(sai.web3, chunk_size=8, min_chunk_size=1)
+
+        # when
+        events = scanner.scan(sai.gem._contract, 'Transfer', from_block)
+
+        # then
+        assert self.values(events) == [1, 2, 3, 4, 5, 6, 7, 8]
+        assert scanner.chunk_size == 2
+
+    def test_should_give_up_if_chunk_cannot_be_split_anymore(self, sai: SaiDeployment, monkeypatch):
+        # given
+        def failing_get_logs(web3, filter_params):
+            raise ValueError({'code': -32005, 'message': 'query returned more than 10000 results'})
+
+        monkeypatch.setattr(api.logs, 'get_logs', failing_get_logs)
+
+        # expect
+        with pytest.raises(ValueError):
+            LogScanner(sai.web3, chunk_size=4, min_chunk_size=2).scan(sai.gem._contract, 'Transfer', 0)
+
+    def test_should_retry_other_errors_without_splitting(self, sai: SaiDeployment, monkeypatch):
+        # given
+        from_block = sai.web3.eth.blockNumber + 1
+        self.transfer(sai, [1, 2, 3, 4])
+        get_logs = api.logs.get_logs
+        failures = [ConnectionError('connection reset'), ValueError({'code': -32000, 'message': 'failed'})]
+        scanned_ranges = []
+
+        def flaky_get_logs(web3, filter_params):
+            scanned_ranges.append((filter_params['fromBlock'], filter_params['toBlock']))
+            if len(failures) > 0:
+                raise failures.pop(0)
+            return get_logs(web3, filter_params)
+
+        monkeypatch.setattr(api.logs, 'get_logs', flaky_get_logs)
+        scanner = LogScanner(sai.web3, chunk_size=8, min_chunk_size=1, retry_delay=0)
+
+        # when
+        events = scanner.scan(sai.gem._contract, 'Transfer', from_block)
+
+        # then
+        assert self.values(events) == [1, 2, 3, 4]
+        assert len(set(scanned_ranges)) == 1
+        assert scanner.chunk_size == 8
+
+    def test_should_give_up_after_max_retries(self, sai: SaiDeployment, monkeypatch):
+        # given
+        def failing_get_logs(web3, filter_params):
+            raise ValueError({'code': -32000, 'message': 'failed'})
+
+        monkeypatch.setattr(api.logs, 'get_logs', failing_get_logs)
+        scanner = LogScanner(sai.web3, chunk_size=4, min_chunk_size=2, max_retries=2, retry_delay=0)
+
+        # expect
+        with pytest.raises(ValueError):
+            scanner.scan(sai.gem._contract, 'Transfer', 0)
+
+    def test_should_grow_chunk_size_back_after_successful_scans(self, sai: SaiDeployment):
+        # given
+        scanner = LogScanner(sai.web3, chunk_size=8, min_chunk_size=1)
+        scanner.chunk_size = 2
+
+        # when
+        scanner.scan(sai.gem._contract, 'Transfer', 0)
+
+        # then
+        assert scanner.chunk_size == 4
+
+        # when
+        scanner.scan(sai.gem._contract, 'Transfer', 0)
+        scanner.scan(sai.gem._contract, 'Transfer', 0)
+
+        # then
+        assert scanner.chunk_size == 8
+
+    def test_should_scan_only_new_blocks_after_checkpoint(self, sai: SaiDeployment, tmpdir, monkeypatch):
+        # given
+        checkpoint_file = str(tmpdir.join('checkpoints.json'))
+        from_block = sai.web3.eth.blockNumber + 1
+        self.transfer(sai, [1, 2, 3])
+        LogScanner(sai.web3, checkpoint_file=checkpoint_file, confirmations=0).scan(sai.gem._contract, 'Transfer',
+                                                                                    from_block)
+        last_block = sai.web3.eth.blockNumber
+
+        # and
+        self.transfer(sai, [4, 5])
+        scanned_ranges = []
+        get_logs = api.logs.get_logs
+
+        def recording_get_logs(web3, filter_params):
+            scanned_ranges.append((filter_params['fromBlock'], filter_params['toBlock']))
+            return get_logs(web3, filter_params)
+
+        monkeypatch.setattr(api.logs, 'get_logs', recording_get_logs)
+
+        # when
+        events = LogScanner(sai.web3, checkpoint_file=checkpoint_file, confirmations=0).scan(sai.gem._contract,
+                                                                                             'Transfer', from_block)
+
+        # then
+        assert self.values(events) == [1, 2, 3, 4, 5]
+        assert scanned_ranges == [(last_block + 1, sai.web3.eth.blockNumber)]
+
+        # when
+        events = LogScanner(sai.web3, checkpoint_file=checkpoint_file, confirmations=0).scan(sai.gem._contract,
+                                                                                             'Transfer', from_block + 1)
+
+        # then
+        assert self.values(events) == [2, 3, 4, 5]
+
+    def test_should_not_save_unconfirmed_blocks_in_checkpoint(self, sai: SaiDeployment, tmpdir):
+        # given
+        checkpoint_file = str(tmpdir.join('checkpoints.json'))
+        from_block = sai.web3.eth.blockNumber + 1
+        self.transfer(sai, [1, 2, 3])
+
+        # when
+        scanner = LogScanner(sai.web3, checkpoint_file=checkpoint_file, confirmations=2)
+        scanner.scan(sai.gem._contract, 'Transfer', from_block)
+
+        # then
+        checkpoint = list(scanner._read_checkpoints().values())[0]
+        assert checkpoint['last_block'] == sai.web3.eth.blockNumber - 2
+        assert [log['blockNumber'] for log in checkpoint['logs']] == [from_block]
+
+    def test_should_save_only_most_recent_blocks_in_checkpoint(self, sai: SaiDeployment, tmpdir):
+        # given
+        checkpoint_file = str(tmpdir.join('checkpoints.json'))
+        from_block = sai.web3.eth.blockNumber + 1
+        self.transfer(sai, [1, 2, 3, 4])
+        scanner = LogScanner(sai.web3, checkpoint_file=checkpoint_file, confirmations=0, checkpoint_blocks=2)
+
+        # when
+        events = scanner.scan(sai.gem._contract, 'Transfer', from_block)
+
+        # then
+        checkpoint = list(scanner._read_checkpoints().values())[0]
+        assert checkpoint['from_block'] == sai.web3.eth.blockNumber - 1
+        assert [log['blockNumber'] for log in checkpoint['logs']] == [from_block + 2, from_block + 3]
+        assert self.values(events) == [1, 2, 3, 4]
+
+        # when
+        self.transfer(sai, [5])
+        events = scanner.scan(sai.gem._contract, 'Transfer', from_block)
+
+        # then
+        assert self.values(events) == [1, 2, 3, 4, 5]
+        assert len(list(scanner._read_checkpoints().values())[0]['logs']) == 2
@@ -0,0 +1,178 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from api import Address
+from api.conftest import SaiDeployment
+from api.logs import LogPoller
+from api.nonce import NonceManager
+from api.numeric import Wad
+
+
+class TestNonceManager:
+    @pytest.fixture()
+    def sent(self, sai: SaiDeployment, monkeypatch):
+        # the test chain doesn't accept nonces in `eth_sendTransaction`, so they only get recorded
+        sent = []
+        send_transaction = sai.web3.eth.sendTransaction
+
+        def send_transaction_without_nonce(transaction):
+            sent.append(transaction)
+            return send_transaction({key: value for key, value in transaction.items() if key != 'nonce'})
+
+        monkeypatch.setattr(sai.web3.eth, 'sendTransaction', send_transaction_without_nonce)
+        return sent
+
+    @pytest.fixture()
+    def nonce_manager(self, sai: SaiDeployment, poller: LogPoller):
+        return NonceManager(sai.web3, Address(sai.web3.eth.defaultAccount))
+
+    @pytest.fixture()
+    def transaction_count(self, sai: SaiDeployment):
+        return sai.web3.eth.getTransactionCount(sai.web3.eth.defaultAccount)
+
+    def test_should_allocate_consecutive_nonces_starting_with_the_node_count(self, nonce_manager, transaction_count):
+        # expect
+        assert [nonce_manager.allocate() for _ in range(3)] == [transaction_count, transaction_count + 1,
+                                                               transaction_count + 2]
+
+    def test_should_resynchronize_after_release(self, sai: SaiDeployment, nonce_manager, transaction_count,
+                                                 monkeypatch):
+        # given
+        nonce = nonce_manager.allocate()
+        monkeypatch.setattr(sai.web3.eth, 'getTransactionCount', lambda account, block_identifier=None:
+                            transaction_count + 1)
+
+        # when
+        nonce_manager.release(nonce)
+
+        # then
+        assert nonce_manager.in_flight() == {}
+        assert nonce_manager.allocate() == transaction_count + 1
+
+    def test_should_resynchronize_if_released_nonce_left_a_gap(self, nonce_manager, transaction_count):
+        # given
+        first_nonce = nonce_manager.allocate()
+        nonce_manager.sent(first_nonce, '0x01')
+        second_nonce = nonce_manager.allocate()
+        third_nonce = nonce_manager.allocate()
+        nonce_manager.sent(third_nonce, '0x03')
+
+        # when
+        nonce_manager.release(second_nonce)
+
+        # then
+        assert nonce_manager.allocate() == transaction_count
+
+    def test_should_send_transactions_with_consecutive_nonces(self, sai: SaiDeployment, sent, nonce_manager,
+                                                              transaction_count):
+        # when
+        first_nonce, first_hash = nonce_manager.send(lambda nonce: sai.web3.eth.sendTransaction(
+            {'to': '0x0000000000000000000000000000000000000001', 'value': 1, 'nonce': nonce}))
+        second_nonce, second_hash = nonce_manager.send(lambda nonce: sai.web3.eth.sendTransaction(
+            {'to': '0x0000000000000000000000000000000000000001', 'value': 2, 'nonce': nonce}))
+
+        # then
+        assert (first_nonce, second_nonce) == (transaction_count, transaction_count + 1)
+        assert [transaction['nonce'] for transaction in sent] == [transaction_count, transaction_count + 1]
+        assert nonce_manager.in_flight() == {transaction_count: first_hash, transaction_count + 1: second_hash}
+
+    def test_should_assign_nonces_to_contract_transactions(self, sai: SaiDeployment, sent, nonce_manager,
+                                                           transaction_count):
+        # when
+        sai.sai.approve(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact(
+            nonce_manager=nonce_manager)
+        sai.skr.approve(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact(
+            nonce_manager=nonce_manager)
+        sai.gem.approve(Address('0x0000000000000000000000000000000000000001'), Wad(1)).transact()
+
+        # then
+        assert [transaction.get('nonce') for transaction in sent] == [transaction_count, transaction_count + 1, None]
+
+    def test_should_release_nonce_if_transaction_could_not_be_sent(self, nonce_manager, transaction_count):
+        # given
+        def send_transaction(nonce):
+            raise Exception("Transaction rejected")
+
+        # when
+        with pytest.raises(Exception):
+            nonce_manager.send(send_transaction)
+
+        # then
+        assert nonce_manager.in_flight() == {}
+        assert nonce_manager.allocate() == transaction_count
+
+    def test_should_forget_mined_transactions_on_new_block(self, sai: SaiDeployment, nonce_manager, poller,
+                                                          transaction_count):
+        # given
+        nonce = nonce_manager.allocate()
+        transaction_hash = sai.web3.eth.sendTransaction({'to': '0x0000000000000000000000000000000000000001',
+                                                         'value': 1})
+        nonce_manager.sent(nonce, transaction_hash)
+        poller.poll()
+
+        # when
+        sai.web3.eth.sendTransaction({'from': sai.web3.eth.accounts[1],
+                                      'to': '0x0000000000000000000000000000000000000001', 'value': 1})
+        poller.poll()
+
+        # then
+        assert nonce_manager.in_flight() == {}
+        assert nonce_manager.allocate() == transaction_count + 1
+
+    def test_should_resynchronize_if_transaction_has_been_sent_bypassing_the_manager(self, sai: SaiDeployment,
+                                                                                     nonce_manager, poller,
+                                                                                     transaction_count):
+        # given
+        nonce = nonce_manager.allocate()
+        transaction_hash = sai.web3.eth.sendTransaction({'to': '0x0000000000000000000000000000000000000001',
+                                                         'value': 1})
+        nonce_manager.sent(nonce, transaction_hash)
+        poller.poll()
+
+        # when
+        sai.web3.eth.sendTransaction({'to': '0x0000000000000000000000000000000000000001', 'value': 2})
+        poller.poll()
+
+        # then
+        assert nonce_manager.in_flight() == {}
+        assert nonce_manager.allocate() == transaction_count + 2
+
+    def test_should_resynchronize_if_transactions_have_been_dropped(self, nonce_manager, transaction_count):
+        # given
+        for index in range(2):
+            nonce_manager.sent(nonce_manager.allocate(), f"0x0{index}")
+
+        # when
+        nonce_manager.check()
+
+        # then
+        assert nonce_manager.in_flight() == {}
+        assert nonce_manager.allocate() == transaction_count
+
+    def test_should_resynchronize_on_reorg(self, sai: SaiDeployment, nonce_manager, transaction_count, monkeypatch):
+        # given
+        nonce_manager.sent(nonce_manager.allocate(), '0x01')
+        monkeypatch.setattr(sai.web3.eth, 'getTransactionCount', lambda account, block_identifier=None:
+                            transaction_count - 1 if block_identifier == 'latest' else transaction_count + 1)
+
+        # when
+        nonce_manager.check()
+
+        # then
+        assert nonce_manager.allocate() == transaction_count + 1
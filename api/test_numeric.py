@@ -15,9 +15,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+import math
+import pickle
+import random
+from fractions import Fraction
+from decimal import Decimal, localcontext, ROUND_DOWN
+
 import pytest
 
-from api.numeric import Wad, Ray
+from api.numeric import Wad, Ray, WadArray, RayArray, RAY, WAD
+
+
+def ds_math(numerator: int, denominator: int) -> int:
+    """Reference DS-math rounding: `numerator / denominator` rounded half up, calculated with fractions."""
+    return math.floor(Fraction(numerator, denominator) + Fraction(1, 2))
 
 
 def is_hashable(v):
@@ -204,6 +216,39 @@ class TestWad:
         with pytest.raises(ArithmeticError):
             Wad.max(15, Wad(25))
 
+    def test_should_be_immutable(self):
+        # given
+        value = Wad(123)
+
+        # expect
+        with pytest.raises(AttributeError):
+            value.value = 456
+        with pytest.raises(AttributeError):
+            value.other = 456
+        with pytest.raises(AttributeError):
+            del value.value
+        assert value == Wad(123)
+
+    def test_should_have_predefined_constants(self):
+        assert Wad.ZERO == Wad(0)
+        assert Wad.ONE == Wad(10**18)
+        assert Wad.ONE == Wad.from_number(1)
+        assert Wad.MICRO == Wad.from_number(0.000001)
+        assert Wad.EPSILON == Wad.from_number(0.0000000001)
+
+    def test_should_cache_from_number(self):
+        assert Wad.from_number(1.5) is Wad.from_number(1.5)
+        assert Wad.from_number(1.5) == Wad(10**18 * 3 // 2)
+
+    def test_should_not_be_copied(self):
+        # given
+        value = Wad(123)
+
+        # expect
+        assert copy.copy(value) is value
+        assert copy.deepcopy(value) is value
+        assert pickle.loads(pickle.dumps(value)) == value
+
 
 class TestRay:
     def test_should_support_negative_values(self):
@@ -295,6 +340,16 @@ class TestRay:
         with pytest.raises(ArithmeticError):
             Ray(4) / 2
 
+    def test_rpow(self):
+        assert Ray.from_number(2).rpow(0) == Ray.ONE
+        assert Ray.from_number(2).rpow(1) == Ray.from_number(2)
+        assert Ray.from_number(2).rpow(10) == Ray.from_number(1024)
+        assert Ray.from_number(1.5).rpow(3) == Ray.from_number(3.375)
+
+    def test_rpow_should_round_half_up(self):
+        assert Ray(RAY + 1).rpow(2) == Ray(RAY + 2)
+        assert Ray(RAY // 2 + 1).rpow(2) == Ray(RAY // 4 + 1)
+
     def test_should_compare_rays_with_each_other(self):
         assert Ray(1000) == Ray(1000)
         assert Ray(1000) != Ray(999)
@@ -377,3 +432,262 @@ class TestRay:
             Ray.max(Ray(10), 20)
         with pytest.raises(ArithmeticError):
             Ray.max(15, Ray(25))
+
+    def test_should_be_immutable(self):
+        # given
+        value = Ray(123)
+
+        # expect
+        with pytest.raises(AttributeError):
+            value.value = 456
+        with pytest.raises(AttributeError):
+            value.other = 456
+        with pytest.raises(AttributeError):
+            del value.value
+        assert value == Ray(123)
+
+    def test_should_have_predefined_constants(self):
+        assert Ray.ZERO == Ray(0)
+        assert Ray.ONE == Ray(10**27)
+        assert Ray.ONE == Ray.from_number(1)
+
+    def test_should_cache_from_number(self):
+        assert Ray.from_number(1.5) is Ray.from_number(1.5)
+        assert Ray.from_number(1.5) == Ray(10**27 * 3 // 2)
+
+    def test_should_not_be_copied(self):
+        # given
+        value = Ray(123)
+
+        # expect
+        assert copy.copy(value) is value
+        assert copy.deepcopy(value) is value
+        assert pickle.loads(pickle.dumps(value)) == value
+
+
+class TestWadArray:
+    def test_should_instantiate_from_wads_rays_and_ints(self):
+        # when
+        array = WadArray([Wad(1), Ray(2000000000), 3])
+
+        # then
+        assert len(array) == 3
+        assert list(array) == [Wad(1), Wad(2), Wad(3)]
+        assert array[1] == Wad(2)
+        assert array[1:] == WadArray([Wad(2), Wad(3)])
+
+    def test_should_have_nice_printable_representation(self):
+        assert repr(WadArray([Wad(1), Wad(2)])) == "WadArray([1, 2])"
+
+    def test_should_be_immutable(self):
+        # given
+        array = WadArray([Wad(1)])
+
+        # expect
+        with pytest.raises(AttributeError):
+            array.values = (2,)
+
+    def test_add_and_subtract(self):
+        # given
+        array = WadArray([Wad(10), Wad(20)])
+
+        # expect
+        assert array + WadArray([Wad(1), Wad(2)]) == WadArray([Wad(11), Wad(22)])
+        assert array - Wad(5) == WadArray([Wad(5), Wad(15)])
+
+    def test_add_should_not_work_with_rays(self):
+        with pytest.raises(ArithmeticError):
+            WadArray([Wad(10)]) + Ray(10)
+        with pytest.raises(ArithmeticError):
+            WadArray([Wad(10)]) + RayArray([Ray(10)])
+
+    def test_should_fail_on_length_mismatch(self):
+        with pytest.raises(ValueError):
+            WadArray([Wad(1), Wad(2)]) + WadArray([Wad(1)])
+
+    def test_multiply_and_divide_should_round_like_scalars(self):
+        # given
+        random.seed(1)
+        wads = [Wad(random.randint(0, 10 ** 30)) for _ in range(100)]
+        rays = [Ray(random.randint(1, 10 ** 30)) for _ in range(100)]
+        divisors = [Wad(random.randint(1, 10 ** 30)) for _ in range(100)]
+        array = WadArray(wads)
+
+        # expect
+        assert list(array * RayArray(rays)) == [x * y for x, y in zip(wads, rays)]
+        assert list(array * WadArray(divisors)) == [x * y for x, y in zip(wads, divisors)]
+        assert list(array / WadArray(divisors)) == [x / y for x, y in zip(wads, divisors)]
+        assert list(array * Ray.from_number(1.5)) == [x * Ray.from_number(1.5) for x in wads]
+        assert list(array / Wad.from_number(3)) == [x / Wad.from_number(3) for x in wads]
+        assert list(array * 3) == [x * 3 for x in wads]
+
+    def test_ds_math_should_round_half_up_like_the_contracts(self):
+        # given
+        random.seed(3)
+        wads = [Wad(random.randint(0, 10 ** 30)) for _ in range(100)]
+        others = [Wad(random.randint(1, 10 ** 30)) for _ in range(100)]
+        rays = [Ray(random.randint(1, 10 ** 30)) for _ in range(100)]
+        array = WadArray(wads)
+
+        # expect
+        assert array.wmul(WadArray(others)).values == tuple(ds_math(x.value * y.value, WAD)
+                                                            for x, y in zip(wads, others))
+        assert array.wmul(Wad.from_number(1.5)).values == tuple(ds_math(x.value * 3 * WAD // 2, WAD) for x in wads)
+        assert array.rmul(RayArray(rays)).values == tuple(ds_math(x.value * y.value, RAY) for x, y in zip(wads, rays))
+        assert array.wdiv(WadArray(others)).values == tuple(ds_math(x.value * WAD, y.value)
+                                                            for x, y in zip(wads, others))
+        assert array.rdiv(WadArray(others)).values == tuple(ds_math(x.value * RAY, y.value)
+                                                            for x, y in zip(wads, others))
+
+    def test_ds_math_should_differ_from_truncating_operators(self):
+        # given
+        array = WadArray([Wad(1), Wad(3)])
+
+        # expect
+        assert array * Wad.from_number(0.5) == WadArray([Wad(0), Wad(1)])
+        assert array.wmul(Wad.from_number(0.5)) == WadArray([Wad(1), Wad(2)])
+        assert array.rmul(Ray.from_number(0.5)) == WadArray([Wad(1), Wad(2)])
+        assert array.rdiv(Wad(2)) == RayArray([Ray.from_number(0.5), Ray.from_number(1.5)])
+
+    def test_ds_math_should_not_work_with_the_wrong_types(self):
+        with pytest.raises(ArithmeticError):
+            WadArray([Wad(10)]).wmul(Ray(10))
+        with pytest.raises(ArithmeticError):
+            WadArray([Wad(10)]).rmul(Wad(10))
+        with pytest.raises(ArithmeticError):
+            WadArray([Wad(10)]).rdiv(Ray(10))
+
+    def test_should_fail_to_multiply_by_float(self):
+        with pytest.raises(ArithmeticError):
+            WadArray([Wad(10)]) * 1.5
+
+    def test_should_fail_to_divide_by_ints(self):
+        with pytest.raises(ArithmeticError):
+            WadArray([Wad(10)]) / 2
+
+    def test_should_compare_elementwise(self):
+        # given
+        array = WadArray([Wad(1), Wad(2), Wad(3)])
+
+        # expect
+        assert (array < Wad(2)) == [True, False, False]
+        assert (array <= Wad(2)) == [True, True, False]
+        assert (array > WadArray([Wad(0), Wad(2), Wad(4)])) == [True, False, False]
+        assert (array >= WadArray([Wad(0), Wad(2), Wad(4)])) == [True, True, False]
+
+    def test_reductions(self):
+        # given
+        array = WadArray([Wad(5), Wad(1), Wad(9), Wad(9)])
+
+        # expect
+        assert array.sum() == Wad(24)
+        assert array.min() == Wad(1)
+        assert array.max() == Wad(9)
+        assert array.argmin() == 1
+        assert array.argmax() == 2
+
+    def test_sum_of_empty_array_should_be_zero(self):
+        assert WadArray([]).sum() == Wad.ZERO
+
+
+class TestRayArray:
+    def test_should_instantiate_from_rays_wads_and_ints(self):
+        assert list(RayArray([Ray(1), Wad(2), 3])) == [Ray(1), Ray(2000000000), Ray(3)]
+
+    def test_multiply_and_divide_should_round_like_scalars(self):
+        # given
+        random.seed(2)
+        rays = [Ray(random.randint(0, 10 ** 40)) for _ in range(100)]
+        wads = [Wad(random.randint(1, 10 ** 30)) for _ in range(100)]
+        divisors = [Ray(random.randint(1, 10 ** 40)) for _ in range(100)]
+        array = RayArray(rays)
+
+        # expect
+        assert list(array * WadArray(wads)) == [x * y for x, y in zip(rays, wads)]
+        assert list(array / RayArray(divisors)) == [x / y for x, y in zip(rays, divisors)]
+
+    def test_reductions(self):
+        # given
+        array = RayArray([Ray(5), Ray(1), Ray(9)])
+
+        # expect
+        assert array.sum() == Ray(15)
+        assert array.argmin() == 1
+        assert array.argmax() == 2
+
+
+class TestDecimalEquivalence:
+    """Compares the integer-only arithmetic with a `Decimal` based reference implementation.
+
+    The reference implementation is the one `Wad` and `Ray` used to be built on, but evaluated
+    with precision high enough for the results to be exact.
+    """
+
+    ITERATIONS = 2000
+
+    @staticmethod
+    def decimal_mul(x: int, y: int, scale: int) -> int:
+        with localcontext() as ctx:
+            ctx.prec = 200
+            return int((Decimal(x) * Decimal(y) / (Decimal(10) ** scale)).quantize(1, rounding=ROUND_DOWN))
+
+    @staticmethod
+    def decimal_div(x: int, y: int, scale: int) -> int:
+        with localcontext() as ctx:
+            ctx.prec = 200
+            return int((Decimal(x) * (Decimal(10) ** scale) / Decimal(y)).quantize(1, rounding=ROUND_DOWN))
+
+    @staticmethod
+    def decimal_from_number(number, scale: int) -> int:
+        with localcontext() as ctx:
+            ctx.prec = 200
+            return int((Decimal(str(number)) * (Decimal(10) ** scale)).quantize(1))
+
+    @pytest.fixture
+    def values(self):
+        generator = random.Random(1234)
+
+        def value():
+            # mix small values, values around one and values close to uint256
+            bits = generator.choice([8, 64, 90, 128, 200, 256])
+            result = generator.randint(1, 2**bits)
+            return result if generator.random() > 0.1 else -result
+
+        return [(value(), value()) for _ in range(self.ITERATIONS)]
+
+    def test_wad_multiplication(self, values):
+        for x, y in values:
+            assert (Wad(x) * Wad(y)).value == self.decimal_mul(x, y, 18)
+            assert (Wad(x) * Ray(y)).value == self.decimal_mul(x, y, 27)
+            assert (Wad(x) * y).value == x * y
+
+    def test_ray_multiplication(self, values):
+        for x, y in values:
+            assert (Ray(x) * Ray(y)).value == self.decimal_mul(x, y, 27)
+            assert (Ray(x) * Wad(y)).value == self.decimal_mul(x, y, 18)
+            assert (Ray(x) * y).value == x * y
+
+    def test_division(self, values):
+        for x, y in values:
+            assert (Wad(x) / Wad(y)).value == self.decimal_div(x, y, 18)
+            assert (Ray(x) / Ray(y)).value == self.decimal_div(x, y, 27)
+
+    def test_conversions(self, values):
+        for x, _ in values:
+            assert Wad(Ray(x)).value == self.decimal_mul(x, 1, 9)
+            assert Ray(Wad(x)).value == x * 10**9
+
+    def test_from_number(self):
+        generator = random.Random(5678)
+        numbers = [generator.uniform(0, 10**generator.randint(0, 12)) for _ in range(self.ITERATIONS)] \
+                  + [generator.randint(0, 2**128) for _ in range(self.ITERATIONS)] \
+                  + [0.000001, 0.1, 0.2, 1.000001, 1e-18, 1e-27, 2.5e-18, 3.5e-18, 1e20]
+        for number in numbers:
+            assert Wad.from_number(number).value == self.decimal_from_number(number, 18)
+            assert Ray.from_number(number).value == self.decimal_from_number(number, 27)
+
+    def test_should_not_lose_precision_on_big_products(self):
+        assert Wad(2**200) * Ray.from_number(1) == Wad(2**200)
+        assert Ray(2**200) * Ray.from_number(1) == Ray(2**200)
+        assert Wad(2**200) / Wad.from_number(1) == Wad(2**200)
+        assert Ray(2**200) / Ray.from_number(1) == Ray(2**200)
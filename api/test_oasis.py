@@ -0,0 +1,209 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from web3 import HTTPProvider, Web3
+
+from api import Address
+from api.numeric import Wad
+from api.oasis import OfferInfo, OfferIndex, SimpleMarketOrderBook
+
+
+TOKEN_A = Address('0x0000000000000000000000000000000000000002')
+TOKEN_B = Address('0x0000000000000000000000000000000000000003')
+OWNER_1 = Address('0x0000000000000000000000000000000000000004')
+OWNER_2 = Address('0x0000000000000000000000000000000000000005')
+
+
+def offer(offer_id: int, sell_how_much, buy_how_much, sell_which_token: Address = TOKEN_A,
+          buy_which_token: Address = TOKEN_B, owner: Address = OWNER_1) -> OfferInfo:
+    return OfferInfo(offer_id=offer_id,
+                     sell_how_much=Wad.from_number(sell_how_much),
+                     sell_which_token=sell_which_token,
+                     buy_how_much=Wad.from_number(buy_how_much),
+                     buy_which_token=buy_which_token,
+                     owner=owner,
+                     timestamp=0)
+
+
+class FakeEvent:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeMarket:
+    """Mimics the parts of `SimpleMarket` used by the order book, counting the offer reads."""
+
+    def __init__(self):
+        self.web3 = Web3(HTTPProvider('http://localhost:8545'))
+        self.address = Address('0x0000000000000000000000000000000000000001')
+        self.offers = {}
+        self.last_offer_id = 0
+        self.handlers = []
+        self.reads = []
+
+    def make(self, amount: int) -> int:
+        self.last_offer_id += 1
+        self.offers[self.last_offer_id] = offer(self.last_offer_id, amount, amount)
+        return self.last_offer_id
+
+    def emit(self, offer_id: int):
+        for handler in self.handlers:
+            handler(FakeEvent(offer_id))
+
+    def get_last_offer_id(self) -> int:
+        return self.last_offer_id
+
+    def get_offer(self, offer_id: int):
+        self.reads.append(offer_id)
+        return self.offers.get(offer_id)
+
+    def on_item_update(self, handler):
+        self.handlers.append(handler)
+
+    def on_make(self, handler):
+        pass
+
+    def on_bump(self, handler):
+        pass
+
+    def on_take(self, handler):
+        pass
+
+    def on_kill(self, handler):
+        pass
+
+
+class TestSimpleMarketOrderBook:
+    def setup_method(self):
+        self.market = FakeMarket()
+        self.order_book = SimpleMarketOrderBook(self.market)
+
+    def test_should_read_all_offers_on_first_call(self):
+        # given
+        self.market.make(1)
+        self.market.make(2)
+        self.market.make(3)
+        del self.market.offers[2]
+
+        # when
+        offers = self.order_book.offers()
+
+        # then
+        assert [offer.offer_id for offer in offers] == [1, 3]
+        assert self.market.reads == [1, 2, 3]
+
+    def test_should_not_read_anything_if_nothing_changed(self):
+        # given
+        self.market.make(1)
+        self.order_book.offers()
+        self.market.reads = []
+
+        # when
+        offers = self.order_book.offers()
+
+        # then
+        assert [offer.offer_id for offer in offers] == [1]
+        assert self.market.reads == []
+
+    def test_should_read_only_new_offers(self):
+        # given
+        self.market.make(1)
+        self.order_book.offers()
+        self.market.reads = []
+
+        # when
+        self.market.make(2)
+        offers = self.order_book.offers()
+
+        # then
+        assert [offer.offer_id for offer in offers] == [1, 2]
+        assert self.market.reads == [2]
+
+    def test_should_reread_offers_referred_to_by_events(self):
+        # given
+        self.market.make(1)
+        self.market.make(2)
+        self.market.make(3)
+        self.order_book.offers()
+        self.market.reads = []
+
+        # when
+        self.market.offers[1] = offer(1, 0.5, 1)
+        self.market.emit(1)
+        del self.market.offers[3]
+        self.market.emit(3)
+        offers = self.order_book.offers()
+
+        # then
+        assert [offer.offer_id for offer in offers] == [1, 2]
+        assert offers[0].sell_how_much == Wad.from_number(0.5)
+        assert self.market.reads == [1, 3]
+
+
+class TestOfferIndex:
+    def setup_method(self):
+        self.index = OfferIndex()
+        self.index.add(offer(1, 10, 20))
+        self.index.add(offer(2, 10, 15, owner=OWNER_2))
+        self.index.add(offer(3, 5, 15))
+        self.index.add(offer(4, 10, 15))
+        self.index.add(offer(5, 1, 1, sell_which_token=TOKEN_B, buy_which_token=TOKEN_A))
+
+    def test_should_return_all_offers_ordered_by_id(self):
+        assert [offer.offer_id for offer in self.index.offers()] == [1, 2, 3, 4, 5]
+        assert len(self.index) == 5
+
+    def test_should_sort_offers_by_price_then_by_id(self):
+        assert [offer.offer_id for offer in self.index.offers_for(TOKEN_A, TOKEN_B)] == [2, 4, 1, 3]
+        assert [offer.offer_id for offer in self.index.offers_for(TOKEN_B, TOKEN_A)] == [5]
+        assert self.index.offers_for(TOKEN_A, OWNER_1) == []
+        assert set(self.index.pairs()) == {(TOKEN_A, TOKEN_B), (TOKEN_B, TOKEN_A)}
+
+    def test_best_and_top_offers(self):
+        assert self.index.best_offer(TOKEN_A, TOKEN_B).offer_id == 2
+        assert self.index.best_offer(TOKEN_A, OWNER_1) is None
+        assert [offer.offer_id for offer in self.index.top_offers(TOKEN_A, TOKEN_B, 3)] == [2, 4, 1]
+
+    def test_depth(self):
+        assert [offer.offer_id for offer in self.index.depth(TOKEN_A, TOKEN_B, Wad.from_number(10))] == [2]
+        assert [offer.offer_id for offer in self.index.depth(TOKEN_A, TOKEN_B, Wad.from_number(11))] == [2, 4]
+        assert [offer.offer_id for offer in self.index.depth(TOKEN_A, TOKEN_B, Wad.from_number(100))] == [2, 4, 1, 3]
+
+    def test_depth_up_to_price(self):
+        assert [offer.offer_id for offer in self.index.depth(TOKEN_A, TOKEN_B, Wad.from_number(100),
+                                                             Wad.from_number(1.5))] == [2, 4]
+        assert [offer.offer_id for offer in self.index.depth(TOKEN_A, TOKEN_B, Wad.from_number(100),
+                                                             Wad.from_number(1))] == []
+        assert self.index.depth(TOKEN_B, OWNER_1, Wad.from_number(100)) == []
+
+    def test_offers_owned_by(self):
+        assert [offer.offer_id for offer in self.index.offers_owned_by(OWNER_1)] == [1, 3, 4, 5]
+        assert [offer.offer_id for offer in self.index.offers_owned_by(OWNER_1, TOKEN_B, TOKEN_A)] == [5]
+        assert [offer.offer_id for offer in self.index.offers_owned_by(OWNER_2)] == [2]
+
+    def test_should_update_and_remove_offers(self):
+        # when
+        self.index.add(offer(1, 10, 1))
+        self.index.remove(2)
+        self.index.remove(5)
+        self.index.remove(6)
+
+        # then
+        assert [offer.offer_id for offer in self.index.offers_for(TOKEN_A, TOKEN_B)] == [1, 4, 3]
+        assert self.index.offers_for(TOKEN_B, TOKEN_A) == []
+        assert self.index.offers_owned_by(OWNER_2) == []
+        assert self.index.pairs() == [(TOKEN_A, TOKEN_B)]
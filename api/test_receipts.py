@@ -0,0 +1,138 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from web3 import Web3
+
+from api.batch import BatchHTTPProvider
+from api.conftest import SaiDeployment, JsonRpcServer
+from api.receipts import ReceiptTracker
+
+
+UNKNOWN_HASHES = ['0x' + f"{i:02x}" * 32 for i in range(1, 4)]
+
+
+class TestReceiptTracker:
+    @pytest.fixture()
+    def no_thread(self, monkeypatch):
+        # blocks get polled for explicitly by the tests
+        monkeypatch.setattr(ReceiptTracker, '_watch', lambda self: None)
+
+    @staticmethod
+    def send_transaction(sai: SaiDeployment) -> str:
+        return sai.web3.eth.sendTransaction({'from': sai.web3.eth.defaultAccount,
+                                             'to': '0x0000000000000000000000000000000000000001',
+                                             'value': 1})
+
+    def test_should_return_receipt_of_mined_transaction(self, sai: SaiDeployment, no_thread):
+        # given
+        tracker = ReceiptTracker(sai.web3)
+        transaction_hash = self.send_transaction(sai)
+
+        # when
+        receipt = tracker.wait(transaction_hash)
+
+        # then
+        assert receipt['transactionHash'] == transaction_hash
+        assert tracker.pending() == []
+
+    def test_should_resolve_pending_transactions_on_new_block(self, sai: SaiDeployment, no_thread, monkeypatch):
+        # given
+        mined = set()
+        get_transaction_receipt = sai.web3.eth.getTransactionReceipt
+        monkeypatch.setattr(sai.web3.eth, 'getTransactionReceipt',
+                            lambda transaction_hash: get_transaction_receipt(transaction_hash)
+                            if transaction_hash in mined else None)
+        tracker = ReceiptTracker(sai.web3)
+        transaction_hashes = [self.send_transaction(sai), self.send_transaction(sai)]
+        futures = [tracker.track(transaction_hash) for transaction_hash in transaction_hashes]
+        tracker.poll()
+
+        # expect
+        assert not any(future.done() for future in futures)
+        assert sorted(tracker.pending()) == sorted(transaction_hashes)
+
+        # when
+        mined.update(transaction_hashes)
+        self.send_transaction(sai)
+        tracker.poll()
+
+        # then
+        assert [future.result(timeout=0)['transactionHash'] for future in futures] == transaction_hashes
+        assert tracker.pending() == []
+
+    def test_should_look_up_all_pending_transactions_in_one_round_trip(self, sai: SaiDeployment, no_thread):
+        # given
+        server = JsonRpcServer(sai.web3.currentProvider)
+        web3 = Web3(BatchHTTPProvider(server.endpoint_uri))
+
+        try:
+            tracker = ReceiptTracker(web3)
+            futures = [tracker.track(transaction_hash) for transaction_hash in UNKNOWN_HASHES]
+
+            # when
+            server.round_trips = 0
+            tracker.check()
+
+            # then
+            assert server.round_trips == 1
+            assert not any(future.done() for future in futures)
+            assert sorted(tracker.pending()) == UNKNOWN_HASHES
+        finally:
+            server.shutdown()
+
+    def test_should_share_one_future_between_waiters_of_the_same_transaction(self, sai: SaiDeployment, no_thread):
+        # given
+        tracker = ReceiptTracker(sai.web3)
+
+        # expect
+        assert tracker.track(UNKNOWN_HASHES[0]) is tracker.track(UNKNOWN_HASHES[0])
+        assert tracker.pending() == [UNKNOWN_HASHES[0]]
+
+    def test_should_cancel_future_of_forgotten_transaction(self, sai: SaiDeployment, no_thread):
+        # given
+        tracker = ReceiptTracker(sai.web3)
+        future = tracker.track(UNKNOWN_HASHES[0])
+
+        # when
+        tracker.forget(UNKNOWN_HASHES[0])
+
+        # then
+        assert future.cancelled()
+        assert tracker.pending() == []
+
+    def test_should_watch_for_blocks_in_own_thread_until_nothing_pending(self, sai: SaiDeployment, monkeypatch):
+        # given
+        mined = set()
+        get_transaction_receipt = sai.web3.eth.getTransactionReceipt
+        monkeypatch.setattr(sai.web3.eth, 'getTransactionReceipt',
+                            lambda transaction_hash: get_transaction_receipt(transaction_hash)
+                            if transaction_hash in mined else None)
+        tracker = ReceiptTracker(sai.web3, poll_interval=0.01)
+        transaction_hash = self.send_transaction(sai)
+        future = tracker.track(transaction_hash)
+        thread = tracker._thread
+
+        # when
+        mined.add(transaction_hash)
+        self.send_transaction(sai)
+
+        # then
+        assert future.result(timeout=5)['transactionHash'] == transaction_hash
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert tracker._thread is None
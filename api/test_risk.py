@@ -0,0 +1,199 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from api import Address
+from api.conftest import SaiDeployment
+from api.feed import DSValue
+from api.numeric import Wad, Ray
+from api.risk import RiskEngine, LiquidationQueue
+from api.sai import Cup, CupIndex
+
+
+def cup(cup_id: int, art: Wad, ink: Wad) -> Cup:
+    return Cup(cup_id, Address('0x0101010101020202020203030303030404040404'), art, ink)
+
+
+class FakeCupIndex(CupIndex):
+    def __init__(self, cups: list):
+        super().__init__(tub=None)
+        for cup in cups:
+            self._update(cup)
+
+    def refresh(self):
+        pass
+
+    def cups(self):
+        return list(self._cups.values())
+
+    def change(self, cup: Cup):
+        self._update(cup)
+
+
+class TestRiskEngine:
+    @pytest.fixture()
+    def engine(self) -> RiskEngine:
+        return RiskEngine(tag=Wad.from_number(250), chi=Ray.from_number(1.1), par=Wad.from_number(1.2),
+                          mat=Ray.from_number(1.5))
+
+    def test_should_calculate_tab(self, engine: RiskEngine):
+        # expect
+        assert engine.tabs([cup(1, Wad.from_number(10), Wad.from_number(1)),
+                            cup(2, Wad(3), Wad.from_number(1))]).values == (Wad.from_number(11).value, 3)
+
+    def test_should_evaluate_cups(self, engine: RiskEngine):
+        # given
+        cups = [cup(1, Wad.from_number(100), Wad.from_number(1)),
+                cup(2, Wad.from_number(200), Wad.from_number(1)),
+                cup(3, Wad(0), Wad.from_number(1))]
+
+        # when
+        risks = engine.evaluate(cups)
+
+        # then
+        assert [risk.cup for risk in risks] == cups
+        assert [risk.safe for risk in risks] == [True, False, True]
+        assert risks[0].tab == Wad.from_number(110)
+        assert risks[0].ratio == Ray(1893939393939393939393939394)
+        assert risks[0].liquidation_price == Wad.from_number(198)
+        assert risks[2].ratio is None
+        assert risks[2].liquidation_price is None
+
+    def test_liquidation_price_should_be_the_lowest_safe_price(self, engine: RiskEngine):
+        # given
+        cups = [cup(1, Wad(123456789123456789123), Wad(987654321987654321)),
+                cup(2, Wad(1), Wad(3)),
+                cup(3, Wad.from_number(100), Wad(0))]
+
+        # when
+        risks = engine.evaluate(cups)
+
+        # then
+        for risk in risks[0:2]:
+            price = risk.liquidation_price
+            assert RiskEngine(price, engine.chi, engine.par, engine.mat).evaluate([risk.cup])[0].safe
+            assert not RiskEngine(price - Wad(1), engine.chi, engine.par, engine.mat).evaluate([risk.cup])[0].safe
+
+        # and
+        assert not risks[2].safe
+        assert risks[2].liquidation_price is None
+
+    def test_should_return_unsafe_cups_only(self, engine: RiskEngine):
+        # given
+        cups = [cup(1, Wad.from_number(100), Wad.from_number(1)),
+                cup(2, Wad.from_number(200), Wad.from_number(1))]
+
+        # expect
+        assert [risk.cup.cup_id for risk in engine.unsafe(cups)] == [2]
+
+    def test_should_match_the_tub(self, sai: SaiDeployment):
+        # given
+        sai.tub.join(Wad.from_number(100)).transact()
+        sai.tub.cork(Wad.from_number(1000000)).transact()
+        sai.tub.cuff(Ray.from_number(1.5)).transact()
+        sai.tub.crop(Ray(1000000000000000020000000000)).transact()
+        sai.tub.coax(Ray(1000000000000000070000000000)).transact()
+        DSValue(web3=sai.web3, address=sai.tub.pip()).poke_with_int(Wad.from_number(250.45).value).transact()
+
+        # and
+        for cup_id in range(1, 9):
+            sai.tub.open()
+            sai.tub.lock(cup_id, Wad(10**18 + 7777777777777*cup_id))
+            sai.tub.draw(cup_id, Wad(150*10**18 + cup_id*1234567891234567891))
+
+        # and
+        sai.tub.warp(1000000).transact()
+        DSValue(web3=sai.web3, address=sai.tub.pip()).poke_with_int(Wad.from_number(236.3333).value).transact()
+
+        # when
+        risks = RiskEngine.for_tub(sai.tub).evaluate([sai.tub.cups(cup_id) for cup_id in range(1, 9)])
+
+        # then
+        assert [risk.tab for risk in risks] == [sai.tub.tab(cup_id) for cup_id in range(1, 9)]
+        assert [risk.safe for risk in risks] == [sai.tub.safe(cup_id) for cup_id in range(1, 9)]
+        assert True in [risk.safe for risk in risks]
+        assert False in [risk.safe for risk in risks]
+
+
+class TestLiquidationQueue:
+    @staticmethod
+    def engine(tag: Wad) -> RiskEngine:
+        return RiskEngine(tag=tag, chi=Ray.from_number(1.1), par=Wad.from_number(1.2), mat=Ray.from_number(1.5))
+
+    def test_should_order_cups_by_liquidation_price(self):
+        # given
+        cup_index = FakeCupIndex([cup(1, Wad.from_number(100), Wad.from_number(1)),
+                                  cup(2, Wad.from_number(100), Wad.from_number(2)),
+                                  cup(3, Wad.from_number(150), Wad.from_number(1)),
+                                  cup(4, Wad(0), Wad.from_number(1)),
+                                  cup(5, Wad.from_number(1), Wad(0))])
+
+        # when
+        queue = LiquidationQueue(cup_index)
+
+        # then
+        assert [cup.cup_id for cup in queue.cups()] == [5, 3, 1, 2]
+        assert len(queue) == 4
+
+    def test_should_return_unsafe_cups_only(self):
+        # given
+        queue = LiquidationQueue(FakeCupIndex([cup(1, Wad.from_number(100), Wad.from_number(1)),
+                                               cup(2, Wad.from_number(100), Wad.from_number(2)),
+                                               cup(3, Wad.from_number(150), Wad.from_number(1))]))
+
+        # expect
+        assert [risk.cup.cup_id for risk in queue.unsafe(self.engine(Wad.from_number(300)))] == []
+        assert [risk.cup.cup_id for risk in queue.unsafe(self.engine(Wad.from_number(200)))] == [3]
+        assert [risk.cup.cup_id for risk in queue.unsafe(self.engine(Wad.from_number(198)))] == [3]
+        assert [risk.cup.cup_id for risk in queue.unsafe(self.engine(Wad.from_number(197)))] == [3, 1]
+        assert [risk.cup.cup_id for risk in queue.unsafe(self.engine(Wad.from_number(10)))] == [3, 1, 2]
+
+    def test_should_evaluate_only_unsafe_cups_and_the_first_safe_one(self, monkeypatch):
+        # given
+        queue = LiquidationQueue(FakeCupIndex([cup(cup_id, Wad.from_number(cup_id), Wad.from_number(1))
+                                               for cup_id in range(1, 101)]))
+        engine = self.engine(Wad.from_number(150))
+        evaluated = []
+        original_evaluate = engine.evaluate
+
+        def evaluate(cups):
+            evaluated.extend(cups)
+            return original_evaluate(cups)
+
+        monkeypatch.setattr(engine, 'evaluate', evaluate)
+
+        # when
+        unsafe = queue.unsafe(engine)
+
+        # then
+        assert [risk.cup.cup_id for risk in unsafe] == list(range(100, 75, -1))
+        assert len(evaluated) == 26
+
+    def test_should_follow_changes_of_cups(self):
+        # given
+        cup_index = FakeCupIndex([cup(1, Wad.from_number(100), Wad.from_number(1)),
+                                  cup(2, Wad.from_number(120), Wad.from_number(1))])
+        queue = LiquidationQueue(cup_index)
+
+        # when
+        cup_index.change(cup(1, Wad.from_number(140), Wad.from_number(1)))
+        cup_index.change(cup(2, Wad(0), Wad.from_number(1)))
+        cup_index.change(cup(3, Wad.from_number(100), Wad.from_number(1)))
+
+        # then
+        assert [cup.cup_id for cup in queue.cups()] == [1, 3]
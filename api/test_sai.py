@@ -21,6 +21,7 @@ from api import Address
 from api.conftest import SaiDeployment
 from api.feed import DSValue
 from api.numeric import Wad, Ray
+from api.sai import CupIndex, TubState
 
 
 class TestTub:
@@ -266,6 +267,36 @@ class TestTub:
         assert sai.sai.balance_of(sai.our_address) == Wad.from_number(20)
 
 
+class TestTubState:
+    def test_should_read_all_values(self, sai: SaiDeployment):
+        # given
+        sai.tub.join(Wad.from_number(10)).transact()
+        DSValue(web3=sai.web3, address=sai.tub.pip()).poke_with_int(Wad.from_number(250.45).value).transact()
+
+        # when
+        state = TubState.read(sai.tub, sai.tap)
+
+        # then
+        assert state.block_number == sai.web3.eth.blockNumber
+        assert state.tag == sai.tub.tag()
+        assert state.par == sai.tub.par()
+        assert state.per == sai.tub.per()
+        assert state.chi == sai.tub.chi()
+        assert state.mat == sai.tub.mat()
+        assert state.axe == sai.tub.axe()
+        assert state.hat == sai.tub.hat()
+        assert state.ice == sai.tub.ice()
+        assert state.air == sai.tub.air()
+        assert state.pie == sai.tub.pie()
+        assert state.jar_bid == sai.tub.jar_bid()
+        assert state.jar_ask == sai.tub.jar_ask()
+        assert state.tap_joy == sai.tap.joy()
+        assert state.tap_woe == sai.tap.woe()
+        assert state.tap_fog == sai.tap.fog()
+        assert state.tap_bid == sai.tap.bid()
+        assert state.tap_ask == sai.tap.ask()
+
+
 class TestTap:
     def test_jump_and_gap(self, sai: SaiDeployment):
         # given
@@ -295,3 +326,118 @@ class TestTap:
         assert sai.tap.bid() == Wad.from_number(475)
         assert sai.tap.s2s() == Wad.from_number(500)
         assert sai.tap.ask() == Wad.from_number(525)
+
+
+class TestCupIndex:
+    @pytest.fixture()
+    def cups_read(self, sai: SaiDeployment, monkeypatch) -> list:
+        cups_read = []
+        original_cups = sai.tub.cups
+
+        def cups(cup_id: int):
+            cups_read.append(cup_id)
+            return original_cups(cup_id)
+
+        monkeypatch.setattr(sai.tub, 'cups', cups)
+        return cups_read
+
+    @staticmethod
+    def prepare(sai: SaiDeployment):
+        sai.tub.join(Wad.from_number(10)).transact()
+        sai.tub.cork(Wad.from_number(100000)).transact()
+        DSValue(web3=sai.web3, address=sai.tub.pip()).poke_with_int(Wad.from_number(250.45).value).transact()
+
+    def test_should_read_all_cups_initially(self, sai: SaiDeployment, poller):
+        # given
+        self.prepare(sai)
+        sai.tub.open()
+        sai.tub.open()
+        sai.tub.lock(2, Wad.from_number(5))
+
+        # when
+        cup_index = CupIndex(sai.tub)
+
+        # then
+        assert [cup.cup_id for cup in cup_index.cups()] == [1, 2]
+        assert cup_index.cup(1).ink == Wad(0)
+        assert cup_index.cup(2).ink == Wad.from_number(5)
+        assert cup_index.cup(3) is None
+
+    def test_should_detect_new_cups(self, sai: SaiDeployment, poller):
+        # given
+        cup_index = CupIndex(sai.tub)
+        assert cup_index.cups() == []
+
+        # when
+        sai.tub.open()
+
+        # then
+        assert [cup.cup_id for cup in cup_index.cups()] == [1]
+        assert cup_index.cup(1).lad == sai.our_address
+
+    def test_should_reread_only_changed_cups(self, sai: SaiDeployment, poller, cups_read):
+        # given
+        self.prepare(sai)
+        sai.tub.open()
+        sai.tub.open()
+        sai.tub.open()
+        cup_index = CupIndex(sai.tub)
+        cup_index.refresh()
+        poller.poll()
+        cups_read.clear()
+
+        # when
+        sai.tub.lock(2, Wad.from_number(5))
+        sai.tub.draw(2, Wad.from_number(50))
+        poller.poll()
+        cup_index.refresh()
+
+        # then
+        assert cups_read == [2]
+        assert cup_index.cup(2).ink == Wad.from_number(5)
+        assert cup_index.cup(2).art > Wad(0)
+
+        # when
+        cups_read.clear()
+        cup_index.refresh()
+
+        # then
+        assert cups_read == []
+
+    def test_should_follow_ownership_changes(self, sai: SaiDeployment, poller):
+        # given
+        other_address = Address('0x0101010101020202020203030303030404040404')
+        sai.tub.open()
+        sai.tub.open()
+        cup_index = CupIndex(sai.tub)
+        cup_index.refresh()
+        poller.poll()
+
+        # when
+        sai.tub.give(1, other_address)
+        poller.poll()
+
+        # then
+        assert [cup.cup_id for cup in cup_index.cups_of(sai.our_address)] == [2]
+        assert [cup.cup_id for cup in cup_index.cups_of(other_address)] == [1]
+
+    def test_should_read_cups_through_reader_if_given(self, sai: SaiDeployment, poller):
+        # given
+        class Reader:
+            def __init__(self):
+                self.cup_ids = []
+
+            def cups(self, cup_ids):
+                self.cup_ids.extend(cup_ids)
+                return [sai.tub.cups(cup_id) for cup_id in cup_ids]
+
+        reader = Reader()
+        sai.tub.open()
+        sai.tub.open()
+
+        # when
+        cup_index = CupIndex(sai.tub, reader)
+
+        # then
+        assert [cup.cup_id for cup in cup_index.cups()] == [1, 2]
+        assert reader.cup_ids == [1, 2]
@@ -0,0 +1,147 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import pytest
+from eth_utils import decode_hex, keccak
+import ethereum.keys
+from ethereum import tester
+from ethereum.keys import make_keystore_json
+from secp256k1 import PublicKey
+
+from api import Address
+from api.conftest import SaiDeployment
+from api.etherdelta import EtherDelta
+from api.numeric import Wad
+from api.signer import LocalSigner
+
+
+class TestLocalSigner:
+    @pytest.fixture()
+    def signer(self, sai: SaiDeployment, monkeypatch):
+        # attaching changes `web3`, which is shared by all the tests, so make sure it gets restored
+        monkeypatch.setattr(LocalSigner, '_signers', {})
+        monkeypatch.setattr(sai.web3.eth, 'sendTransaction', sai.web3.eth.sendTransaction)
+        return LocalSigner(tester.keys[0])
+
+    @staticmethod
+    def as_text(keystore):
+        # `make_keystore_json` returns bytes, while the files written by nodes contain strings
+        if isinstance(keystore, dict):
+            return {key: TestLocalSigner.as_text(value) for key, value in keystore.items()}
+        return keystore.decode() if isinstance(keystore, bytes) else keystore
+
+    @staticmethod
+    def recover(data: bytes, signature: str) -> Address:
+        signature = decode_hex(signature)
+        message_hash = keccak(b"\x19Ethereum Signed Message:\n" + str(len(data)).encode() + data)
+        public_key = PublicKey()
+        recoverable_signature = public_key.ecdsa_recoverable_deserialize(signature[0:64], signature[64] - 27)
+        public_key = PublicKey(public_key.ecdsa_recover(message_hash, recoverable_signature, raw=True))
+        return Address(keccak(public_key.serialize(compressed=False)[1:])[12:])
+
+    def test_should_derive_address_from_private_key(self, sai: SaiDeployment, signer: LocalSigner):
+        assert signer.address == Address(sai.web3.eth.accounts[0])
+
+    def test_should_load_key_from_keystore_file(self, sai: SaiDeployment, tmpdir, monkeypatch):
+        # given
+        monkeypatch.setitem(ethereum.keys.PBKDF2_CONSTANTS, 'c', 16)
+        keystore_file = tmpdir.join("keystore.json")
+        keystore_file.write(json.dumps(self.as_text(make_keystore_json(tester.keys[0], 'secret', kdf='pbkdf2'))))
+
+        # when
+        signer = LocalSigner.from_keystore(str(keystore_file), 'secret')
+
+        # then
+        assert signer.address == Address(sai.web3.eth.accounts[0])
+
+    def test_should_send_transactions_from_our_account_as_raw_transactions(self, sai: SaiDeployment,
+                                                                           signer: LocalSigner, monkeypatch):
+        # given
+        raw_transactions = []
+        send_raw_transaction = sai.web3.eth.sendRawTransaction
+        monkeypatch.setattr(sai.web3.eth, 'sendRawTransaction',
+                            lambda raw_transaction: raw_transactions.append(raw_transaction) or
+                                                    send_raw_transaction(raw_transaction))
+        recipient = Address('0x0000000000000000000000000000000000000123')
+        signer.attach(sai.web3)
+
+        # when
+        receipt = sai.gem.transfer(recipient, Wad(17)).transact()
+
+        # then
+        assert receipt is not None
+        assert sai.gem.balance_of(recipient) == Wad(17)
+        assert len(raw_transactions) == 1
+        assert LocalSigner.for_account(sai.web3, signer.address) is signer
+
+    def test_should_leave_transactions_from_other_accounts_to_the_node(self, sai: SaiDeployment,
+                                                                       signer: LocalSigner, monkeypatch):
+        # given
+        monkeypatch.setattr(sai.web3.eth, 'sendRawTransaction', lambda raw_transaction: pytest.fail())
+        signer.attach(sai.web3)
+
+        # when
+        sai.web3.eth.sendTransaction({'from': sai.web3.eth.accounts[1],
+                                      'to': '0x0000000000000000000000000000000000000123', 'value': 1})
+
+        # then
+        assert sai.web3.eth.getBalance('0x0000000000000000000000000000000000000123') >= 1
+        assert LocalSigner.for_account(sai.web3, Address(sai.web3.eth.accounts[1])) is None
+
+    def test_should_wrap_send_transaction_only_once(self, sai: SaiDeployment, signer: LocalSigner):
+        # given
+        signer.attach(sai.web3)
+        send_transaction = sai.web3.eth.sendTransaction
+
+        # when
+        LocalSigner(tester.keys[1]).attach(sai.web3)
+
+        # then
+        assert sai.web3.eth.sendTransaction is send_transaction
+        assert LocalSigner.for_account(sai.web3, Address(sai.web3.eth.accounts[1])) is not None
+
+    def test_should_refuse_to_attach_if_send_transaction_is_already_wrapped(self, sai: SaiDeployment,
+                                                                            signer: LocalSigner, monkeypatch):
+        # given
+        send_transaction = sai.web3.eth.sendTransaction
+        monkeypatch.setattr(sai.web3.eth, 'sendTransaction', lambda transaction: send_transaction(transaction))
+
+        # expect
+        with pytest.raises(AssertionError):
+            signer.attach(sai.web3)
+
+    def test_should_sign_messages_like_eth_sign(self, signer: LocalSigner):
+        # given
+        data = keccak(b"some order")
+
+        # when
+        signature = signer.sign(data)
+
+        # then
+        assert len(decode_hex(signature)) == 65
+        assert self.recover(data, signature) == signer.address
+
+    def test_should_sign_etherdelta_orders_locally(self, sai: SaiDeployment, signer: LocalSigner):
+        # given
+        etherdelta = EtherDelta(web3=sai.web3, address=sai.tub.address, api_server=None)
+        signer.attach(sai.web3)
+        data = keccak(b"some order")
+
+        # expect
+        assert etherdelta._eth_sign(sai.web3.eth.defaultAccount, data) == signer.sign(data)
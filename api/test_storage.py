@@ -0,0 +1,105 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from api import Address
+from api.conftest import SaiDeployment, JsonRpcServer
+from api.feed import DSValue
+from api.numeric import Wad
+from api.sai import Tub
+from api.storage import CupStorageReader, OfferStorageReader, mapping_slot
+
+
+class TestMappingSlot:
+    def test_should_compute_mapping_slots(self):
+        assert mapping_slot(1, 0) == 0xa6eef7e35abe7026729641147f7915573c7e97b47efa546f5f6e3230263bcb49
+
+
+class TestCupStorageReader:
+    @pytest.fixture()
+    def cups(self, sai: SaiDeployment):
+        sai.tub.join(Wad.from_number(100)).transact()
+        sai.tub.cork(Wad.from_number(1000000)).transact()
+        DSValue(web3=sai.web3, address=sai.tub.pip()).poke_with_int(Wad.from_number(250.45).value).transact()
+        for cup_id in range(1, 6):
+            sai.tub.open()
+            sai.tub.lock(cup_id, Wad(10**19 + cup_id))
+            sai.tub.draw(cup_id, Wad(123456789123456789123 * cup_id))
+        sai.tub.give(3, Address('0x0101010101020202020203030303030404040404'))
+
+    def test_should_read_the_same_cups_as_the_tub(self, sai: SaiDeployment, tub: Tub, cups):
+        # when
+        cups = CupStorageReader(tub).cups([1, 2, 3, 4, 5, 6])
+
+        # then
+        for cup, expected in zip(cups, [sai.tub.cups(cup_id) for cup_id in [1, 2, 3, 4, 5, 6]]):
+            assert cup.cup_id == expected.cup_id
+            assert cup.lad == expected.lad
+            assert cup.art == expected.art
+            assert cup.ink == expected.ink
+
+    def test_should_read_all_cups_in_one_round_trip_once_validated(self, tub: Tub, server: JsonRpcServer, cups):
+        # given
+        reader = CupStorageReader(tub)
+        reader.cups([1, 2, 3])
+        server.round_trips = 0
+
+        # when
+        reader.cups([1, 2, 3, 4, 5])
+
+        # then
+        assert server.round_trips == 1
+        assert [request['method'] for request in server.requests[-10:]] == ['eth_getStorageAt'] * 10
+
+    def test_should_fall_back_to_abi_calls_if_layout_does_not_match(self, sai: SaiDeployment, tub: Tub, cups):
+        # given
+        reader = CupStorageReader(tub, slot=CupStorageReader.CUPS_SLOT + 1)
+
+        # when
+        cups = reader.cups([2, 3])
+
+        # then
+        assert [cup.lad for cup in cups] == [sai.tub.lad(2), sai.tub.lad(3)]
+        assert [cup.art for cup in cups] == [sai.tub.cups(2).art, sai.tub.cups(3).art]
+
+
+class TestOfferStorageReader:
+    def test_should_decode_offers(self):
+        # given
+        reader = OfferStorageReader.__new__(OfferStorageReader)
+        owner = 0x0101010101020202020203030303030404040404
+        packed = owner | (1 << 160) | (1500000000 << 168)
+
+        # when
+        offer = reader._decode(7, [Wad.from_number(5).value, 0x11, Wad.from_number(10).value, 0x22, packed])
+
+        # then
+        assert offer.offer_id == 7
+        assert offer.sell_how_much == Wad.from_number(5)
+        assert offer.sell_which_token == Address('0x0000000000000000000000000000000000000011')
+        assert offer.buy_how_much == Wad.from_number(10)
+        assert offer.buy_which_token == Address('0x0000000000000000000000000000000000000022')
+        assert offer.owner == Address('0x0101010101020202020203030303030404040404')
+        assert offer.timestamp == 1500000000
+
+    def test_should_decode_inactive_offers_as_none(self):
+        # given
+        reader = OfferStorageReader.__new__(OfferStorageReader)
+
+        # expect
+        assert reader._decode(7, [0, 0, 0, 0, 0]) is None
@@ -18,11 +18,11 @@
 from web3 import EthereumTesterProvider
 from web3 import Web3
 
-from api import Address
+from api import Address, Transact
 from api import Wad
 from api.approval import directly
 from api.token import DSToken
-from api.transact import TxManager, Invocation
+from api.transact import TxManager
 
 
 class TestTxManager:
@@ -62,3 +62,81 @@ class TestTxManager:
         # then
         assert self.token1.balance_of(self.our_address) == Wad.from_number(999500)
         assert self.token1.balance_of(self.other_address) == Wad.from_number(500)
+
+
+class TestSimulate:
+    def setup_method(self):
+        Transact._simulations.clear()
+        self.web3 = Web3(EthereumTesterProvider())
+        self.web3.eth.defaultAccount = self.web3.eth.accounts[0]
+        self.our_address = Address(self.web3.eth.defaultAccount)
+        self.other_address = Address(self.web3.eth.accounts[1])
+        self.token = DSToken.deploy(self.web3, 'ABC')
+        self.token.mint(Wad.from_number(1000)).transact()
+
+    def test_should_simulate_successful_transaction_without_sending_it(self):
+        # when
+        simulation = self.token.transfer(self.other_address, Wad.from_number(500)).simulate()
+
+        # then
+        assert simulation.successful
+        assert simulation.gas > 21000
+        assert simulation.output == '0x' + '00' * 31 + '01'
+        assert simulation.block_number == self.web3.eth.blockNumber
+
+        # and
+        assert self.token.balance_of(self.our_address) == Wad.from_number(1000)
+
+    def test_should_simulate_failing_transaction(self):
+        # when
+        simulation = self.token.transfer(self.other_address, Wad.from_number(1001)).simulate()
+
+        # then
+        assert not simulation.successful
+        assert simulation.gas is None
+        assert simulation.output is None
+
+    def test_should_memoize_simulations_within_block(self, monkeypatch):
+        # given
+        calls = []
+        call = self.web3.eth.call
+        monkeypatch.setattr(self.web3.eth, 'call', lambda *args: calls.append(args) or call(*args))
+
+        # when
+        first = self.token.transfer(self.other_address, Wad.from_number(1000)).simulate()
+        second = self.token.transfer(self.other_address, Wad.from_number(1000)).simulate()
+
+        # then
+        assert first.successful
+        assert second is first
+        assert len(calls) == 1
+
+        # when
+        self.token.transfer(self.other_address, Wad.from_number(1)).transact()
+        third = self.token.transfer(self.other_address, Wad.from_number(1000)).simulate()
+
+        # then
+        assert not third.successful
+        assert len(calls) == 2
+
+    def test_should_memoize_simulations_separately_for_each_web3(self, monkeypatch):
+        # given
+        other_web3 = Web3(EthereumTesterProvider())
+        other_web3.eth.defaultAccount = other_web3.eth.accounts[0]
+        other_token = DSToken.deploy(other_web3, 'ABC')
+        other_token.mint(Wad.from_number(1000)).transact()
+        other_token.mint(Wad.from_number(1000)).transact()
+        assert other_web3.eth.blockNumber > self.web3.eth.blockNumber
+
+        calls = []
+        call = self.web3.eth.call
+        monkeypatch.setattr(self.web3.eth, 'call', lambda *args: calls.append(args) or call(*args))
+
+        # when
+        first = self.token.transfer(self.other_address, Wad.from_number(1000)).simulate()
+        other_token.transfer(self.other_address, Wad.from_number(1000)).simulate()
+        second = self.token.transfer(self.other_address, Wad.from_number(1000)).simulate()
+
+        # then
+        assert second is first
+        assert len(calls) == 1
@@ -20,6 +20,7 @@ from typing import Optional
 from web3 import Web3
 
 from api import Contract, Address, Receipt, Transact
+from api.cache import block_cached
 from api.numeric import Wad
 
 
@@ -42,6 +43,7 @@ class ERC20Token(Contract):
     def name(self):
         return ERC20Token.registry.get(self.address, '???')
 
+    @block_cached
     def total_supply(self) -> Wad:
         """Returns the total supply of the token.
         
@@ -50,6 +52,7 @@ class ERC20Token(Contract):
         """
         return Wad(self._contract.call().totalSupply())
 
+    @block_cached
     def balance_of(self, address: Address) -> Wad:
         """Returns the token balance of a given address.
 
@@ -63,6 +66,7 @@ class ERC20Token(Contract):
 
         return Wad(self._contract.call().balanceOf(address.address))
 
+    @block_cached
     def allowance_of(self, address: Address, payee: Address) -> Wad:
         """Returns the current allowance of a specified `payee` (delegate account).
 
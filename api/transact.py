@@ -22,6 +22,7 @@ from typing import Optional, List
 from web3 import Web3
 
 from api import Contract, Address, Receipt, Invocation, Transact
+from api.cache import immutable
 from api.token import ERC20Token
 
 
@@ -60,6 +61,7 @@ class TxManager(Contract):
         for token in tokens:
             approval_function(token, self.address, 'TxManager')
 
+    @immutable
     def owner(self) -> Address:
         return Address(self._contract.call().owner())
 
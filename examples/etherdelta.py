@@ -75,7 +75,7 @@ logging.info("---")
 # logging.info(etherdelta.can_trade(offchain_order, Wad.from_number(0.0026)))
 # logging.info(etherdelta.can_trade(offchain_order, Wad.from_number(0.0025)))
 # logging.info(etherdelta.can_trade(offchain_order, Wad.from_number(0.0006)))
-# logging.info(etherdelta.trade(offchain_order, Wad.from_number(0.0006)))
+# logging.info(etherdelta.trade(offchain_order, Wad.from_number(0.0006)).transact())
 # logging.info(etherdelta.amount_available(offchain_order))
 # logging.info(etherdelta.amount_filled(offchain_order))
 # logging.info(etherdelta.cancel_order(offchain_order))
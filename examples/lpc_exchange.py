@@ -44,7 +44,7 @@ print(f"")
 
 # Perform the exchange (`take()`) via LPC
 # Print our balances again afterwards
-if lpc.take(tub.sai(), Wad.from_number(10)):
+if lpc.take(tub.sai(), Wad.from_number(10)).transact():
     print(f"Exchange was successful.")
     print(f"Our balance after the exchange is:  {sai.balance_of(our_address)} SAI")
     print(f"                                    {gem.balance_of(our_address)} W-ETH")
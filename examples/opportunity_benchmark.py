@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+
+import time
+from random import Random
+
+from api import Address
+from api.numeric import Ray, Wad
+from keepers.conversion import Conversion
+from keepers.opportunity import OpportunityFinder
+
+# Measures how long `OpportunityFinder` takes to find profitable sequences in a SAI/SKR/GEM market
+# with a growing number of order book offers. Every offer is a separate conversion, so the number
+# of all possible sequences grows with the cube of the number of offers, whereas the search only
+# follows the handful of offers with rates good enough to close a profitable cycle.
+
+random = Random(0)
+sai = Address('0x0101010101010101010101010101010101010101')
+skr = Address('0x0202020202020202020202020202020202020202')
+gem = Address('0x0303030303030303030303030303030303030303')
+pairs = [(sai, skr), (skr, sai), (sai, gem), (gem, sai), (skr, gem), (gem, skr)]
+prices = {sai: 1.0, skr: 250.0, gem: 250.0}
+min_total_rate = Ray.from_number(1.000001)
+
+
+def conversions(number_of_offers: int) -> list:
+    result = []
+    for i in range(number_of_offers):
+        source_token, target_token = pairs[i % len(pairs)]
+        rate = prices[source_token] / prices[target_token] * random.uniform(0.95, 1.001)
+        result.append(Conversion(source_token, target_token, Ray.from_number(rate), Wad.from_number(100), f"take({i})"))
+    return result
+
+
+print(f"{'offers':>8} {'all sequences':>15} {'profitable':>12} {'time [ms]':>10} {'optimal':>8} {'time [ms]':>10}")
+for number_of_offers in [60, 120, 240, 480, 960]:
+    all_conversions = conversions(number_of_offers)
+    per_pair = number_of_offers // len(pairs)
+    all_sequences = 2 * per_pair ** 2 + 2 * per_pair ** 3
+
+    start = time.perf_counter()
+    opportunities = OpportunityFinder(all_conversions).find_opportunities(sai, Wad.from_number(100), min_total_rate)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    optimal = OpportunityFinder(all_conversions).find_optimal_opportunities(sai, Wad.from_number(100), min_total_rate)
+    elapsed_optimal = (time.perf_counter() - start) * 1000
+
+    print(f"{number_of_offers:>8} {all_sequences:>15} {len(opportunities):>12} {elapsed:>10.1f}"
+          f" {len(optimal):>8} {elapsed_optimal:>10.1f}")
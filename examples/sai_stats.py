@@ -17,21 +17,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from web3 import HTTPProvider
 from web3 import Web3
 
 from api import Address
+from api.batch import BatchHTTPProvider
 from api.token import ERC20Token
 from api.numeric import Ray
-from api.sai import Tub, Tap
+from api.risk import RiskEngine
+from api.sai import Tub, Tap, CupIndex, TubState
 
 
-web3 = Web3(HTTPProvider(endpoint_uri=f"http://localhost:8545"))
+web3 = Web3(BatchHTTPProvider(endpoint_uri=f"http://localhost:8545"))
 tub = Tub(web3=web3, address=Address('0xe819300b6f3d0625632b47196233fe6671a59891'))
 tap = Tap(web3=web3, address=Address('0x897c798c096d44e511a275153da9de6139ebc249'))
 sai = ERC20Token(web3=web3, address=tub.sai())
 skr = ERC20Token(web3=web3, address=tub.skr())
 gem = ERC20Token(web3=web3, address=tub.gem())
+state = TubState.read(tub, tap)
 
 print(f"")
 print(f"Token summary")
@@ -42,32 +44,31 @@ print(f"GEM total supply       : {gem.total_supply()} GEM")
 print(f"")
 print(f"Collateral summary")
 print(f"------------------")
-print(f"GEM collateral         : {tub.pie()} GEM")
-print(f"SKR collateral         : {tub.air()} SKR")
-print(f"SKR pending liquidation: {tap.fog()} SKR")
+print(f"GEM collateral         : {state.pie} GEM")
+print(f"SKR collateral         : {state.air} SKR")
+print(f"SKR pending liquidation: {state.tap_fog} SKR")
 print(f"")
 print(f"Debt summary")
 print(f"------------")
-print(f"Debt ceiling           : {tub.hat()} SAI")
-print(f"Good debt              : {tub.ice()} SAI")
-print(f"Bad debt               : {tap.woe()} SAI")
-print(f"Surplus                : {tap.joy()} SAI")
+print(f"Debt ceiling           : {state.hat} SAI")
+print(f"Good debt              : {state.ice} SAI")
+print(f"Bad debt               : {state.tap_woe} SAI")
+print(f"Surplus                : {state.tap_joy} SAI")
 print(f"")
 print(f"Feed summary")
 print(f"------------")
 print(f"REF per GEM feed       : {tub.pip()}")
-print(f"REF per SKR price      : {tub.tag()}")
-print(f"GEM per SKR price      : {tub.per()}")
+print(f"REF per SKR price      : {state.tag}")
+print(f"GEM per SKR price      : {state.per}")
 print(f"")
 print(f"Tub parameters")
 print(f"--------------")
-print(f"Liquidation ratio      : {tub.mat()*100} %")
-print(f"Liquidation penalty    : {tub.axe()*100 - Ray.from_number(100)} %")
+print(f"Liquidation ratio      : {state.mat*100} %")
+print(f"Liquidation penalty    : {state.axe*100 - Ray.from_number(100)} %")
 print(f"Stability fee          : {tub.tax()} %")
 print(f"Holder fee             : {tub.way()} %")
 print(f"")
 print(f"All cups")
 print(f"--------")
-for cup_id in range(1, tub.cupi()+1):
-    cup = tub.cups(cup_id)
-    print(f"Cup #{cup_id}, lad={cup.lad}, ink={cup.ink} SKR, tab={tub.tab(cup_id)} SAI, safe={tub.safe(cup_id)}")
+for risk in RiskEngine.from_state(state).evaluate(CupIndex(tub).cups()):
+    print(f"Cup #{risk.cup.cup_id}, lad={risk.cup.lad}, ink={risk.cup.ink} SKR, tab={risk.tab} SAI, safe={risk.safe}")
@@ -24,10 +24,15 @@ import threading
 import time
 
 import datetime
-from web3 import Web3, HTTPProvider
+from web3 import Web3
 
-from api import Address, register_filter_thread, all_filter_threads_alive, stop_all_filter_threads, \
-    any_filter_thread_present, Wad
+from api import Address, Wad
+from api.batch import BatchHTTPProvider
+from api.cache import block_cache
+from api.gas import GasPrice, DefaultGasPrice, FixedGasPrice, NodeGasPrice, PercentileGasPrice, IncreasingGasPrice
+from api.logs import LogPoller, LogScanner
+from api.nonce import NonceManager
+from api.signer import LocalSigner
 from api.token import ERC20Token
 
 
@@ -39,13 +44,27 @@ class Keeper:
         parser.add_argument("--rpc-host", help="JSON-RPC host (default: `localhost')", default="localhost", type=str)
         parser.add_argument("--rpc-port", help="JSON-RPC port (default: `8545')", default=8545, type=int)
         parser.add_argument("--eth-from", help="Ethereum account from which to send transactions", required=True, type=str)
+        parser.add_argument("--eth-key-file", help="Key store file of the account, to sign transactions locally instead of by the node", type=str)
+        parser.add_argument("--eth-password-file", help="File containing the password to the key store file", type=str)
+        parser.add_argument("--log-checkpoint-file", help="File to keep checkpoints of past events scanning in", type=str)
+        parser.add_argument("--gas-price", help="Gas price in Wei (default: chosen by the node)", type=int)
+        parser.add_argument("--gas-price-percentile", help="Use this percentile of gas prices paid in recent blocks as the gas price", type=float)
+        parser.add_argument("--gas-price-increase-every", help="Replace pending transactions with ones paying more gas every this number of blocks", type=int)
+        parser.add_argument("--gas-price-increase", help="Factor to increase the gas price of pending transactions by (default: 1.125)", default=1.125, type=float)
+        parser.add_argument("--gas-price-max", help="Maximum gas price in Wei pending transactions can be replaced with", type=int)
         self.args(parser)
         self.arguments = parser.parse_args()
-        self.web3 = Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}"))
+        self.web3 = Web3(BatchHTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}"))
         self.web3.eth.defaultAccount = self.arguments.eth_from #TODO allow to use ETH_FROM env variable
         self.our_address = Address(self.arguments.eth_from)
+        if self.arguments.eth_key_file:
+            self._attach_local_signer()
+        self.nonce_manager = NonceManager.for_account(self.web3, self.our_address)
+        self.gas_price = self._gas_price()
         self.config = Config(self.chain())
         self.terminated = False
+        self.log_poller = LogPoller.for_web3(self.web3)
+        LogScanner.for_web3(self.web3).checkpoint_file = self.arguments.log_checkpoint_file
         self._last_block_time = None
 
     def start(self):
@@ -60,9 +79,9 @@ class Keeper:
         self.startup()
         self._main_loop()
         logging.info("Shutting down the keeper")
-        if any_filter_thread_present():
+        if self.log_poller.active():
             logging.info("Waiting for all threads to terminate...")
-            stop_all_filter_threads()
+            self.log_poller.stop()
         logging.info("Executing keeper shutdown logic...")
         self.shutdown()
         logging.info("Keeper terminated")
@@ -101,23 +120,38 @@ class Keeper:
         return Wad(self.web3.eth.getBalance(address.address))
 
     def on_block(self, callback):
+        # the callback runs on a thread of its own so the log poller keeps going while it waits for transactions,
+        # blocks arriving in the meantime get skipped so the callback never runs twice at the same time
+        processing = threading.Lock()
+
+        def process_block(block_hash):
+            try:
+                logging.debug(f"Processing block {block_hash}")
+                callback()
+            except:
+                logging.exception(f"Processing block {block_hash} failed")
+            finally:
+                processing.release()
+
         def new_block_callback(block_hash):
             self._last_block_time = datetime.datetime.now()
             if not self.web3.eth.syncing:
                 block = self.web3.eth.getBlock(block_hash)
                 this_block_number = block['number']
                 last_block_number = self.web3.eth.blockNumber
-                if this_block_number == last_block_number:
-                    logging.debug(f"Processing block {block_hash}")
-                    callback()
-                else:
+                block_cache.new_block(last_block_number)
+                if this_block_number != last_block_number:
                     logging.info(f"Ignoring block {block_hash} (as #{this_block_number} < #{last_block_number})")
+                elif processing.acquire(blocking=False):
+                    threading.Thread(target=process_block, args=(block_hash,), daemon=True).start()
+                else:
+                    logging.debug(f"Ignoring block {block_hash} as the previous one is still being processed")
             else:
                 logging.info(f"Ignoring block {block_hash} as the client is syncing")
 
-        block_filter = self.web3.eth.filter('latest')
-        block_filter.watch(new_block_callback)
-        register_filter_thread(block_filter)
+        block_cache.enable()
+        self.log_poller.on_block(new_block_callback)
+        self.log_poller.start()
 
         logging.info("Watching for new blocks")
 
@@ -143,7 +177,41 @@ class Keeper:
             while self.web3.eth.syncing:
                 time.sleep(0.25)
 
+    def _gas_price(self) -> GasPrice:
+        if self.arguments.gas_price:
+            gas_price = FixedGasPrice(self.arguments.gas_price)
+        elif self.arguments.gas_price_percentile is not None:
+            gas_price = PercentileGasPrice(self.web3, self.arguments.gas_price_percentile)
+        elif self.arguments.gas_price_increase_every:
+            gas_price = NodeGasPrice(self.web3)
+        else:
+            return DefaultGasPrice()
+
+        if self.arguments.gas_price_increase_every:
+            gas_price = IncreasingGasPrice(gas_price,
+                                           every_blocks=self.arguments.gas_price_increase_every,
+                                           increase=self.arguments.gas_price_increase,
+                                           max_price=self.arguments.gas_price_max)
+        return gas_price
+
+    def _attach_local_signer(self):
+        password = ''
+        if self.arguments.eth_password_file:
+            with open(self.arguments.eth_password_file) as file:
+                password = file.read().strip()
+
+        signer = LocalSigner.from_keystore(self.arguments.eth_key_file, password)
+        if signer.address != self.our_address:
+            logging.fatal(f"Key store file {self.arguments.eth_key_file} is not for account {self.our_address}.")
+            exit(-1)
+
+        signer.attach(self.web3)
+
     def _check_account_unlocked(self):
+        if LocalSigner.for_account(self.web3, self.our_address) is not None:
+            logging.info(f"Transactions will be signed locally")
+            return
+
         try:
             self.web3.eth.sign(self.web3.eth.defaultAccount, "test")
         except:
@@ -152,10 +220,10 @@ class Keeper:
             exit(-1)
 
     def _main_loop(self):
-        # in case at least one filter has been set up, we enter an infinite loop and let
-        # the callbacks do the job. in case of no filters, we will not enter this loop
+        # in case at least one log poller subscription has been set up, we enter an infinite loop
+        # and let the callbacks do the job. in case of no subscriptions, we will not enter this loop
         # and the keeper will terminate soon after it started
-        while any_filter_thread_present():
+        while self.log_poller.active():
             # we watch for KeyboardInterrupt in order to detect SIGINT signals
             # capturing this event allows the keeper to shutdown gracefully
             try:
@@ -168,12 +236,11 @@ class Keeper:
                 logging.warning("Keeper logic asked for termination, the keeper will terminate")
                 break
 
-            # if any exception is raised in filter handling thread (could be an HTTP exception
-            # while communicating with the node), web3.py does not retry and the filter becomes
-            # dysfunctional i.e. no new callbacks will ever be fired. we detect it and terminate
-            # the keeper so it can be restarted.
-            if not all_filter_threads_alive():
-                logging.fatal("One of filter threads is dead, the keeper will terminate")
+            # the log poller retries on errors (for example HTTP exceptions while communicating
+            # with the node) itself, so its thread should never die. we check it anyway and
+            # terminate the keeper so it can be restarted.
+            if not self.log_poller.alive():
+                logging.fatal("Log poller thread is dead, the keeper will terminate")
                 break
 
             # if we are watching for new blocks and no new block has been reported during
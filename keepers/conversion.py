@@ -15,157 +15,217 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from api import Address
+from typing import Optional
+
+from api import Address, Transact
+from api.accrual import FeeProjection
 from api.oasis import SimpleMarket
 from api.numeric import Ray
 from api.numeric import Wad
 from api.oasis import OfferInfo
-from api.sai import Tub, Lpc, Tap
+from api.sai import Tub, Lpc, Tap, TubState
 from api.token import ERC20Token
 
 
 class Conversion:
+    """Describes a way of converting one token into another at a known rate.
+
+    Conversions hold no amounts and never change once created, so they can be freely shared between
+    all the sequences they take part in. The amounts of a particular step live in `Step`.
+    """
     def __init__(self, source_token: Address, target_token: Address, rate: Ray, max_source_amount: Wad, method: str):
-        self.source_amount = None
         self.source_token = source_token
-        self.target_amount = None
         self.target_token = target_token
         self.rate = rate
         self.max_source_amount = max_source_amount
         self.method = method
 
-    def name(self):
+    def name(self, source_amount: Wad, target_amount: Wad):
         raise NotImplementedError("name() not implemented")
 
-    def execute(self):
+    def execute(self, source_amount: Wad, target_amount: Wad) -> Transact:
         raise NotImplementedError("execute() not implemented")
 
     def address(self) -> Address:
         raise NotImplementedError("address() not implemented")
 
-    def calldata(self) -> str:
+    def calldata(self, source_amount: Wad, target_amount: Wad) -> str:
         raise NotImplementedError("calldata() not implemented")
 
-    def __str__(self):
+    def describe(self, source_amount: Optional[Wad], target_amount: Optional[Wad]) -> str:
         def amt(amount: Wad) -> str:
             return f"{amount} " if amount is not None else ""
 
         source_token_name = ERC20Token.token_name_by_address(self.source_token)
         target_token_name = ERC20Token.token_name_by_address(self.target_token)
 
-        return f"[{amt(self.source_amount)}{source_token_name} -> {amt(self.target_amount)}{target_token_name} " \
+        return f"[{amt(source_amount)}{source_token_name} -> {amt(target_amount)}{target_token_name} " \
                f"@{self.rate} by {self.method} (max={self.max_source_amount} {source_token_name})]"
 
+    def __str__(self):
+        return self.describe(None, None)
+
+
+class Step:
+    """A conversion taking part in a sequence, together with the amounts it is going to convert.
+
+    Only references the conversion, so creating steps is cheap even if the conversion holds
+    contract instances.
+    """
+    __slots__ = ('conversion', 'source_amount', 'target_amount')
+
+    def __init__(self, conversion: Conversion, source_amount: Optional[Wad] = None, target_amount: Optional[Wad] = None):
+        assert(isinstance(conversion, Conversion))
+        self.conversion = conversion
+        self.source_amount = source_amount
+        self.target_amount = target_amount
+
+    @property
+    def source_token(self) -> Address:
+        return self.conversion.source_token
+
+    @property
+    def target_token(self) -> Address:
+        return self.conversion.target_token
+
+    @property
+    def rate(self) -> Ray:
+        return self.conversion.rate
+
+    @property
+    def max_source_amount(self) -> Wad:
+        return self.conversion.max_source_amount
+
+    @property
+    def method(self) -> str:
+        return self.conversion.method
+
+    def name(self):
+        return self.conversion.name(self.source_amount, self.target_amount)
+
+    def execute(self) -> Transact:
+        return self.conversion.execute(self.source_amount, self.target_amount)
+
+    def address(self) -> Address:
+        return self.conversion.address()
+
+    def calldata(self) -> str:
+        return self.conversion.calldata(self.source_amount, self.target_amount)
+
+    def __str__(self):
+        return self.conversion.describe(self.source_amount, self.target_amount)
+
 
 class TubJoinConversion(Conversion):
-    def __init__(self, tub: Tub):
+    def __init__(self, tub: Tub, state: TubState):
         self.tub = tub
         super().__init__(source_token=self.tub.gem(),
                          target_token=self.tub.skr(),
-                         rate=(Ray.from_number(1) / tub.jar_ask()),
+                         rate=(Ray.ONE / state.jar_ask),
                          max_source_amount=Wad.from_number(1000000),  #1 mio ETH = infinity ;)
                          method="tub.join()")
 
-    def name(self):
-        return f"tub.join('{self.source_amount}')"
+    def name(self, source_amount: Wad, target_amount: Wad):
+        return f"tub.join('{source_amount}')"
 
-    def execute(self):
-        return self.tub.join(self.source_amount).transact()
+    def execute(self, source_amount: Wad, target_amount: Wad):
+        return self.tub.join(source_amount)
 
     def address(self) -> Address:
         return self.tub.address
 
-    def calldata(self):
-        return self.tub.join_calldata(self.source_amount)
+    def calldata(self, source_amount: Wad, target_amount: Wad):
+        return self.tub.join_calldata(source_amount)
 
 
 class TubExitConversion(Conversion):
-    def __init__(self, tub: Tub):
+    def __init__(self, tub: Tub, state: TubState):
         self.tub = tub
         super().__init__(source_token=self.tub.skr(),
                          target_token=self.tub.gem(),
-                         rate=tub.jar_bid(),
+                         rate=state.jar_bid,
                          max_source_amount=Wad.from_number(1000000),  #1 mio SKR = infinity ;)
                          method="tub.exit()")
 
-    def name(self):
-        return f"tub.exit('{self.source_amount}')"
+    def name(self, source_amount: Wad, target_amount: Wad):
+        return f"tub.exit('{source_amount}')"
 
-    def execute(self):
-        return self.tub.exit(self.source_amount).transact()
+    def execute(self, source_amount: Wad, target_amount: Wad):
+        return self.tub.exit(source_amount)
 
     def address(self) -> Address:
         return self.tub.address
 
-    def calldata(self):
-        return self.tub.exit_calldata(self.source_amount)
+    def calldata(self, source_amount: Wad, target_amount: Wad):
+        return self.tub.exit_calldata(source_amount)
 
 
 class TubBoomConversion(Conversion):
-    def __init__(self, tub: Tub, tap: Tap):
+    def __init__(self, tub: Tub, tap: Tap, state: TubState):
         self.tub = tub
         self.tap = tap
         super().__init__(source_token=self.tub.skr(),
                          target_token=self.tub.sai(),
-                         rate=Ray(tap.bid()),
-                         max_source_amount=self.boomable_amount_in_skr(tap),
+                         rate=Ray(state.tap_bid),
+                         max_source_amount=self.boomable_amount_in_skr(state),
                          method="tub.boom()")
 
-    #TODO currently the keeper doesn't see `joy` changing unless `drip` gets called
-    #this is the thing `sai-explorer` is trying to calculate on his own
-    def boomable_amount_in_sai(self, tap: Tap):
-        return Wad.max(tap.joy() - tap.woe(), Wad.from_number(0))
+    def boomable_amount_in_sai(self, state: TubState):
+        # `joy` only grows over time, so the amount available now will still be there when we boom
+        joy = FeeProjection(state).joy(state.era)
+        return Wad.max(joy - state.tap_woe, Wad.ZERO)
 
-    def boomable_amount_in_skr(self, tap: Tap):
+    def boomable_amount_in_skr(self, state: TubState):
         # we deduct 0.000001 in order to avoid rounding errors
-        return Wad.max(Wad(self.boomable_amount_in_sai(tap) / (tap.bid())) - Wad.from_number(0.000001), Wad.from_number(0))
+        return Wad.max(Wad(self.boomable_amount_in_sai(state) / state.tap_bid) - Wad.MICRO, Wad.ZERO)
 
-    def name(self):
-        return f"tub.boom('{self.source_amount}')"
+    def name(self, source_amount: Wad, target_amount: Wad):
+        return f"tub.boom('{source_amount}')"
 
-    def execute(self):
-        return self.tap.boom(self.source_amount)
+    def execute(self, source_amount: Wad, target_amount: Wad):
+        return self.tap.boom(source_amount)
 
     def address(self) -> Address:
         return self.tap.address
 
-    def calldata(self):
-        return self.tap.boom_calldata(self.source_amount)
+    def calldata(self, source_amount: Wad, target_amount: Wad):
+        return self.tap.boom_calldata(source_amount)
 
 
 class TubBustConversion(Conversion):
-    def __init__(self, tub: Tub, tap: Tap):
+    # how far ahead (in seconds) we look at the growth of `joy`, to cover the time our transaction waits to get mined
+    ACCRUAL_HORIZON = 5*60
+
+    def __init__(self, tub: Tub, tap: Tap, state: TubState):
         self.tub = tub
         self.tap = tap
         super().__init__(source_token=self.tub.sai(),
                          target_token=self.tub.skr(),
-                         rate=(Ray.from_number(1) / Ray(tap.ask())),
-                         max_source_amount=self.bustable_amount_in_sai(tap),
+                         rate=(Ray.ONE / Ray(state.tap_ask)),
+                         max_source_amount=self.bustable_amount_in_sai(state),
                          method="tub.bust()")
 
-    def bustable_amount_in_sai(self, tap: Tap):
-        #TODO we always try to bust 10 SAI less than what the Tub reports
-        #in order to discount the growth of `joy()` that might've have happened since the last drip
-        #of course this is not the right solution and it won't even work properly if the last
-        #drip happened enough time ago
-        bustable_woe = tap.woe() - tap.joy() - Wad.from_number(10)
+    def bustable_amount_in_sai(self, state: TubState):
+        # `joy` keeps growing until our transaction gets mined, which reduces the amount of `woe` we can bust
+        joy = FeeProjection(state).joy(state.era + self.ACCRUAL_HORIZON)
+        bustable_woe = state.tap_woe - joy
 
         # we deduct 0.000001 in order to avoid rounding errors
-        bustable_fog = tap.fog() * tap.ask() - Wad.from_number(0.000001)
+        bustable_fog = state.tap_fog * state.tap_ask - Wad.MICRO
 
-        return Wad.max(bustable_woe, bustable_fog, Wad.from_number(0))
+        return Wad.max(bustable_woe, bustable_fog, Wad.ZERO)
 
-    def name(self):
-        return f"tub.bust('{self.target_amount}')"
+    def name(self, source_amount: Wad, target_amount: Wad):
+        return f"tub.bust('{target_amount}')"
 
-    def execute(self):
-        return self.tap.bust(self.target_amount)
+    def execute(self, source_amount: Wad, target_amount: Wad):
+        return self.tap.bust(target_amount)
 
     def address(self) -> Address:
         return self.tap.address
 
-    def calldata(self):
-        return self.tap.bust_calldata(self.target_amount)
+    def calldata(self, source_amount: Wad, target_amount: Wad):
+        return self.tap.bust_calldata(target_amount)
 
 
 class LpcTakeRefConversion(Conversion):
@@ -173,24 +233,24 @@ class LpcTakeRefConversion(Conversion):
         self.lpc = lpc
         rate = Ray(self.lpc.tag() / (self.lpc.par() * self.lpc.gap()))
         #TODO we always leave 0.000001 in the liquidity pool, in case of some rounding errors
-        max_entry_alt = Wad.max((ERC20Token(web3=lpc.web3, address=lpc.ref()).balance_of(lpc.address) / Wad(rate)) - Wad.from_number(0.000001), Wad.from_number(0))
+        max_entry_alt = Wad.max((ERC20Token(web3=lpc.web3, address=lpc.ref()).balance_of(lpc.address) / Wad(rate)) - Wad.MICRO, Wad.ZERO)
         super().__init__(source_token=self.lpc.alt(),
                          target_token=self.lpc.ref(),
                          rate=rate,
                          max_source_amount=max_entry_alt,
                          method="lpc.take(ref)")
 
-    def name(self):
-        return f"lpc.take(ref, '{self.target_amount}')"
+    def name(self, source_amount: Wad, target_amount: Wad):
+        return f"lpc.take(ref, '{target_amount}')"
 
-    def execute(self):
-        return self.lpc.take(self.lpc.ref(), self.target_amount)
+    def execute(self, source_amount: Wad, target_amount: Wad):
+        return self.lpc.take(self.lpc.ref(), target_amount)
 
     def address(self) -> Address:
         return self.lpc.address
 
-    def calldata(self):
-        return self.lpc.take_calldata(self.lpc.ref(), self.target_amount)
+    def calldata(self, source_amount: Wad, target_amount: Wad):
+        return self.lpc.take_calldata(self.lpc.ref(), target_amount)
 
 
 class LpcTakeAltConversion(Conversion):
@@ -198,24 +258,24 @@ class LpcTakeAltConversion(Conversion):
         self.lpc = lpc
         rate = Ray(self.lpc.par() / (self.lpc.tag() * self.lpc.gap()))
         #TODO we always leave 0.000001 in the liquidity pool, in case of some rounding errors
-        max_entry_ref = Wad.max((ERC20Token(web3=lpc.web3, address=lpc.alt()).balance_of(lpc.address) / Wad(rate)) - Wad.from_number(0.000001), Wad.from_number(0))
+        max_entry_ref = Wad.max((ERC20Token(web3=lpc.web3, address=lpc.alt()).balance_of(lpc.address) / Wad(rate)) - Wad.MICRO, Wad.ZERO)
         super().__init__(source_token=self.lpc.ref(),
                          target_token=self.lpc.alt(),
                          rate=rate,
                          max_source_amount=max_entry_ref,
                          method="lpc.take(alt)")
 
-    def name(self):
-        return f"lpc.take(alt, '{self.target_amount}')"
+    def name(self, source_amount: Wad, target_amount: Wad):
+        return f"lpc.take(alt, '{target_amount}')"
 
-    def execute(self):
-        return self.lpc.take(self.lpc.alt(), self.target_amount)
+    def execute(self, source_amount: Wad, target_amount: Wad):
+        return self.lpc.take(self.lpc.alt(), target_amount)
 
     def address(self) -> Address:
         return self.lpc.address
 
-    def calldata(self):
-        return self.lpc.take_calldata(self.lpc.alt(), self.target_amount)
+    def calldata(self, source_amount: Wad, target_amount: Wad):
+        return self.lpc.take_calldata(self.lpc.alt(), target_amount)
 
 
 class OasisTakeConversion(Conversion):
@@ -228,20 +288,20 @@ class OasisTakeConversion(Conversion):
                          max_source_amount=offer.buy_how_much,
                          method=f"opc.take({self.offer.offer_id})")
 
-    def name(self):
-        return f"otc.take({self.offer.offer_id}, '{self.quantity()}')"
+    def name(self, source_amount: Wad, target_amount: Wad):
+        return f"otc.take({self.offer.offer_id}, '{self.quantity(target_amount)}')"
 
-    def execute(self):
-        return self.otc.take(self.offer.offer_id, self.quantity())
+    def execute(self, source_amount: Wad, target_amount: Wad):
+        return self.otc.take(self.offer.offer_id, self.quantity(target_amount))
 
     def address(self) -> Address:
         return self.otc.address
 
-    def calldata(self):
-        return self.otc.take_calldata(self.offer.offer_id, self.quantity())
+    def calldata(self, source_amount: Wad, target_amount: Wad):
+        return self.otc.take_calldata(self.offer.offer_id, self.quantity(target_amount))
 
-    def quantity(self):
-        quantity = self.target_amount
+    def quantity(self, target_amount: Wad):
+        quantity = target_amount
 
         #TODO probably at some point dust order limitation will get introuced at the contract level
         #if that happens, a concept of `min_source_amount` will be needed
@@ -253,7 +313,7 @@ class OasisTakeConversion(Conversion):
 
         # if by any chance rounding makes us want to buy only slightly less than the available lot,
         # we buy everything as this is probably what we wanted in the first place
-        if self.offer.sell_how_much - quantity < Wad.from_number(0.0000000001):
+        if self.offer.sell_how_much - quantity < Wad.EPSILON:
             quantity = self.offer.sell_how_much
 
         return quantity
@@ -15,41 +15,69 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import copy
+import math
 import operator
 from functools import reduce
-from typing import List
-
-import networkx
+from typing import Dict, List, Optional, Tuple
 
 from api import Address
 from api.numeric import Ray
 from api.numeric import Wad
-from keepers.conversion import Conversion
+from keepers.conversion import Conversion, Step
 
 
 class Sequence:
+    """A sequence of conversions, each one converting the tokens received from the previous one.
+
+    Consecutive conversions between the same pair of tokens form one hop, in which case the tokens received
+    from the previous hop get split between them.
+
+    Conversions are shared, not copied. Amounts are kept separately for each sequence, in its `steps`.
+    """
     def __init__(self, conversions: List[Conversion]):
         assert(isinstance(conversions, list))
-        self.steps = copy.deepcopy(conversions)
+        self.steps = [Step(conversion) for conversion in conversions]
         self._validate_token_chain()
 
+    def hops(self) -> List[List[Step]]:
+        """Groups the steps of this sequence into hops, each one converting tokens between the same pair of tokens."""
+        hops = []
+        for step in self.steps:
+            if len(hops) > 0 and self._same_hop(hops[-1][-1], step):
+                hops[-1].append(step)
+            else:
+                hops.append([step])
+        return hops
+
     def total_rate(self) -> Ray:
         """Calculates the multiplication of all conversion rates forming this sequence.
 
+        For hops using more than one conversion, the average rate of the hop (based on the amounts) is used.
+
         A `total_rate` > 1.0 is a general indication that executing this sequence may be profitable.
         """
-        return reduce(operator.mul, map(lambda step: step.rate, self.steps), Ray.from_number(1.0))
+        def hop_rate(hop: List[Step]) -> Ray:
+            if len(hop) == 1:
+                return hop[0].rate
+            return Ray(sum(map(lambda step: step.target_amount, hop), Wad.ZERO)) / \
+                   Ray(sum(map(lambda step: step.source_amount, hop), Wad.ZERO))
+
+        return reduce(operator.mul, map(hop_rate, self.hops()), Ray.ONE)
 
     def profit(self, token: Address) -> Wad:
         """Calculates the expected profit brought by executing this sequence (in token `token`)."""
-        return sum(map(lambda s: s.target_amount, filter(lambda s: s.target_token == token, self.steps)), Wad(0)) \
-               - sum(map(lambda s: s.source_amount, filter(lambda s: s.source_token == token, self.steps)), Wad(0))
+        return sum(map(lambda s: s.target_amount, filter(lambda s: s.target_token == token, self.steps)), Wad.ZERO) \
+               - sum(map(lambda s: s.source_amount, filter(lambda s: s.source_token == token, self.steps)), Wad.ZERO)
 
     def tx_costs(self) -> Wad:
         """Calculates the transaction costs that this sequence will take to execute."""
+        return self.tx_costs_of(len(self.steps))
+
+    @staticmethod
+    def tx_costs_of(number_of_steps: int) -> Wad:
+        """Calculates the transaction costs of executing a sequence of `number_of_steps` steps."""
         # TODO transaction costs are still in a fixed currency (SAI) here
-        return Wad.from_number(0.25) * Wad.from_number(len(self.steps))
+        return Wad.from_number(0.25) * Wad.from_number(number_of_steps)
 
     def net_profit(self, token: Address) -> Wad:
         """Calculates the expected net profit brought by executing this sequence (in token `token`).
@@ -59,6 +87,11 @@ class Sequence:
         return self.profit(token) - self.tx_costs()
 
     def set_amounts(self, initial_amount: Wad):
+        """Sets the amounts of all the steps, starting with `initial_amount` and respecting `max_source_amount`.
+
+        Works only for sequences using one conversion per hop. Amounts of sequences found
+        by `RouteOptimizer` are set by the optimizer itself.
+        """
         def recalculate_previous_amounts(from_step_id: int):
             for id in range(from_step_id, -1, -1):
                 self.steps[id].target_amount = self.steps[id + 1].source_amount
@@ -77,51 +110,374 @@ class Sequence:
 
     def _validate_token_chain(self):
         for i in range(1, len(self.steps)):
-            assert(self.steps[i - 1].target_token == self.steps[i].source_token)
+            assert(self.steps[i - 1].target_token == self.steps[i].source_token
+                   or self._same_hop(self.steps[i - 1], self.steps[i]))
+
+    @staticmethod
+    def _same_hop(step1: Step, step2: Step) -> bool:
+        return step1.source_token == step2.source_token and step1.target_token == step2.target_token
+
+
+class RouteOptimizer:
+    """Finds the most profitable amount to trade along a route, taking the depth of the market into account.
+
+    A route is a list of hops, the first one starting and the last one ending with the same token. Each hop
+    can use all the conversions available between its pair of tokens, best rates first. So the amount received
+    from each hop is a concave, piecewise-linear function of the amount put in, and so is the amount received
+    from the whole route. The gross profit is the highest where the marginal rate of the route (the product
+    of the rates of the conversions being used at each hop) drops to `min_marginal_rate`. It is found in a single
+    pass over the conversions of all the hops, each step of which uses up at least one conversion.
+
+    As every conversion used adds a fixed cost (see `Sequence.tx_costs()`), the net profit can be lower
+    with a thin conversion at the margin than without it. So the net profit is tracked at the end of each
+    step of the pass, and the sequence with the highest one is returned.
+    """
+    def __init__(self, hops: List[List[Conversion]]):
+        assert(isinstance(hops, list))
+        assert(len(hops) > 0)
+        self.hops = [sorted(hop, key=lambda conversion: conversion.rate, reverse=True) for hop in hops]
+        for hop in self.hops:
+            assert(len(hop) > 0)
+            assert(all(conversion.source_token == hop[0].source_token for conversion in hop))
+            assert(all(conversion.target_token == hop[0].target_token for conversion in hop))
+        for i in range(1, len(self.hops)):
+            assert(self.hops[i - 1][0].target_token == self.hops[i][0].source_token)
+
+    def optimize(self, max_engagement: Wad, min_marginal_rate: Ray = Ray.ONE) -> Optional[Sequence]:
+        """Finds the most profitable sequence of conversions along the route.
+
+        Args:
+            max_engagement: Maximum amount which can be put in at the beginning of the route.
+            min_marginal_rate: Conversions are only used as long as the marginal rate of the route
+                stays above this value.
+
+        Returns:
+            A sequence with all the amounts set, or `None` if trading along the route is not profitable.
+        """
+        assert(isinstance(max_engagement, Wad))
+        assert(isinstance(min_marginal_rate, Ray))
+
+        positions = [0] * len(self.hops)
+        used = [[Wad.ZERO] * len(hop) for hop in self.hops]
+        engagement = Wad.ZERO
+        profit = Wad.ZERO
+        number_of_steps = 0
+
+        # the state with the highest net profit so far, as (net profit, positions, amounts used at the positions)
+        best = None
+
+        while engagement < max_engagement:
+            conversions = [hop[position] for hop, position in zip(self.hops, positions)]
+            if reduce(operator.mul, map(lambda conversion: conversion.rate, conversions), Ray.ONE) <= min_marginal_rate:
+                break
+
+            # find how much more can be put in before one of the conversions being used gets exhausted,
+            # `scale` being the amount reaching the current hop for each token put in at the beginning
+            delta = max_engagement - engagement
+            exhausted = None
+            scale = Ray.ONE
+            for index, conversion in enumerate(conversions):
+                available = conversion.max_source_amount - used[index][positions[index]]
+                limit = Wad(Ray(available) / scale)
+                if limit <= delta:
+                    delta = limit
+                    exhausted = index
+                scale = scale * conversion.rate
+
+            amount = delta
+            for index, conversion in enumerate(conversions):
+                available = conversion.max_source_amount - used[index][positions[index]]
+                amount = Wad.min(amount, available)
+                if used[index][positions[index]] == Wad.ZERO and amount > Wad.ZERO:
+                    number_of_steps += 1
+                used[index][positions[index]] += amount
+                amount = Wad(Ray(amount) * conversion.rate)
+            engagement += delta
+            profit += amount - delta
+
+            net_profit = profit - Sequence.tx_costs_of(number_of_steps)
+            if engagement > Wad.ZERO and (best is None or net_profit > best[0]):
+                best = (net_profit, list(positions), [hop_used[position] for hop_used, position in zip(used, positions)])
+
+            if exhausted is not None:
+                positions[exhausted] += 1
+                if positions[exhausted] == len(self.hops[exhausted]):
+                    break
+
+        if best is None:
+            return None
+
+        # conversions before the best positions had been used up by then, the ones after them not used at all
+        _, best_positions, best_used = best
+        for hop_used, position, amount in zip(used, best_positions, best_used):
+            hop_used[position] = amount
+            hop_used[position + 1:] = [Wad.ZERO] * (len(hop_used) - position - 1)
+
+        taken = [(conversion, amount) for hop, hop_used in zip(self.hops, used)
+                                      for conversion, amount in zip(hop, hop_used)
+                                      if amount > Wad.ZERO]
+        sequence = Sequence([conversion for conversion, amount in taken])
+        for step, (conversion, amount) in zip(sequence.steps, taken):
+            step.source_amount = amount
+            step.target_amount = Wad(Ray(amount) * conversion.rate)
+        return sequence
 
 
 class OpportunityFinder:
-    def __init__(self, conversions):
+    """Finds arbitrage opportunities, i.e. sequences of conversions which start and end with the same token.
+
+    Tokens are the nodes of a graph and each conversion is an edge weighted with the logarithm of its rate,
+    so the `total_rate` of a sequence corresponds to the sum of weights along a cycle. Cycles through the base token
+    are searched for depth-first, visiting every other token at most once. Conversions between each pair
+    of tokens are tried from the best rate down, and a branch gets abandoned as soon as even the best rates
+    available in the rest of the graph couldn't bring its `total_rate` above the threshold. As the number
+    of tokens is small and the number of conversions (one per order book offer) is large, this visits only
+    a tiny fraction of all the possible sequences.
+    """
+
+    # tolerance for floating point errors in log-rates, so no cycle gets pruned by mistake
+    EPSILON = 1e-9
+
+    def __init__(self, conversions: List[Conversion]):
         assert(isinstance(conversions, list))
         self.conversions = conversions
+        self._edges_cache = None
 
-    def find_opportunities(self, base_token: Address, max_engagement: Wad):
-        graph_links = self._prepare_graph_links()
-        graph = networkx.DiGraph(graph_links)
-        try:
-            paths = list(networkx.shortest_simple_paths(graph, base_token.address, base_token.address + "-pre"))
+    def find_opportunities(self, base_token: Address, max_engagement: Wad, min_total_rate: Optional[Ray] = None) -> List[Sequence]:
+        """Finds all the sequences of conversions starting and ending with `base_token`.
 
-            opportunities = []
-            for path in paths:
-                conversions = []
-                for i in range(0, len(path)-1):
-                    if 'conversion' in graph_links[path[i]][path[i+1]]:
-                        conversions.append(graph_links[path[i]][path[i+1]]['conversion'])
+        Args:
+            base_token: Token the sequences start and end with.
+            max_engagement: Amount of `base_token` to start each sequence with.
+            min_total_rate: If specified, only sequences with `total_rate` greater than this will be returned.
+                Otherwise all the sequences are returned, regardless whether they are profitable or not.
+
+        Returns:
+            List of sequences found, with the amounts already set. Shorter sequences go first.
+        """
+        assert(isinstance(base_token, Address))
+        assert(isinstance(max_engagement, Wad))
+        assert(isinstance(min_total_rate, Ray) or (min_total_rate is None))
 
-                sequence = Sequence(conversions=conversions)
+        opportunities = []
+        for cycle in self._cycles(self._edges(), base_token, min_total_rate):
+            sequence = Sequence(conversions=cycle)
+            if min_total_rate is None or sequence.total_rate() > min_total_rate:
                 sequence.set_amounts(max_engagement)
                 opportunities.append(sequence)
 
-            return opportunities
-        except networkx.exception.NetworkXNoPath:
+        return opportunities
+
+    def find_optimal_opportunities(self, base_token: Address, max_engagement: Wad, min_total_rate: Ray = Ray.ONE) -> List[Sequence]:
+        """Finds the most profitable sequence of conversions for each route starting and ending with `base_token`.
+
+        Unlike `find_opportunities()`, which returns one sequence for each combination of conversions,
+        this returns one sequence for each route (a list of tokens), which can use any number of conversions
+        at each hop. See `RouteOptimizer` for details.
+
+        Args:
+            base_token: Token the sequences start and end with.
+            max_engagement: Maximum amount of `base_token` to start each sequence with.
+            min_total_rate: Conversions are only used as long as the marginal rate of the route stays above this value.
+
+        Returns:
+            List of sequences found, with the amounts already set. Shorter sequences go first.
+        """
+        assert(isinstance(base_token, Address))
+        assert(isinstance(max_engagement, Wad))
+        assert(isinstance(min_total_rate, Ray))
+
+        opportunities = []
+        for route in self.routes(base_token, min_total_rate):
+            sequence = self.optimize_route(route, max_engagement, min_total_rate)
+            if sequence is not None:
+                opportunities.append(sequence)
+
+        return opportunities
+
+    def routes(self, base_token: Address, min_total_rate: Optional[Ray] = None) -> List[Tuple[Address, ...]]:
+        """Finds all the routes starting and ending with `base_token`.
+
+        Args:
+            base_token: Token the routes start and end with.
+            min_total_rate: If specified, only routes on which the best conversions of each hop
+                give `total_rate` greater than this will be returned. Otherwise all the routes are returned.
+
+        Returns:
+            List of routes, each one being a tuple of tokens, the first and the last one being `base_token`.
+        """
+        assert(isinstance(base_token, Address))
+        assert(isinstance(min_total_rate, Ray) or (min_total_rate is None))
+
+        # a route can only be profitable if it is profitable for the best conversions at each hop
+        edges = self._edges()
+        best_edges = {src: {dst: target_edges[dst][:1] for dst in target_edges} for src, target_edges in edges.items()}
+
+        return [tuple([base_token] + [conversion.target_token for conversion in cycle])
+                for cycle in self._cycles(best_edges, base_token, min_total_rate)]
+
+    def optimize_route(self, route: Tuple[Address, ...], max_engagement: Wad, min_total_rate: Ray = Ray.ONE) -> Optional[Sequence]:
+        """Finds the most profitable sequence of conversions along `route`, using `RouteOptimizer`."""
+        assert(isinstance(route, tuple))
+        assert(isinstance(max_engagement, Wad))
+        assert(isinstance(min_total_rate, Ray))
+
+        edges = self._edges()
+        hops = [[conversion for _, conversion in edges[source_token.address][target_token.address]]
+                for source_token, target_token in zip(route, route[1:])]
+        return RouteOptimizer(hops).optimize(max_engagement, min_total_rate)
+
+    def _cycles(self, edges: dict, base_token: Address, min_total_rate: Optional[Ray]) -> List[List[Conversion]]:
+        if base_token.address not in edges:
             return []
 
-    def _prepare_graph_links(self):
-        def add_empty_link(dod, link_from, link_to):
-            if link_from not in dod:
-                dod[link_from] = {}
-            dod[link_from][link_to] = {}
+        min_weight = self._log(min_total_rate) if min_total_rate is not None else None
+        bounds = self._bounds(edges, base_token.address)
+        max_depth = len(bounds)
+        cycles = []
+
+        def search(token: str, weight: float, visited: set, steps: list):
+            remaining = max_depth - len(steps) - 1
+            for target_token, target_edges in edges.get(token, {}).items():
+                if target_token == base_token.address:
+                    bound = 0.0
+                elif target_token in visited or remaining == 0:
+                    continue
+                else:
+                    bound = bounds[remaining - 1].get(target_token, -math.inf)
+
+                for edge_weight, conversion in target_edges:
+                    # edges are sorted by rate, so none of the remaining ones can do any better
+                    if min_weight is not None and weight + edge_weight + bound < min_weight - self.EPSILON:
+                        break
+
+                    if target_token == base_token.address:
+                        cycles.append(steps + [conversion])
+                    else:
+                        search(target_token, weight + edge_weight, visited | {target_token}, steps + [conversion])
 
-        def add_conversion_link(dod, link_from, link_to, conversion):
-            if link_from not in dod:
-                dod[link_from] = {}
-            dod[link_from][link_to] = {'conversion': conversion}
+        search(base_token.address, 0.0, {base_token.address}, [])
+        return sorted(cycles, key=len)
 
-        links = {}
+    def _edges(self) -> Dict[str, Dict[str, List[Tuple[float, Conversion]]]]:
+        if self._edges_cache is not None:
+            return self._edges_cache
+
+        edges = {}
         for conversion in self.conversions:
             src = conversion.source_token.address
             dst = conversion.target_token.address
-            add_empty_link(links, src + "-pre", src)
-            add_conversion_link(links, src, dst + "-via-" + conversion.method, conversion)
-            add_empty_link(links, dst + "-via-" + conversion.method, dst + "-pre")
-        return links
+            edges.setdefault(src, {}).setdefault(dst, []).append((self._log(conversion.rate), conversion))
+
+        for target_edges in edges.values():
+            for dst in target_edges:
+                target_edges[dst].sort(key=lambda edge: edge[0], reverse=True)
+
+        self._edges_cache = edges
+        return edges
+
+    @staticmethod
+    def _bounds(edges: dict, base_token: str) -> List[Dict[str, float]]:
+        """Calculates upper bounds for the weight of paths leading back to `base_token`.
+
+        `bounds[k][token]` is the highest weight of a path from `token` to `base_token` having at most `k + 1`
+        edges. Tokens are allowed to repeat, so it is never lower than the weight of any simple path.
+        """
+        tokens = set(edges.keys()) | set(dst for target_edges in edges.values() for dst in target_edges)
+        best = {src: {dst: target_edges[dst][0][0] for dst in target_edges} for src, target_edges in edges.items()}
+
+        bounds = []
+        previous = {base_token: 0.0}
+        for _ in range(len(tokens)):
+            current = {}
+            for src, best_edges in best.items():
+                if src == base_token:
+                    continue
+                weights = [weight + previous[dst] for dst, weight in best_edges.items() if dst in previous]
+                weights.append(previous.get(src, -math.inf))
+                if max(weights) > -math.inf:
+                    current[src] = max(weights)
+            current[base_token] = 0.0
+            bounds.append(current)
+            previous = current
+
+        return bounds
+
+    @staticmethod
+    def _log(rate: Ray) -> float:
+        return math.log(rate.value) - math.log(Ray.ONE.value) if rate.value > 0 else -math.inf
+
+
+class IncrementalOpportunityFinder:
+    """Finds optimal opportunities block after block, recomputing only what has changed since the previous block.
+
+    The inputs of the search are fingerprinted: every pair of tokens gets a fingerprint made of the methods,
+    rates and maximum amounts of all the conversions between them. As the conversions are derived from the order
+    book and from the state of `Tub` and `Tap`, this covers new, taken and cancelled offers as well as any change
+    of `tag`, `jar_bid`/`jar_ask` or `Tap` prices. If neither any of the fingerprints nor `max_engagement` has changed,
+    the opportunities found previously are returned without any search. Otherwise only the routes going through
+    the pairs which have changed get optimized again, the results for the other ones are reused.
+
+    Attributes:
+        skipped: Number of times the search has been skipped entirely, as nothing has changed.
+        recomputed: Number of routes which have been optimized.
+        reused: Number of routes for which the previous result has been reused.
+    """
+    def __init__(self, base_token: Address, min_total_rate: Ray = Ray.ONE):
+        assert(isinstance(base_token, Address))
+        assert(isinstance(min_total_rate, Ray))
+        self.base_token = base_token
+        self.min_total_rate = min_total_rate
+        self.skipped = 0
+        self.recomputed = 0
+        self.reused = 0
+        self._fingerprints = {}
+        self._max_engagement = None
+        self._results = {}
+
+    def find_optimal_opportunities(self, conversions: List[Conversion], max_engagement: Wad) -> List[Sequence]:
+        """Finds the most profitable sequence of conversions for each route starting and ending with the base token.
+
+        Returns the same opportunities `OpportunityFinder.find_optimal_opportunities()` would return.
+
+        Args:
+            conversions: All the conversions available now.
+            max_engagement: Maximum amount of the base token to start each sequence with.
+
+        Returns:
+            List of sequences found, with the amounts already set. Shorter sequences go first.
+        """
+        assert(isinstance(conversions, list))
+        assert(isinstance(max_engagement, Wad))
+
+        fingerprints = self._fingerprint(conversions)
+        changed_pairs = set(pair for pair in set(fingerprints.keys()) | set(self._fingerprints.keys())
+                            if fingerprints.get(pair) != self._fingerprints.get(pair))
+
+        if len(changed_pairs) == 0 and max_engagement == self._max_engagement:
+            self.skipped += 1
+        else:
+            finder = OpportunityFinder(conversions)
+            results = {}
+            for route in finder.routes(self.base_token):
+                pairs = set((source_token.address, target_token.address) for source_token, target_token in zip(route, route[1:]))
+                if route in self._results and max_engagement == self._max_engagement and pairs.isdisjoint(changed_pairs):
+                    results[route] = self._results[route]
+                    self.reused += 1
+                else:
+                    results[route] = finder.optimize_route(route, max_engagement, self.min_total_rate)
+                    self.recomputed += 1
+
+            self._fingerprints = fingerprints
+            self._max_engagement = max_engagement
+            self._results = results
+
+        return [sequence for sequence in self._results.values() if sequence is not None]
+
+    @staticmethod
+    def _fingerprint(conversions: List[Conversion]) -> Dict[Tuple[str, str], frozenset]:
+        fingerprints = {}
+        for conversion in conversions:
+            pair = (conversion.source_token.address, conversion.target_token.address)
+            fingerprints.setdefault(pair, set()).add((conversion.method, conversion.rate.value, conversion.max_source_amount.value))
+        return {pair: frozenset(fingerprint) for pair, fingerprint in fingerprints.items()}
@@ -16,8 +16,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from api import Address
-from api.oasis import SimpleMarket
-from api.sai import Tub, Top, Tap
+from api.oasis import SimpleMarket, SimpleMarketOrderBook
+from api.sai import Tub, Top, Tap, CupIndex
+from api.storage import CupStorageReader, OfferStorageReader
 from api.token import ERC20Token, DSEthToken
 from keepers import Keeper
 
@@ -33,6 +34,8 @@ class SaiKeeper(Keeper):
         self.top = Top(web3=self.web3, address=self.top_address)
         self.otc_address = Address(self.config.get_contract_address("otc"))
         self.otc = SimpleMarket(web3=self.web3, address=self.otc_address)
+        self.order_book = SimpleMarketOrderBook(self.otc, OfferStorageReader(self.otc))
+        self.cup_index = CupIndex(self.tub, CupStorageReader(self.tub))
 
         self.skr = ERC20Token(web3=self.web3, address=self.tub.skr())
         self.sai = ERC20Token(web3=self.web3, address=self.tub.sai())
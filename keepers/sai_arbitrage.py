@@ -19,18 +19,20 @@
 
 import argparse
 import logging
+from itertools import permutations
 from typing import List
 
 from api import Address, Transfer
 from api.approval import via_tx_manager, directly
 from api.numeric import Ray
 from api.numeric import Wad
+from api.sai import TubState
 from api.token import ERC20Token
 from api.transact import Invocation, TxManager
 from keepers.conversion import Conversion
 from keepers.conversion import OasisTakeConversion
 from keepers.conversion import TubBoomConversion, TubBustConversion, TubExitConversion, TubJoinConversion
-from keepers.opportunity import OpportunityFinder, Sequence
+from keepers.opportunity import IncrementalOpportunityFinder, Sequence
 from keepers.sai import SaiKeeper
 from keepers.transfer_formatter import TransferFormatter
 
@@ -76,6 +78,8 @@ class SaiArbitrage(SaiKeeper):
             self.excluded_makers = set()
         self.max_errors = self.arguments.max_errors
         self.errors = 0
+        self.opportunity_finder = IncrementalOpportunityFinder(self.base_token.address,
+                                                               min_total_rate=Ray.from_number(1.000001))
 
         if self.arguments.tx_manager:
             self.tx_manager_address = Address(self.arguments.tx_manager)
@@ -110,6 +114,7 @@ class SaiArbitrage(SaiKeeper):
         self.approve()
         self.on_block(self.process_block)
         self.every(60*60, self.print_balances)
+        self.every(60*60, self.print_search_statistics)
 
     def print_balances(self):
         def balances():
@@ -117,6 +122,11 @@ class SaiArbitrage(SaiKeeper):
                 yield f"{token.balance_of(self.our_address)} {token.name()}"
         logging.info(f"Keeper balances are {', '.join(balances())}.")
 
+    def print_search_statistics(self):
+        logging.info(f"Opportunity search skipped {self.opportunity_finder.skipped} times as nothing has changed,"
+                     f" {self.opportunity_finder.recomputed} routes recomputed,"
+                     f" {self.opportunity_finder.reused} routes reused.")
+
     def approve(self):
         """Approve all components that need to access our balances"""
         approval_method = via_tx_manager(self.tx_manager) if self.tx_manager else directly()
@@ -126,16 +136,17 @@ class SaiArbitrage(SaiKeeper):
             self.tx_manager.approve([self.gem, self.sai, self.skr], directly())
 
     def tub_conversions(self) -> List[Conversion]:
-        return [TubJoinConversion(self.tub),
-                TubExitConversion(self.tub),
-                TubBoomConversion(self.tub, self.tap),
-                TubBustConversion(self.tub, self.tap)]
+        state = TubState.read(self.tub, self.tap)
+        return [TubJoinConversion(self.tub, state),
+                TubExitConversion(self.tub, state),
+                TubBoomConversion(self.tub, self.tap, state),
+                TubBustConversion(self.tub, self.tap, state)]
 
     def otc_offers(self, tokens):
-        return [offer for offer in self.otc.active_offers()
-                if offer.sell_which_token in tokens
-                and offer.buy_which_token in tokens
-                and offer.owner not in self.excluded_makers]
+        self.order_book.refresh()
+        return [offer for sell_which_token, buy_which_token in permutations(tokens, 2)
+                for offer in self.order_book.index.offers_for(sell_which_token, buy_which_token)
+                if offer.owner not in self.excluded_makers]
 
     def otc_conversions(self, tokens) -> List[Conversion]:
         return list(map(lambda offer: OasisTakeConversion(self.otc, offer), self.otc_offers(tokens)))
@@ -163,9 +174,7 @@ class SaiArbitrage(SaiKeeper):
     def profitable_opportunities(self):
         """Identify all profitable arbitrage opportunities within given limits."""
         entry_amount = Wad.min(self.base_token.balance_of(self.our_address), self.max_engagement)
-        opportunity_finder = OpportunityFinder(conversions=self.all_conversions())
-        opportunities = opportunity_finder.find_opportunities(self.base_token.address, entry_amount)
-        opportunities = filter(lambda op: op.total_rate() > Ray.from_number(1.000001), opportunities)
+        opportunities = self.opportunity_finder.find_optimal_opportunities(self.all_conversions(), entry_amount)
         opportunities = filter(lambda op: op.net_profit(self.base_token.address) > self.min_profit, opportunities)
         opportunities = sorted(opportunities, key=lambda op: op.net_profit(self.base_token.address), reverse=True)
         return opportunities
@@ -196,7 +205,11 @@ class SaiArbitrage(SaiKeeper):
         """Execute the opportunity step-by-step."""
         all_transfers = []
         for conversion in opportunity.steps:
-            receipt = conversion.execute()
+            transact = conversion.execute()
+            if not transact.simulate().successful:
+                logging.info(f"Not executing {conversion.name()} as the transaction would fail")
+                return
+            receipt = transact.transact(self.gas_price, self.nonce_manager)
             if receipt:
                 all_transfers += receipt.transfers
                 outgoing = TransferFormatter().format(filter(Transfer.outgoing(self.our_address), receipt.transfers))
@@ -211,7 +224,11 @@ class SaiArbitrage(SaiKeeper):
         """Execute the opportunity in one transaction, using the `tx_manager`."""
         tokens = [self.sai.address, self.skr.address, self.gem.address]
         invocations = list(map(lambda conv: Invocation(conv.address(), conv.calldata()), opportunity.steps))
-        receipt = self.tx_manager.execute(tokens, invocations).transact()
+        transact = self.tx_manager.execute(tokens, invocations)
+        if not transact.simulate().successful:
+            logging.info("Not executing the opportunity as the transaction would fail")
+            return
+        receipt = transact.transact(self.gas_price, self.nonce_manager)
         if receipt:
             logging.info(f"The profit we made is {TransferFormatter().format_net(receipt.transfers, self.our_address)}.")
         else:
@@ -17,6 +17,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+
+from api.risk import RiskEngine, LiquidationQueue
 from keepers.sai import SaiKeeper
 
 
@@ -31,15 +34,20 @@ class SaiBite(SaiKeeper):
     """
 
     def startup(self):
+        self.liquidation_queue = LiquidationQueue(self.cup_index)
         self.on_block(self.check_all_cups)
 
     def check_all_cups(self):
-        for cup_id in range(self.tub.cupi()):
-            self.check_cup(cup_id+1)
+        for risk in self.liquidation_queue.unsafe(RiskEngine.for_tub(self.tub)):
+            self.check_cup(risk.cup.cup_id)
 
     def check_cup(self, cup_id):
         if not self.tub.safe(cup_id):
-            self.tub.bite(cup_id)
+            bite = self.tub.bite(cup_id)
+            if bite.simulate().successful:
+                bite.transact(self.gas_price, self.nonce_manager)
+            else:
+                logging.info(f"Not biting cup {cup_id} as the transaction would fail")
 
 
 if __name__ == '__main__':
@@ -18,8 +18,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
-import operator
-from functools import reduce
 from itertools import chain
 from typing import List
 
@@ -27,7 +25,7 @@ import logging
 
 from api.approval import directly
 from api.feed import DSValue
-from api.numeric import Wad
+from api.numeric import Wad, WadArray
 from api.oasis import OfferInfo
 from api.util import synchronize
 from keepers.sai import SaiKeeper
@@ -62,6 +60,7 @@ class SaiMakerOtc(SaiKeeper):
         self.min_margin = self.arguments.min_margin
         self.avg_margin = self.arguments.avg_margin
         self.max_margin = self.arguments.max_margin
+        self._price_feed = None
 
     def args(self, parser: argparse.ArgumentParser):
         parser.add_argument("--min-margin", help="Minimum margin allowed", type=float, required=True)
@@ -78,7 +77,8 @@ class SaiMakerOtc(SaiKeeper):
         self.every(60*60, self.print_balances)
 
     def shutdown(self):
-        self.cancel_offers(self.our_offers(self.otc.active_offers()))
+        self.order_book.refresh()
+        self.cancel_offers(self.order_book.index.offers_owned_by(self.our_address))
 
     def print_balances(self):
         def balances():
@@ -90,77 +90,82 @@ class SaiMakerOtc(SaiKeeper):
         """Approve OasisDEX to access our balances, so we can place orders."""
         self.otc.approve([self.gem, self.sai], directly())
 
-    def our_offers(self, active_offers: list):
-        return list(filter(lambda offer: offer.owner == self.our_address, active_offers))
+    def our_buy_offers(self):
+        return self.order_book.index.offers_owned_by(self.our_address, sell_which_token=self.gem.address,
+                                                     buy_which_token=self.sai.address)
 
-    def our_buy_offers(self, active_offers: list):
-        return list(filter(lambda offer: offer.buy_which_token == self.sai.address and
-                                         offer.sell_which_token == self.gem.address, self.our_offers(active_offers)))
-
-    def our_sell_offers(self, active_offers: list):
-        return list(filter(lambda offer: offer.buy_which_token == self.gem.address and
-                                         offer.sell_which_token == self.sai.address, self.our_offers(active_offers)))
+    def our_sell_offers(self):
+        return self.order_book.index.offers_owned_by(self.our_address, sell_which_token=self.sai.address,
+                                                     buy_which_token=self.gem.address)
 
     def synchronize_offers(self):
         """Update our positions in the order book to reflect keeper parameters."""
-        active_offers = self.otc.active_offers()
-        self.cancel_offers(chain(self.excessive_buy_offers(active_offers),
-                                 self.excessive_sell_offers(active_offers)))
-        self.create_new_offers(active_offers)
+        self.order_book.refresh()
+        target_rate = self.target_rate()
+        self.cancel_offers(chain(self.excessive_buy_offers(target_rate), self.excessive_sell_offers(target_rate)))
+        self.create_new_offers(target_rate)
 
-    def excessive_buy_offers(self, active_offers: list):
+    def excessive_buy_offers(self, target_rate: Wad):
         """Return buy offers with rates outside allowed margin range."""
-        for offer in self.our_buy_offers(active_offers):
+        rate_min = self.apply_buy_margin(target_rate, self.min_margin)
+        rate_max = self.apply_buy_margin(target_rate, self.max_margin)
+        for offer in self.our_buy_offers():
             rate = self.rate_buy(offer)
-            rate_min = self.apply_buy_margin(self.target_rate(), self.min_margin)
-            rate_max = self.apply_buy_margin(self.target_rate(), self.max_margin)
             if (rate < rate_max) or (rate > rate_min):
                 yield offer
 
-    def excessive_sell_offers(self, active_offers: list):
+    def excessive_sell_offers(self, target_rate: Wad):
         """Return sell offers with rates outside allowed margin range."""
-        for offer in self.our_sell_offers(active_offers):
+        rate_min = self.apply_sell_margin(target_rate, self.min_margin)
+        rate_max = self.apply_sell_margin(target_rate, self.max_margin)
+        for offer in self.our_sell_offers():
             rate = self.rate_sell(offer)
-            rate_min = self.apply_sell_margin(self.target_rate(), self.min_margin)
-            rate_max = self.apply_sell_margin(self.target_rate(), self.max_margin)
             if (rate < rate_min) or (rate > rate_max):
                 yield offer
 
     def cancel_offers(self, offers):
         """Cancel offers asynchronously."""
-        synchronize([self.otc.kill(offer.offer_id).transact_async() for offer in offers])
+        synchronize([self.otc.kill(offer.offer_id).transact_async(self.gas_price, self.nonce_manager)
+                     for offer in offers])
 
-    def create_new_offers(self, active_offers: list):
+    def create_new_offers(self, target_rate: Wad):
         """Asynchronously create new buy and sell offers if necessary."""
-        synchronize([transact.transact_async() for transact in chain(self.new_buy_offer(active_offers),
-                                                                     self.new_sell_offer(active_offers))])
+        synchronize([transact.transact_async(self.gas_price, self.nonce_manager)
+                     for transact in chain(self.new_buy_offer(target_rate), self.new_sell_offer(target_rate))])
 
-    def new_buy_offer(self, active_offers: list):
+    def new_buy_offer(self, target_rate: Wad):
         """If our WETH engagement is below the minimum amount, yield a new offer up to the maximum amount."""
-        total_amount = self.total_amount(self.our_buy_offers(active_offers))
+        total_amount = self.total_amount(self.our_buy_offers())
         if total_amount < self.min_weth_amount:
             our_balance = self.gem.balance_of(self.our_address)
             have_amount = Wad.min(self.max_weth_amount - total_amount, our_balance)
-            if have_amount > Wad(0):
-                want_amount = have_amount / self.apply_buy_margin(self.target_rate(), self.avg_margin)
+            if have_amount > Wad.ZERO:
+                want_amount = have_amount / self.apply_buy_margin(target_rate, self.avg_margin)
                 yield self.otc.make(have_token=self.gem.address, have_amount=have_amount,
                                     want_token=self.sai.address, want_amount=want_amount)
 
-    def new_sell_offer(self, active_offers: list):
+    def new_sell_offer(self, target_rate: Wad):
         """If our SAI engagement is below the minimum amount, yield a new offer up to the maximum amount."""
-        total_amount = self.total_amount(self.our_sell_offers(active_offers))
+        total_amount = self.total_amount(self.our_sell_offers())
         if total_amount < self.min_sai_amount:
             our_balance = self.sai.balance_of(self.our_address)
             have_amount = Wad.min(self.max_sai_amount - total_amount, our_balance)
-            if have_amount > Wad(0):
-                want_amount = have_amount * self.apply_sell_margin(self.target_rate(), self.avg_margin)
+            if have_amount > Wad.ZERO:
+                want_amount = have_amount * self.apply_sell_margin(target_rate, self.avg_margin)
                 yield self.otc.make(have_token=self.sai.address, have_amount=have_amount,
                                     want_token=self.gem.address, want_amount=want_amount)
 
     def target_rate(self) -> Wad:
-        ref_per_gem = Wad(DSValue(web3=self.web3, address=self.tub.pip()).read_as_int())
+        ref_per_gem = Wad(self.price_feed().read_as_int())
         return self.tub.par() / ref_per_gem
 
+    def price_feed(self) -> DSValue:
+        """Return the GEM price feed, only creating a new `DSValue` if the `Tub` has switched to another feed."""
+        pip = self.tub.pip()
+        if self._price_feed is None or self._price_feed.address != pip:
+            self._price_feed = DSValue(web3=self.web3, address=pip)
+        return self._price_feed
+
     @staticmethod
     def rate_buy(offer: OfferInfo) -> Wad:
         return offer.sell_how_much / offer.buy_how_much
@@ -171,7 +176,7 @@ class SaiMakerOtc(SaiKeeper):
 
     @staticmethod
     def total_amount(offers: List[OfferInfo]):
-        return reduce(operator.add, map(lambda offer: offer.sell_how_much, offers), Wad(0))
+        return WadArray(offer.sell_how_much for offer in offers).sum()
 
     @staticmethod
     def apply_buy_margin(rate: Wad, margin: float) -> Wad:
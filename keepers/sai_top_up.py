@@ -24,6 +24,8 @@ import logging
 from api.approval import directly
 from api.numeric import Ray
 from api.numeric import Wad
+from api.risk import RiskEngine, CupRisk
+from api.sai import TubState
 from keepers.sai import SaiKeeper
 
 
@@ -54,30 +56,28 @@ class SaiTopUp(SaiKeeper):
         self.tub.approve(directly())
 
     def check_all_cups(self):
-        for cup in self.our_cups():
-            self.check_cup(cup)
+        engine = RiskEngine.from_state(TubState.read(self.tub, self.tap))
+        for risk in engine.evaluate(self.our_cups()):
+            self.check_cup(risk, engine.tag)
 
-    def check_cup(self, cup):
-        top_up_amount = self.required_top_up(cup)
+    def check_cup(self, risk: CupRisk, tag: Wad):
+        top_up_amount = self.required_top_up(risk, tag)
         if top_up_amount:
             if top_up_amount >= self.skr.balance_of(self.our_address):
-                self.tub.lock(cup.cup_id, top_up_amount)
+                self.tub.lock(risk.cup.cup_id, top_up_amount)
             else:
                 logging.info(f"Cannot top-up as our balance is less than {top_up_amount} SKR.")
 
     def our_cups(self):
-        for cup_id in range(1, self.tub.cupi()+1):
-            cup = self.tub.cups(cup_id)
-            if cup.lad == self.our_address:
-                yield cup
-
-    def required_top_up(self, cup):
-        pro = cup.ink*self.tub.tag()
-        tab = self.tub.tab(cup.cup_id)
-        if tab > Wad(0):
-            current_ratio = Ray(pro / tab)
+        return self.cup_index.cups_of(self.our_address)
+
+    def required_top_up(self, risk: CupRisk, tag: Wad):
+        # `risk.ratio` takes `par` into account, this keeper has always compared `ink * tag / tab` instead
+        pro = risk.cup.ink * tag
+        if risk.tab > Wad.ZERO:
+            current_ratio = Ray(pro / risk.tab)
             if current_ratio < self.minimum_ratio:
-                return tab * (Wad(self.target_ratio - current_ratio) / self.tub.tag())
+                return risk.tab * (Wad(self.target_ratio - current_ratio) / tag)
             else:
                 return None
         else:
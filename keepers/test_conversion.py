@@ -21,7 +21,7 @@ from api import Address
 from api.numeric import Ray
 from api.numeric import Wad
 from api.token import ERC20Token
-from keepers.conversion import Conversion
+from keepers.conversion import Conversion, Step
 
 
 @pytest.fixture(autouse=True)
@@ -51,9 +51,8 @@ def test_nicely_convert_to_string_without_amounts(token1, token2):
 def test_nicely_convert_to_string_with_amounts(token1, token2):
     # given
     conversion = Conversion(token1, token2, Ray.from_number(1.01), Wad.from_number(1000), 'met()')
-    conversion.source_amount = Wad.from_number(50)
-    conversion.target_amount = Wad.from_number(50.5)
+    step = Step(conversion, Wad.from_number(50), Wad.from_number(50.5))
 
     # expect
-    assert str(conversion) == "[50.000000000000000000 TK1 -> 50.500000000000000000 TK2 @1.010000000000000000000000000" \
+    assert str(step) == "[50.000000000000000000 TK1 -> 50.500000000000000000 TK2 @1.010000000000000000000000000" \
                               " by met() (max=1000.000000000000000000 TK1)]"
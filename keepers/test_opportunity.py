@@ -15,13 +15,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from random import Random
+
 import pytest
 
 from api import Address
 from api.numeric import Ray
 from api.numeric import Wad
 from keepers.conversion import Conversion
-from keepers.opportunity import Sequence, OpportunityFinder
+from keepers.opportunity import Sequence, OpportunityFinder, RouteOptimizer, IncrementalOpportunityFinder
 
 
 class TestSequence:
@@ -47,14 +49,14 @@ class TestSequence:
     def test_should_calculate_profit_and_net_profit(self, token1, token2):
         # given
         step1 = Conversion(token1, token2, Ray.from_number(1.01), Wad.from_number(1000), 'met1')
-        step1.source_amount = Wad.from_number(100)
-        step1.target_amount = Wad.from_number(101)
         step2 = Conversion(token2, token1, Ray.from_number(1.02), Wad.from_number(1000), 'met2')
-        step2.source_amount = Wad.from_number(101)
-        step2.target_amount = Wad.from_number(103.02)
 
         # when
         sequence = Sequence([step1, step2])
+        sequence.steps[0].source_amount = Wad.from_number(100)
+        sequence.steps[0].target_amount = Wad.from_number(101)
+        sequence.steps[1].source_amount = Wad.from_number(101)
+        sequence.steps[1].target_amount = Wad.from_number(103.02)
 
         # then
         assert sequence.profit(token1) == Wad.from_number(3.02)
@@ -62,6 +64,23 @@ class TestSequence:
         assert sequence.net_profit(token1) == sequence.profit(token1) - sequence.tx_costs()
         assert sequence.net_profit(token2) == sequence.profit(token2) - sequence.tx_costs()
 
+    def test_should_share_conversions_between_sequences(self, token1, token2):
+        # given
+        step1 = Conversion(token1, token2, Ray.from_number(1.01), Wad.from_number(1000), 'met1')
+        step2 = Conversion(token2, token1, Ray.from_number(1.02), Wad.from_number(1000), 'met2')
+
+        # when
+        sequence1 = Sequence([step1, step2])
+        sequence1.set_amounts(Wad.from_number(100))
+        sequence2 = Sequence([step1, step2])
+        sequence2.set_amounts(Wad.from_number(10))
+
+        # then
+        assert sequence1.steps[0].conversion is sequence2.steps[0].conversion is step1
+        assert sequence1.steps[1].conversion is sequence2.steps[1].conversion is step2
+        assert sequence1.steps[0].source_amount == Wad.from_number(100)
+        assert sequence2.steps[0].source_amount == Wad.from_number(10)
+
     def test_should_calculate_tx_costs(self, token1):
         # expect the tx_costs to be non negative and to increase with the number of steps
         steps = []
@@ -246,3 +265,259 @@ class TestOpportunityFinder:
         assert opportunities[0].steps[3].method == "met4"
         assert opportunities[0].steps[3].source_amount == Wad.from_number(120)
         assert opportunities[0].steps[3].target_amount == Wad.from_number(132)
+
+    def test_should_only_return_opportunities_above_min_total_rate(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token1, Ray.from_number(0.95), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token2, token3, Ray.from_number(1.2), Wad.from_number(10000), 'met4')
+        conversion5 = Conversion(token3, token1, Ray.from_number(0.8), Wad.from_number(10000), 'met5')
+        conversions = [conversion1, conversion2, conversion3, conversion4, conversion5]
+        base_token = token1
+
+        # when
+        opportunities = OpportunityFinder(conversions).find_opportunities(base_token, Wad.from_number(100),
+                                                                          min_total_rate=Ray.from_number(1.0))
+
+        # then
+        assert len(opportunities) == 2
+        assert [step.method for step in opportunities[0].steps] == ["met1", "met3"]
+        assert [step.method for step in opportunities[1].steps] == ["met1", "met4", "met5"]
+
+    def test_should_find_the_same_opportunities_as_exhaustive_search(self, token1, token2, token3, token4):
+        # given
+        random = Random(17)
+        tokens = [token1, token2, token3, token4]
+        conversions = [Conversion(source_token, target_token, Ray.from_number(random.uniform(0.8, 1.2)),
+                                  Wad.from_number(10000), f"met{i}")
+                       for i, (source_token, target_token) in enumerate((random.choice(tokens), random.choice(tokens))
+                                                                        for _ in range(40))
+                       if source_token != target_token]
+        finder = OpportunityFinder(conversions)
+
+        # when
+        opportunities = finder.find_opportunities(token1, Wad.from_number(100), min_total_rate=Ray.from_number(1.1))
+
+        # then
+        expected = [opportunity for opportunity in finder.find_opportunities(token1, Wad.from_number(100))
+                    if opportunity.total_rate() > Ray.from_number(1.1)]
+        assert len(opportunities) > 0
+        assert sorted(self.methods(opportunities)) == sorted(self.methods(expected))
+
+    @staticmethod
+    def methods(opportunities):
+        return [tuple(step.method for step in opportunity.steps) for opportunity in opportunities]
+
+    def test_should_find_optimal_opportunity_using_multiple_conversions_at_each_hop(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met1')
+        conversion2 = Conversion(token1, token2, Ray.from_number(1.05), Wad.from_number(50), 'met2')
+        conversion3 = Conversion(token1, token2, Ray.from_number(0.9), Wad.from_number(50), 'met3')
+        conversion4 = Conversion(token2, token1, Ray.from_number(1.0), Wad.from_number(1000), 'met4')
+        conversions = [conversion1, conversion2, conversion3, conversion4]
+        base_token = token1
+
+        # when
+        opportunities = OpportunityFinder(conversions).find_optimal_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 1
+        assert self.methods(opportunities) == [("met1", "met2", "met4")]
+        assert opportunities[0].profit(token1) == Wad.from_number(3.5)
+
+    def test_should_not_find_optimal_opportunities_if_best_conversions_are_not_profitable(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(0.9), Wad.from_number(1000), 'met2')
+        conversions = [conversion1, conversion2]
+        base_token = token1
+
+        # when
+        opportunities = OpportunityFinder(conversions).find_optimal_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 0
+
+
+class TestRouteOptimizer:
+    @pytest.fixture
+    def token1(self):
+        return Address('0x0101010101010101010101010101010101010101')
+
+    @pytest.fixture
+    def token2(self):
+        return Address('0x0202020202020202020202020202020202020202')
+
+    def test_should_take_offers_best_rate_first(self, token1, token2):
+        # given
+        offer1 = Conversion(token1, token2, Ray.from_number(1.05), Wad.from_number(50), 'met1')
+        offer2 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met2')
+        join = Conversion(token2, token1, Ray.from_number(1.0), Wad.from_number(1000), 'met3')
+
+        # when
+        sequence = RouteOptimizer([[offer1, offer2], [join]]).optimize(Wad.from_number(100))
+
+        # then
+        assert [step.method for step in sequence.steps] == ["met2", "met1", "met3"]
+        assert [step.source_amount for step in sequence.steps] == [Wad.from_number(10), Wad.from_number(50), Wad.from_number(63.5)]
+        assert [step.target_amount for step in sequence.steps] == [Wad.from_number(11), Wad.from_number(52.5), Wad.from_number(63.5)]
+        assert sequence.total_rate() == Ray.from_number(63.5) / Ray.from_number(60)
+
+    def test_should_stop_when_marginal_rate_is_not_profitable(self, token1, token2):
+        # given
+        offer1 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met1')
+        offer2 = Conversion(token1, token2, Ray.from_number(0.9), Wad.from_number(50), 'met2')
+        join = Conversion(token2, token1, Ray.from_number(1.05), Wad.from_number(1000), 'met3')
+
+        # when
+        sequence = RouteOptimizer([[offer1, offer2], [join]]).optimize(Wad.from_number(100))
+
+        # then
+        assert [step.method for step in sequence.steps] == ["met1", "met3"]
+        assert sequence.steps[0].source_amount == Wad.from_number(10)
+        assert sequence.steps[1].target_amount == Wad.from_number(11.55)
+
+    def test_should_not_engage_more_than_max_engagement(self, token1, token2):
+        # given
+        offer1 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met1')
+        offer2 = Conversion(token1, token2, Ray.from_number(1.05), Wad.from_number(50), 'met2')
+        join = Conversion(token2, token1, Ray.from_number(1.0), Wad.from_number(1000), 'met3')
+
+        # when
+        sequence = RouteOptimizer([[offer1, offer2], [join]]).optimize(Wad.from_number(5))
+
+        # then
+        assert [step.method for step in sequence.steps] == ["met1", "met3"]
+        assert sequence.steps[0].source_amount == Wad.from_number(5)
+        assert sequence.profit(token1) == Wad.from_number(0.5)
+
+    def test_should_respect_depth_of_later_hops(self, token1, token2):
+        # given
+        tub_exit = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(100), 'met1')
+        offer1 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(30), 'met2')
+        offer2 = Conversion(token2, token1, Ray.from_number(0.55), Wad.from_number(1000), 'met3')
+
+        # when
+        sequence = RouteOptimizer([[tub_exit], [offer1, offer2]]).optimize(Wad.from_number(50))
+
+        # then
+        assert [step.method for step in sequence.steps] == ["met1", "met2", "met3"]
+        assert [step.source_amount for step in sequence.steps] == [Wad.from_number(50), Wad.from_number(30), Wad.from_number(70)]
+        assert sequence.profit(token1) == Wad.from_number(6.5)
+
+    def test_should_skip_thin_offers_not_covering_their_transaction_costs(self, token1, token2):
+        # given
+        offer1 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met1')
+        offer2 = Conversion(token1, token2, Ray.from_number(1.05), Wad.from_number(1), 'met2')
+        offer3 = Conversion(token1, token2, Ray.from_number(1.04), Wad.from_number(100), 'met3')
+        join = Conversion(token2, token1, Ray.from_number(1.0), Wad.from_number(1000), 'met4')
+
+        # when
+        sequence = RouteOptimizer([[offer1, offer2], [join]]).optimize(Wad.from_number(100))
+
+        # then
+        assert [step.method for step in sequence.steps] == ["met1", "met4"]
+        assert sequence.net_profit(token1) == Wad.from_number(0.5)
+
+        # when
+        sequence = RouteOptimizer([[offer1, offer2, offer3], [join]]).optimize(Wad.from_number(100))
+
+        # then
+        assert [step.method for step in sequence.steps] == ["met1", "met2", "met3", "met4"]
+        assert sequence.net_profit(token1) == Wad.from_number(3.61)
+
+    def test_should_return_none_if_route_is_not_profitable(self, token1, token2):
+        # given
+        offer = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met1')
+        join = Conversion(token2, token1, Ray.from_number(0.9), Wad.from_number(1000), 'met2')
+
+        # expect
+        assert RouteOptimizer([[offer], [join]]).optimize(Wad.from_number(100)) is None
+
+
+class TestIncrementalOpportunityFinder:
+    @pytest.fixture
+    def token1(self):
+        return Address('0x0101010101010101010101010101010101010101')
+
+    @pytest.fixture
+    def token2(self):
+        return Address('0x0202020202020202020202020202020202020202')
+
+    @pytest.fixture
+    def token3(self):
+        return Address('0x0303030303030303030303030303030303030303')
+
+    @pytest.fixture
+    def conversions(self, token1, token2, token3):
+        return [Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10), 'met1'),
+                Conversion(token2, token1, Ray.from_number(1.0), Wad.from_number(1000), 'met2'),
+                Conversion(token1, token3, Ray.from_number(0.9), Wad.from_number(1000), 'met3'),
+                Conversion(token3, token1, Ray.from_number(1.2), Wad.from_number(20), 'met4'),
+                Conversion(token2, token3, Ray.from_number(0.95), Wad.from_number(1000), 'met5'),
+                Conversion(token3, token2, Ray.from_number(1.0), Wad.from_number(1000), 'met6')]
+
+    def test_should_find_the_same_opportunities_as_opportunity_finder(self, token1, conversions):
+        # given
+        finder = IncrementalOpportunityFinder(token1)
+
+        # when
+        opportunities = finder.find_optimal_opportunities(conversions, Wad.from_number(100))
+
+        # then
+        expected = OpportunityFinder(conversions).find_optimal_opportunities(token1, Wad.from_number(100))
+        assert len(opportunities) == 3
+        assert self.amounts(opportunities) == self.amounts(expected)
+        assert finder.recomputed == 4
+        assert finder.skipped == 0
+
+    def test_should_skip_the_search_if_nothing_has_changed(self, token1, conversions):
+        # given
+        finder = IncrementalOpportunityFinder(token1)
+        opportunities = finder.find_optimal_opportunities(conversions, Wad.from_number(100))
+
+        # when
+        conversions = [Conversion(c.source_token, c.target_token, c.rate, c.max_source_amount, c.method)
+                       for c in conversions]
+        opportunities_again = finder.find_optimal_opportunities(conversions, Wad.from_number(100))
+
+        # then
+        assert self.amounts(opportunities_again) == self.amounts(opportunities)
+        assert finder.skipped == 1
+        assert finder.recomputed == 4
+
+    def test_should_recompute_only_routes_going_through_changed_pairs(self, token1, token2, token3, conversions):
+        # given
+        finder = IncrementalOpportunityFinder(token1)
+        finder.find_optimal_opportunities(conversions, Wad.from_number(100))
+
+        # when
+        conversions = conversions + [Conversion(token2, token3, Ray.from_number(1.5), Wad.from_number(5), 'met7')]
+        opportunities = finder.find_optimal_opportunities(conversions, Wad.from_number(100))
+
+        # then
+        expected = OpportunityFinder(conversions).find_optimal_opportunities(token1, Wad.from_number(100))
+        assert self.amounts(opportunities) == self.amounts(expected)
+        assert finder.skipped == 0
+        assert finder.recomputed == 5
+        assert finder.reused == 3
+
+    def test_should_recompute_all_routes_if_max_engagement_has_changed(self, token1, conversions):
+        # given
+        finder = IncrementalOpportunityFinder(token1)
+        finder.find_optimal_opportunities(conversions, Wad.from_number(100))
+
+        # when
+        opportunities = finder.find_optimal_opportunities(conversions, Wad.from_number(5))
+
+        # then
+        expected = OpportunityFinder(conversions).find_optimal_opportunities(token1, Wad.from_number(5))
+        assert self.amounts(opportunities) == self.amounts(expected)
+        assert finder.recomputed == 8
+        assert finder.reused == 0
+
+    @staticmethod
+    def amounts(opportunities):
+        return [[(step.method, step.source_amount, step.target_amount) for step in opportunity.steps]
+                for opportunity in opportunities]
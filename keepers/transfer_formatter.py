@@ -26,7 +26,7 @@ from api.numeric import Wad
 
 class TransferFormatter:
     def _sum(self, wads):
-        return reduce(Wad.__add__, wads, Wad.from_number(0))
+        return reduce(Wad.__add__, wads, Wad.ZERO)
 
     def _sum_by_token(self, transfers: list):
         transfers.sort(key=lambda transfer: transfer.token_address, reverse=False)
@@ -36,19 +36,19 @@ class TransferFormatter:
 
     def _net_value(self, transfer: Transfer, our_address: Address):
         if transfer.from_address == our_address and transfer.to_address == our_address:
-            return Wad(0)
+            return Wad.ZERO
         elif transfer.from_address == our_address:
-            return Wad(0) - transfer.value
+            return Wad.ZERO - transfer.value
         elif transfer.to_address == our_address:
             return transfer.value
         else:
-            return Wad(0)
+            return Wad.ZERO
 
     def _net_by_token(self, transfers: list, our_address: Address):
         transfers.sort(key=lambda transfer: transfer.token_address, reverse=False)
         for token_address, transfers in itertools.groupby(transfers, lambda transfer: transfer.token_address):
             total = self._sum(map(lambda transfer: self._net_value(transfer, our_address), transfers))
-            if total != Wad(0):
+            if total != Wad.ZERO:
                 yield f"{total} {ERC20Token.token_name_by_address(token_address)}"
 
     def _join_with_and(self, iterable: Iterable):